@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive ordering of the extraction rules based on their recent yield.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import logging
+import random
+import threading
+
+from collections import deque
+
+# own
+from .settings import ADAPTIVE_EXPLORATION, ADAPTIVE_MIN_SAMPLES, ADAPTIVE_THRESHOLD, ADAPTIVE_WINDOW
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RuleStats(object):
+    """Outcomes and costs of a rule over the last documents"""
+
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)
+        self.total_hits = 0
+        self.total_cost = 0
+
+    def record(self, hit, cost):
+        # keep running sums of the window
+        if len(self.outcomes) == self.outcomes.maxlen:
+            oldhit, oldcost = self.outcomes[0]
+            self.total_hits -= oldhit
+            self.total_cost -= oldcost
+        self.outcomes.append((hit, cost))
+        self.total_hits += hit
+        self.total_cost += cost
+
+    @property
+    def samples(self):
+        return len(self.outcomes)
+
+    @property
+    def hit_rate(self):
+        return self.total_hits / self.samples if self.samples else 0.0
+
+    @property
+    def cost(self):
+        """Average cost in milliseconds"""
+        return self.total_cost / self.samples * 1000 if self.samples else 0.0
+
+    @property
+    def value(self):
+        """Expected hits per millisecond"""
+        return self.hit_rate / max(self.cost, 0.001)
+
+
+class AdaptiveController(object):
+    """
+    Reorder the rules according to their expected value per millisecond and skip
+    the ones below a threshold, all rules run in default order for a share of the
+    documents to keep the statistics up to date
+
+    :param rules:
+        Number of rules (e.g. len(DATE_EXPRESSIONS))
+    :type rules: integer
+    :param window:
+        Number of recent documents taken into account for each rule
+    :type window: integer
+    :param min_samples:
+        Number of observations before a rule can be moved or skipped
+    :type min_samples: integer
+    :param exploration:
+        Share of documents on which all rules run in default order
+    :type exploration: float
+    :param threshold:
+        Expected hits per millisecond below which a rule is skipped
+    :type threshold: float
+    :param seed:
+        Seed of the random generator deciding on exploration, for reproducible runs
+
+    """
+
+    def __init__(self, rules, window=ADAPTIVE_WINDOW, min_samples=ADAPTIVE_MIN_SAMPLES,
+                 exploration=ADAPTIVE_EXPLORATION, threshold=ADAPTIVE_THRESHOLD, seed=None):
+        self.rules = [RuleStats(window) for _ in range(rules)]
+        self.min_samples = min_samples
+        self.exploration = exploration
+        self.threshold = threshold
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.explorations = 0
+
+    def _skipped(self, stats):
+        return stats.samples >= self.min_samples and stats.value < self.threshold
+
+    def order(self):
+        """Return the indices of the rules to run on the next document"""
+        with self.lock:
+            self.documents += 1
+            if self.random.random() < self.exploration:
+                self.explorations += 1
+                return list(range(len(self.rules)))
+            ranked = [i for i, stats in enumerate(self.rules) if not self._skipped(stats)]
+            # rules lacking observations follow in default order, they are observed during exploration
+            return sorted(ranked, key=lambda i: (0, -self.rules[i].value) if self.rules[i].samples >= self.min_samples else (1, 0))
+
+    def record(self, rule, hit, cost):
+        """Record the outcome of a rule (True if it found the date) and its cost in seconds"""
+        with self.lock:
+            skipped = self._skipped(self.rules[rule])
+            self.rules[rule].record(int(hit), cost)
+            if self._skipped(self.rules[rule]) is not skipped:
+                LOGGER.debug('rule %s %s: %.4f hits/ms', rule, 'skipped' if not skipped else 'restored', self.rules[rule].value)
+
+    def stats(self):
+        """Export the statistics and decisions for each rule"""
+        with self.lock:
+            return {
+                'documents': self.documents,
+                'explorations': self.explorations,
+                'rules': [
+                    {
+                        'rule': i,
+                        'samples': stats.samples,
+                        'hit_rate': stats.hit_rate,
+                        'cost_ms': stats.cost,
+                        'value': stats.value,
+                        'skipped': self._skipped(stats),
+                    }
+                    for i, stats in enumerate(self.rules)
+                ],
+            }
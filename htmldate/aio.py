@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous download and extraction for asyncio-based applications (Python 3.7+).
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import asyncio
+import functools
+import logging
+import sys
+
+if sys.version_info < (3, 7):
+    raise ImportError('htmldate.aio requires Python 3.7+')
+
+# third-party, optional
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# own
+from .core import find_date
+from .settings import ASYNC_CONCURRENCY, MAX_FILE_SIZE
+from .metrics import METRICS
+from .utils import decode_content, fetch_url, record_fetch_error
+
+
+LOGGER = logging.getLogger(__name__)
+
+# session and semaphore used when fetch_url_async is called without them, bound to an event loop
+SHARED = {'loop': None, 'session': None, 'semaphore': None}
+
+
+def make_session(concurrency=ASYNC_CONCURRENCY):
+    """Create a pooled aiohttp session (None if aiohttp is not installed)"""
+    if aiohttp is None:
+        return None
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+
+
+async def _fetch_with_session(url, session):
+    """Download a page with aiohttp and run the same checks as fetch_url"""
+    if METRICS.enabled is True:
+        METRICS.inc('htmldate_fetches_total')
+    try:
+        async with session.get(url, allow_redirects=True) as response:
+            if response.status != 200:
+                LOGGER.error('not a 200 response: %s', response.status)
+                record_fetch_error('status')
+                return None
+            content = await response.read()
+            encoding = response.get_encoding()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+        LOGGER.error('connection: %s %s', url, err)
+        record_fetch_error('connection')
+        return None
+    if len(content) < 100:
+        LOGGER.error('file too small/incorrect response: %s %s', url, len(content))
+        record_fetch_error('too_small')
+        return None
+    if len(content) > MAX_FILE_SIZE:
+        LOGGER.error('file too large: %s %s', url, len(content))
+        record_fetch_error('too_large')
+        return None
+    htmltext = decode_content(content, encoding)
+    if htmltext is None:
+        htmltext = content.decode(encoding, errors='replace')
+    return htmltext
+
+
+def discard_session(session, loop):
+    """Close a shared session left by another event loop (close_shared_session was not called)"""
+    if session is None or session.closed:
+        return
+    LOGGER.warning('shared session of a previous event loop discarded, call close_shared_session() before the loop stops')
+    # still running in another thread
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+        return
+    # the loop is stopped and cannot close the connections anymore, they are left to the garbage collector
+    session.detach()
+
+
+def shared_resources():
+    """Return the session and the semaphore shared within the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    if SHARED['loop'] is not loop or (SHARED['session'] is not None and SHARED['session'].closed):
+        if SHARED['loop'] is not loop:
+            discard_session(SHARED['session'], SHARED['loop'])
+        SHARED['loop'] = loop
+        SHARED['semaphore'] = asyncio.Semaphore(ASYNC_CONCURRENCY)
+        SHARED['session'] = make_session()
+    return SHARED['session'], SHARED['semaphore']
+
+
+async def close_shared_session():
+    """Close the session shared by the calls of fetch_url_async, required before the event loop stops"""
+    session = SHARED['session']
+    SHARED['loop'], SHARED['session'], SHARED['semaphore'] = None, None, None
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def fetch_url_async(url, session=None, semaphore=None):
+    """
+    Fetch a page without blocking the event loop
+
+    :param url:
+        URL of the page to fetch
+    :type url: string
+    :param session:
+        aiohttp session holding the connection pool (see make_session), by
+        default a session shared within the event loop (see close_shared_session),
+        if aiohttp is not installed fetch_url runs in the default executor
+    :param semaphore:
+        asyncio.Semaphore limiting the number of concurrent downloads, by
+        default one shared within the event loop (ASYNC_CONCURRENCY)
+    :return: Returns the HTML text or None
+
+    """
+    if session is None or semaphore is None:
+        shared_session, shared_semaphore = shared_resources()
+        session = session or shared_session
+        semaphore = semaphore or shared_semaphore
+    async with semaphore:
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(None, fetch_url, url)
+        return await _fetch_with_session(url, session)
+
+
+async def find_date_async(htmlobject, executor=None, **kwargs):
+    """
+    Run find_date in an executor so that the event loop is not blocked
+
+    :param htmlobject:
+        HTML document as string (LXML trees cannot be sent to a process pool)
+    :param executor:
+        concurrent.futures thread or process pool, None for the default executor
+    :param kwargs:
+        Further arguments passed to find_date
+    :return: Returns a valid date expression as a string, or None
+
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(find_date, htmlobject, **kwargs))
+
+
+async def iterate_dates(urls, concurrency=ASYNC_CONCURRENCY, executor=None, **kwargs):
+    """
+    Download and date a series of URLs, yielding (URL, date) tuples in order of completion
+
+    Downloads of further URLs overlap with the extraction of finished ones. At most
+    twice as many URLs as concurrent downloads are in progress: new URLs are only
+    taken from the input when results are consumed.
+
+    :param urls:
+        Iterable of URLs
+    :param concurrency:
+        Maximum number of concurrent downloads
+    :type concurrency: integer
+    :param executor:
+        concurrent.futures pool used for the extraction
+    :param kwargs:
+        Further arguments passed to find_date
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    session = make_session(concurrency)
+
+    async def process(url):
+        htmltext = await fetch_url_async(url, session, semaphore)
+        if htmltext is None:
+            return url, None
+        return url, await find_date_async(htmltext, executor, **kwargs)
+
+    urls = iter(urls)
+    pending = set()
+    try:
+        while True:
+            # backpressure: bounded window of URLs in progress
+            while len(pending) < 2 * concurrency:
+                url = next(urls, None)
+                if url is None:
+                    break
+                pending.add(asyncio.ensure_future(process(url.strip())))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if session is not None:
+            await session.close()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Batch processing of URL lists with resumable, checkpointed jobs and of stored files.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import fnmatch
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+
+from urllib.parse import urlsplit
+
+from .settings import BLOOM_ERROR_RATE
+
+
+LOGGER = logging.getLogger(__name__)
+PROGRESS_FILE = 'progress.log'
+
+
+def url_hash(url):
+    """Compact 64-bit fingerprint of an URL (hex string)"""
+    return hashlib.md5(url.encode('utf-8', errors='surrogatepass')).hexdigest()[:16]
+
+
+def parse_shard(string):
+    """Convert a shard specification "i/N" to a tuple (i, N), i ranging from 0 to N-1"""
+    try:
+        index, total = [int(part) for part in string.split('/')]
+    except ValueError:
+        raise ValueError('shard must be given as i/N: %s' % string)
+    if total < 1 or not 0 <= index < total:
+        raise ValueError('shard index out of range: %s' % string)
+    return index, total
+
+
+def host_shard(url, total):
+    """Assign an URL to a shard using a stable hash of its host name"""
+    host = urlsplit(url).hostname or ''
+    return int(hashlib.md5(host.encode('utf-8')).hexdigest()[:8], 16) % total
+
+
+def in_shard(url, shard):
+    """Check if an URL belongs to the given shard (None means no sharding)"""
+    if shard is None:
+        return True
+    return host_shard(url, shard[1]) == shard[0]
+
+
+def count_lines(filename):
+    """Count the lines of a file without decoding it"""
+    lines = 0
+    with open(filename, 'rb') as inputfile:
+        for block in iter(lambda: inputfile.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return lines + 1
+
+
+def iterate_files(inputs, pattern=None):
+    """Yield the paths of the files in the given directories (walked recursively in sorted order,
+       file names optionally filtered by a pattern such as "*.html.gz") or matching glob patterns"""
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, directories, filenames in os.walk(entry):
+                directories.sort()
+                for filename in sorted(filenames):
+                    if pattern is None or fnmatch.fnmatch(filename, pattern):
+                        yield os.path.join(root, filename)
+        else:
+            paths = sorted(path for path in glob.iglob(entry, recursive=True) if os.path.isfile(path))
+            if not paths:
+                LOGGER.error('no file found: %s', entry)
+            for path in paths:
+                yield path
+
+
+class BloomFilter(object):
+    """
+    Compact probabilistic set of URL fingerprints
+
+    :param capacity:
+        Expected number of elements
+    :type capacity: integer
+    :param error_rate:
+        Probability of false positives at full capacity
+    :type error_rate: float
+
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2)**2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint):
+        """Derive the bit positions by double hashing"""
+        value = int(fingerprint, 16)
+        first, second = value >> 32, value & 0xffffffff
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, fingerprint):
+        """Add a fingerprint to the set"""
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+
+class JobLog(object):
+    """
+    Append-only progress log of a batch job, synced to disk after each record
+
+    :param directory:
+        Job directory (created if necessary)
+    :type directory: string
+    :param capacity:
+        Expected number of URLs, used to size the seen-set
+    :type capacity: integer
+
+    """
+
+    def __init__(self, directory, capacity):
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(directory, PROGRESS_FILE)
+        self.seen = BloomFilter(capacity)
+        self.offset = 0
+        self.done = 0
+        # resume
+        if os.path.isfile(self.filename):
+            validlength = 0
+            with open(self.filename, 'r', encoding='utf-8') as logfile:
+                for line in logfile:
+                    # incomplete last record after an interruption
+                    if not line.endswith('\n'):
+                        break
+                    offset, fingerprint = line.rstrip('\n').split('\t')
+                    self.offset = max(self.offset, int(offset))
+                    self.seen.add(fingerprint)
+                    self.done += 1
+                    validlength += len(line)
+            os.truncate(self.filename, validlength)
+            LOGGER.info('resuming job after %s URLs at offset %s', self.done, self.offset)
+        self.logfile = open(self.filename, 'a', encoding='utf-8')
+
+    def record(self, offset, fingerprint):
+        """Mark the input up to the given offset as processed"""
+        self.logfile.write(str(offset) + '\t' + fingerprint + '\n')
+        self.logfile.flush()
+        os.fsync(self.logfile.fileno())
+        self.offset = offset
+        self.done += 1
+
+    def close(self):
+        """Close the log file"""
+        self.logfile.close()
+
+
+def run_job(inputfilename, jobdirectory, process, output=sys.stdout, shard=None):
+    """
+    Process a list of URLs (one per line) so that the job can be interrupted and resumed
+
+    Results are written as URL<TAB>result lines and flushed immediately, the
+    progress is then recorded in the job directory. Processing is resumed at the
+    last recorded offset, URLs already seen (including duplicates within the
+    input) are skipped and counted. The seen-set is sized on the number of lines so
+    that the rate of false positives (URLs wrongly skipped) stays at
+    BLOOM_ERROR_RATE. A document may be processed twice if the job is killed
+    between output and progress record.
+
+    :param inputfilename:
+        File containing one URL per line
+    :type inputfilename: string
+    :param jobdirectory:
+        Directory holding the progress log
+    :type jobdirectory: string
+    :param process:
+        Function taking an URL and returning a result string or None
+    :param output:
+        Stream the results are written to
+    :param shard:
+        Process only the URLs of the given shard (tuple index, total)
+    :type shard: tuple
+    :return: Returns the number of URLs processed in this run
+
+    """
+    joblog = JobLog(jobdirectory, count_lines(inputfilename))
+    processed, skipped = 0, 0
+    try:
+        with open(inputfilename, 'rb') as inputfile:
+            inputfile.seek(joblog.offset)
+            offset = joblog.offset
+            for line in inputfile:
+                offset += len(line)
+                url = line.decode('utf-8', errors='replace').strip()
+                if not url or not in_shard(url, shard):
+                    continue
+                fingerprint = url_hash(url)
+                if fingerprint in joblog.seen:
+                    LOGGER.debug('already seen: %s', url)
+                    skipped += 1
+                    continue
+                joblog.seen.add(fingerprint)
+                result = process(url)
+                if result is None:
+                    result = 'None'
+                output.write(url + '\t' + result + '\n')
+                output.flush()
+                joblog.record(offset, fingerprint)
+                processed += 1
+    finally:
+        joblog.close()
+        if skipped > 0:
+            LOGGER.info('%s URLs skipped as already seen', skipped)
+    return processed
+
+
+def read_results(filename):
+    """Iterate over (URL, date) pairs in tab-separated or JSON lines format"""
+    with open(filename, 'r', encoding='utf-8') as inputfile:
+        for line in inputfile:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                yield record['url'], record.get('date')
+            else:
+                url, _, date = line.partition('\t')
+                yield url, (date if date not in ('', 'None') else None)
+
+
+def merge_results(filenames, output=sys.stdout, outputformat='tsv'):
+    """
+    Combine the outputs of several shards into one result sorted by URL
+
+    :param filenames:
+        Result files in tab-separated or JSON lines format
+    :type filenames: list
+    :param output:
+        Stream the merged results are written to
+    :param outputformat:
+        "tsv" or "jsonl"
+    :type outputformat: string
+    :return: Returns coverage statistics as a dictionary
+
+    """
+    results = dict()
+    records = 0
+    for filename in filenames:
+        for url, date in read_results(filename):
+            records += 1
+            # keep dated entries over undated duplicates
+            if date is not None or url not in results:
+                results[url] = date
+    for url in sorted(results):
+        if outputformat == 'jsonl':
+            output.write(json.dumps({'url': url, 'date': results[url]}) + '\n')
+        else:
+            output.write(url + '\t' + str(results[url]) + '\n')
+    dated = sum(1 for date in results.values() if date is not None)
+    return {
+        'files': len(filenames),
+        'records': records,
+        'urls': len(results),
+        'duplicates': records - len(results),
+        'dated': dated,
+        'coverage': dated/len(results) if results else 0.0,
+    }
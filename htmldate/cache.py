@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent caching of extraction results for identical documents.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+# own
+from . import __version__
+from .settings import CACHE_MAXSIZE, CACHE_SYNC_INTERVAL
+
+
+LOGGER = logging.getLogger(__name__)
+URL_INPUT = re.compile(r'^https?://[^ ]+$')
+
+
+def open_database(path):
+    """Connect to a SQLite file shared between threads"""
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+class DictBackend(object):
+    """In-memory key-value store with least-recently-used eviction"""
+
+    def __init__(self):
+        self.store = OrderedDict()
+
+    def get(self, key):
+        """Return the stored value or None"""
+        value = self.store.get(key)
+        if value is not None:
+            self.store.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Store a value under the given key"""
+        self.store[key] = value
+        self.store.move_to_end(key)
+
+    def evict(self, maxsize):
+        """Remove the least recently used entries above maxsize"""
+        while len(self.store) > maxsize:
+            self.store.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries"""
+        self.store.clear()
+
+    def close(self):
+        """Nothing to release"""
+        pass
+
+    def __len__(self):
+        return len(self.store)
+
+
+class SQLiteBackend(object):
+    """Key-value store in a local SQLite file with least-recently-used eviction"""
+
+    def __init__(self, path, sync_interval=CACHE_SYNC_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.connection = open_database(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, atime REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+        self.connection.commit()
+
+    def _written(self):
+        """Commit writes in batches to avoid a disk sync per document"""
+        self.pending += 1
+        if self.pending >= self.sync_interval:
+            self.connection.commit()
+            self.pending = 0
+
+    def get(self, key):
+        """Return the stored value or None"""
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE entries SET atime = ? WHERE key = ?', (time.time(), key))
+            self._written()
+        return row[0]
+
+    def put(self, key, value):
+        """Store a value under the given key"""
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO entries (key, value, atime) VALUES (?, ?, ?)', (key, value, time.time()))
+            self._written()
+
+    def evict(self, maxsize):
+        """Remove the least recently used entries above maxsize"""
+        with self.lock:
+            excess = self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - maxsize
+            if excess > 0:
+                self.connection.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY atime LIMIT ?)', (excess,))
+                self.connection.commit()
+                self.pending = 0
+
+    def clear(self):
+        """Remove all entries"""
+        with self.lock:
+            self.connection.execute('DELETE FROM entries')
+            self.connection.commit()
+
+    def close(self):
+        """Write pending changes and close the database"""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+class ResultCache(object):
+    """
+    Cache of find_date results keyed by a hash of the document and the options
+
+    :param path:
+        Path of the SQLite file, None for an in-memory store
+    :type path: string
+    :param maxsize:
+        Maximum number of stored results before eviction
+    :type maxsize: integer
+    :param backend:
+        Alternative key-value backend (get, put, evict, clear, close and len)
+
+    """
+
+    VERSION_KEY = '__version__'
+
+    def __init__(self, path=None, maxsize=CACHE_MAXSIZE, backend=None):
+        if backend is None:
+            backend = SQLiteBackend(path) if path is not None else DictBackend()
+        self.backend = backend
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        # library upgrades invalidate stored results
+        if self.backend.get(self.VERSION_KEY) != __version__:
+            LOGGER.debug('cache version mismatch, clearing: %s', path)
+            self.backend.clear()
+            self.backend.put(self.VERSION_KEY, __version__)
+
+    def make_key(self, htmlobject, extensive_search, original_date, outputformat, url, mode='full'):
+        """Hash the document along with the relevant options, None if the input cannot be cached"""
+        if not isinstance(htmlobject, str) or URL_INPUT.match(htmlobject):
+            return None
+        digest = hashlib.md5(htmlobject.encode('utf-8', errors='surrogatepass'))
+        digest.update('\x00'.join([str(extensive_search), str(original_date), outputformat, str(url), mode]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """Return a tuple (found, result) for the given key"""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, json.loads(value)
+
+    def store(self, key, result):
+        """Store a result (including None) and evict old entries if necessary"""
+        self.backend.put(key, json.dumps(result))
+        self.writes += 1
+        # amortize the cost of eviction
+        if self.writes % max(1, self.maxsize // 10) == 0:
+            self.evict()
+
+    def evict(self):
+        """Reduce the cache to its maximum size"""
+        # refresh the version entry so that it is never evicted
+        self.backend.get(self.VERSION_KEY)
+        self.backend.evict(self.maxsize + 1)
+
+    def stats(self):
+        """Return hit-rate statistics"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits/total if total > 0 else 0.0,
+        }
+
+    def close(self):
+        """Release the backend"""
+        self.evict()
+        self.backend.close()
+
+    def __len__(self):
+        # version entry excluded
+        return len(self.backend) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HTTPCache(object):
+    """
+    On-disk store of HTTP validators, compressed bodies and extracted dates per URL
+
+    :param path:
+        Path of the SQLite file
+    :type path: string
+
+    """
+
+    def __init__(self, path, sync_interval=CACHE_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.connection = open_database(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, lastmodified TEXT, body BLOB, options TEXT, date TEXT)')
+        self.connection.commit()
+
+    def _written(self):
+        """Commit writes in batches"""
+        self.pending += 1
+        if self.pending >= self.sync_interval:
+            self.connection.commit()
+            self.pending = 0
+
+    def get_validators(self, url):
+        """Return the headers needed for a conditional request (empty if the URL is unknown)"""
+        with self.lock:
+            row = self.connection.execute('SELECT etag, lastmodified FROM pages WHERE url = ?', (url,)).fetchone()
+        headers = dict()
+        if row is not None:
+            if row[0] is not None:
+                headers['If-None-Match'] = row[0]
+            if row[1] is not None:
+                headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def get_body(self, url):
+        """Return the stored document or None"""
+        with self.lock:
+            row = self.connection.execute('SELECT body FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def store(self, url, etag, lastmodified, htmltext):
+        """Store a freshly downloaded document, previous dates are discarded"""
+        with self.lock:
+            # nothing to revalidate without validators
+            if etag is None and lastmodified is None:
+                self.connection.execute('DELETE FROM pages WHERE url = ?', (url,))
+            else:
+                body = zlib.compress(htmltext.encode('utf-8', errors='surrogatepass'))
+                self.connection.execute('INSERT OR REPLACE INTO pages (url, etag, lastmodified, body, options, date) VALUES (?, ?, ?, ?, NULL, NULL)', (url, etag, lastmodified, body))
+            self._written()
+
+    def get_date(self, url, options):
+        """Return a tuple (found, date) for a date extracted with the same options"""
+        with self.lock:
+            row = self.connection.execute('SELECT date FROM pages WHERE url = ? AND options = ?', (url, options)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def store_date(self, url, options, date):
+        """Attach the extracted date (including None) to a stored document"""
+        with self.lock:
+            self.connection.execute('UPDATE pages SET options = ?, date = ? WHERE url = ?', (options, json.dumps(date), url))
+            self._written()
+
+    def close(self):
+        """Write pending changes and close the database"""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -8,13 +8,23 @@ Implementing a basic command-line interface.
 
 import argparse
 import logging
+import multiprocessing
+import os
 import sys
 
-from .core import find_date
-from .utils import fetch_url
+from .batch import in_shard, iterate_files, merge_results, parse_shard, run_job
+from .cache import HTTPCache, ResultCache
+from .core import MODES, find_date, warmup
+from .metrics import METRICS
+from .profiling import PROFILE_METHODS, Profiler, replay
+from .parsers import PARSERS
+from .scheduler import HostScheduler
+from .settings import HOST_DELAY, PROFILE_THRESHOLD
+from .tracing import Tracer
+from .utils import fetch_conditional, fetch_url
 
 
-def examine(htmlstring, extensive_bool=True, original_date=False):
+def examine(htmlstring, extensive_bool=True, original_date=False, cache=None, mode='full', tracer=None, profiler=None):
     """ Generic safeguards and triggers """
     # safety check
     if htmlstring is None:
@@ -25,30 +35,217 @@ def examine(htmlstring, extensive_bool=True, original_date=False):
         sys.stderr.write('# ERROR: file too small\n')
     # proceed
     else:
-        result = find_date(htmlstring, extensive_bool, original_date)
+        result = find_date(htmlstring, extensive_bool, original_date, cache=cache, mode=mode, tracer=tracer, profiler=profiler)
         return result
     return None
 
 
+def examine_url(url, args, cache=None, httpcache=None, profiler=None):
+    """ Download and examine a web page, reuse stored dates for unmodified pages """
+    if httpcache is None:
+        htmltext = fetch_url(url)
+        return examine(htmltext, args.fast, args.original, cache, args.mode, profiler=profiler)
+    htmltext, modified = fetch_conditional(url, httpcache)
+    options = '\t'.join([str(args.fast), str(args.original), args.mode])
+    if modified is False:
+        found, result = httpcache.get_date(url, options)
+        if found is True:
+            return result
+    result = examine(htmltext, args.fast, args.original, cache, args.mode, profiler=profiler)
+    if htmltext is not None:
+        httpcache.store_date(url, options, result)
+    return result
+
+
+def process_files(args, output=sys.stdout, profiler=None):
+    """ Date stored files on a pool of worker processes, results in order of completion. """
+    # deferred import, only needed for this mode
+    from .pool import SupervisedPool
+    from .server import run_task
+    # loaded once and shared by the forked workers
+    warmup(freeze=True)
+    options = {'extensive_search': args.fast, 'original_date': args.original, 'mode': args.mode}
+    # the workers read the files themselves
+    tasks = (dict(options, id=path, path=path) for path in iterate_files(args.input_dir, args.pattern))
+    # profiled documents are processed in the current process
+    if profiler is not None:
+        for result in (run_task(task, profiler) for task in tasks):
+            output.write(result['id'] + '\t' + str(result['date']) + '\n')
+        return
+    with SupervisedPool(workers=args.workers) as pool:
+        for result in pool.imap_unordered(tasks):
+            output.write(result['id'] + '\t' + str(result['date']) + '\n')
+
+
+def shard_type(string):
+    """ Parse the shard argument. """
+    try:
+        return parse_shard(string)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def merge_main(arguments):
+    """ Combine the outputs of several shards. """
+    argsparser = argparse.ArgumentParser(prog='htmldate merge')
+    argsparser.add_argument("files", help="result files of the shards (TSV or JSON lines)", nargs='+')
+    argsparser.add_argument("-o", "--output", help="output file (default: standard output)", type=str)
+    argsparser.add_argument("--format", help="output format", choices=['tsv', 'jsonl'], default='tsv')
+    args = argsparser.parse_args(arguments)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as outputfile:
+            stats = merge_results(args.files, outputfile, args.format)
+    else:
+        stats = merge_results(args.files, sys.stdout, args.format)
+    sys.stderr.write('# {files} files, {records} records, {urls} URLs ({duplicates} duplicates), {dated} dated, coverage {coverage:.2%}\n'.format(**stats))
+
+
+def serve_main(arguments):
+    """ Run a local extraction server. """
+    # deferred import, only needed for this command
+    from .server import serve
+    argsparser = argparse.ArgumentParser(prog='htmldate serve')
+    argsparser.add_argument("--host", help="interface to listen on", type=str, default='127.0.0.1')
+    argsparser.add_argument("-p", "--port", help="port to listen on", type=int, default=8000)
+    argsparser.add_argument("-w", "--workers", help="number of worker processes", type=int, default=multiprocessing.cpu_count())
+    argsparser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    args = argsparser.parse_args(arguments)
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.verbose else logging.INFO)
+    serve(args.host, args.port, args.workers)
+
+
+def profiles_main(arguments):
+    """ Run the extraction profiles on their sample pages. """
+    # deferred import, only needed for this command
+    from .profiles import load_profiles, validate_profiles
+    argsparser = argparse.ArgumentParser(prog='htmldate profiles')
+    argsparser.add_argument("file", help="profile file (JSON or YAML) listing rules and samples for each host")
+    argsparser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    args = argsparser.parse_args(arguments)
+    if args.verbose:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    try:
+        profiles = load_profiles(args.file)
+    except (OSError, ValueError) as err:
+        sys.exit('# ERROR invalid profiles: ' + str(err) + '\n')
+    failures, total = 0, 0
+    for report in validate_profiles(profiles, os.path.dirname(os.path.abspath(args.file))):
+        total += 1
+        if report['ok'] is False:
+            failures += 1
+        sys.stdout.write('\t'.join([
+            'OK' if report['ok'] else 'FAIL', report['host'], report['sample'],
+            str(report['rule']), str(report['date']), str(report['expected'])
+        ]) + '\n')
+    sys.stderr.write('# {} profiles, {} samples, {} failures\n'.format(len(profiles), total, failures))
+    if failures > 0:
+        sys.exit(1)
+
+
+def replay_main(arguments):
+    """ Run the documents saved by --capture-dir again under the profiler. """
+    argsparser = argparse.ArgumentParser(prog='htmldate replay')
+    argsparser.add_argument("directory", help="capture directory")
+    argsparser.add_argument("--profile", help="profiling method", choices=PROFILE_METHODS, default='cprofile')
+    argsparser.add_argument("--profile-report", help="file to which the profiling report is written (default: standard error)", type=str)
+    argsparser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    args = argsparser.parse_args(arguments)
+    if args.verbose:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    if not os.path.isdir(args.directory):
+        sys.exit('# ERROR not a directory: ' + args.directory + '\n')
+    profiler = Profiler(args.profile)
+    for filename, captured, duration, result in replay(args.directory, profiler):
+        if isinstance(result, dict):
+            result = result['date']
+        sys.stdout.write('\t'.join([filename, '%.1f' % captured if captured is not None else 'None', '%.1f' % duration, str(result)]) + '\n')
+    write_profile(profiler, args.profile_report)
+
+
+def write_profile(profiler, filename=None):
+    """ Write the profiling report to a file or to standard error. """
+    if filename:
+        profiler.write(filename)
+    else:
+        sys.stderr.write(profiler.report())
+
+
+COMMANDS = {'merge': merge_main, 'profiles': profiles_main, 'replay': replay_main, 'serve': serve_main}
+
+
 def main():
     """ Run as a command-line utility. """
+    # subcommands
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
     # arguments
     argsparser = argparse.ArgumentParser()
     argsparser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
     argsparser.add_argument("-f", "--fast", help="fast mode: disable extensive search", action="store_false")
     argsparser.add_argument("--original", help="original date prioritized", action="store_true")
+    argsparser.add_argument("--mode", help="extraction tier, from the cheapest to the most thorough", choices=MODES, default='full')
     argsparser.add_argument("-i", "--inputfile", help="name of input file for batch processing (similar to wget -i)", type=str)
     argsparser.add_argument("-u", "--URL", help="custom URL download", type=str)
+    argsparser.add_argument("--input-dir", help="directory (walked recursively) or glob pattern of stored files, possibly compressed (.gz, .bz2, .xz, .zst), can be repeated", action="append")
+    argsparser.add_argument("--pattern", help="names of the files to process in the input directories (e.g. '*.html.gz')", type=str)
+    argsparser.add_argument("--workers", help="number of worker processes (with --input-dir)", type=int, default=multiprocessing.cpu_count())
+    argsparser.add_argument("--explain", help="print the decisions taken for a single document (without -i)", action="store_true")
+    argsparser.add_argument("--shard", help="process only the hosts of shard i out of N (0 <= i < N, with -i)", type=shard_type)
+    argsparser.add_argument("--parallel", help="number of concurrent downloads (with -i, without --job)", type=int, default=1)
+    argsparser.add_argument("--host-delay", help="minimum delay in seconds between requests to the same host (with --parallel)", type=float, default=HOST_DELAY)
+    argsparser.add_argument("--job", help="directory storing the progress of a resumable batch job (with -i)", type=str)
+    argsparser.add_argument("--cache", help="SQLite file used to store results for identical documents", type=str)
+    argsparser.add_argument("--http-cache", help="SQLite file used to send conditional requests and reuse results for unmodified pages", type=str)
+    argsparser.add_argument("--metrics", help="file to which counters and latency histograms are written on exit (Prometheus text format)", type=str)
+    argsparser.add_argument("--profile", help="profile the extraction of each document (with --input-dir: in a single process)", nargs='?', const='cprofile', choices=PROFILE_METHODS)
+    argsparser.add_argument("--profile-report", help="file to which the profiling report is written on exit (default: standard error)", type=str)
+    argsparser.add_argument("--capture-dir", help="directory in which the documents slower than --slow-ms are saved for htmldate replay", type=str)
+    argsparser.add_argument("--slow-ms", help="latency threshold for --capture-dir in milliseconds", type=float, default=PROFILE_THRESHOLD)
     args = argsparser.parse_args()
 
     if args.verbose:
         logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
+    cache, httpcache = None, None
+    if args.cache:
+        cache = ResultCache(args.cache)
+    if args.http_cache:
+        httpcache = HTTPCache(args.http_cache)
+    if args.metrics:
+        METRICS.enable()
+    profiler = None
+    if args.profile or args.capture_dir:
+        profiler = Profiler(args.profile, threshold_ms=args.slow_ms, capture_dir=args.capture_dir)
+    try:
+        process_args(args, cache, httpcache, profiler)
+    finally:
+        if args.metrics:
+            METRICS.write(args.metrics)
+        if profiler is not None:
+            write_profile(profiler, args.profile_report)
+        if args.verbose:
+            for name, stats in PARSERS.stats().items():
+                sys.stderr.write('# parser {}: {calls} calls, {hits} hits, {ms_per_call:.3f} ms per call\n'.format(name, **stats))
+        if cache is not None:
+            if args.verbose:
+                sys.stderr.write('# cache: {hits} hits, {misses} misses, hit rate {hit_rate:.2%}\n'.format(**cache.stats()))
+            cache.close()
+        if httpcache is not None:
+            httpcache.close()
+
+
+def process_args(args, cache=None, httpcache=None, profiler=None):
+    """ Process the input according to the command-line arguments. """
+    # stored files
+    if args.input_dir:
+        process_files(args, profiler=profiler)
+
     # process input on STDIN
-    if not args.inputfile:
+    elif not args.inputfile:
         # URL as input
         if args.URL:
-            htmlstring = fetch_url(args.URL)
+            htmlstring = fetch_url(args.URL, httpcache)
             if htmlstring is None:
                 sys.exit('# ERROR no valid result for url: ' + args.URL + '\n') # exit code: 1
         # unicode check
@@ -59,16 +256,35 @@ def main():
                 # input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding='latin-1')
                 sys.exit('# ERROR system/buffer encoding: ' + str(err) + '\n') # exit code: 1
 
-        result = examine(htmlstring, args.fast, args.original)
+        tracer = Tracer() if args.explain else None
+        result = examine(htmlstring, args.fast, args.original, cache, args.mode, tracer, profiler)
+        if tracer is not None:
+            sys.stdout.write(tracer.explain() + '\n')
         if result is not None:
             sys.stdout.write(result + '\n')
 
+    # resumable batch job
+    elif args.job:
+        run_job(args.inputfile, args.job, lambda url: examine_url(url, args, cache, httpcache, profiler), shard=args.shard)
+
+    # concurrent downloads, results in order of completion
+    elif args.parallel > 1:
+        scheduler = HostScheduler(workers=args.parallel, delay=args.host_delay, fetch=lambda url: fetch_url(url, httpcache))
+        with open(args.inputfile, mode='r', encoding='utf-8') as inputfile:
+            urls = (line.strip() for line in inputfile if in_shard(line.strip(), args.shard))
+            for url, htmltext in scheduler.fetch_all(urls):
+                result = examine(htmltext, args.fast, args.original, cache, args.mode, profiler=profiler)
+                if result is None:
+                    result = 'None'
+                sys.stdout.write(url + '\t' + result + '\n')
+
     # process input file line by line
     else:
         with open(args.inputfile, mode='r', encoding='utf-8') as inputfile: # errors='strict', buffering=1
             for line in inputfile:
-                htmltext = fetch_url(line.strip())
-                result = examine(htmltext, args.fast, args.original)
+                if not in_shard(line.strip(), args.shard):
+                    continue
+                result = examine_url(line.strip(), args, cache, httpcache, profiler)
                 if result is None:
                     result = 'None'
                 sys.stdout.write(line.strip() + '\t' + result + '\n')
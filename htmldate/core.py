@@ -9,22 +9,24 @@ Module bundling all functions needed to determine the date of HTML strings or LX
 
 # standard
 import datetime
+import gc
 import logging
 import re
+import time
 
 from collections import Counter
 
 # third-party
 import regex
 
-from ciso8601 import parse_datetime_as_naive
 from lxml import etree, html
 from lxml.html.clean import Cleaner
 
 # own
-from .parsers import custom_parse, external_date_parser, extract_url_date, extract_partial_url_date
+from .metrics import METRICS
+from .parsers import DATEPARSERS, PARSERS, extract_url_date, extract_partial_url_date
 from .settings import PARSER, PARSERCONFIG
-from .utils import load_html
+from .utils import bounded_text, document_language, load_html
 from .validators import compare_values, convert_date, date_validator, filter_ymd_candidate, output_format_validator, plausible_year_filter
 
 
@@ -56,6 +58,16 @@ DATE_EXPRESSIONS = [
 ]
 # "//*[contains(@class, 'fa-clock-o')]",
 # "//*[contains(@id, 'metadata')]",
+# compiled once instead of on every call of tree.xpath(), the strings are kept for the traces
+XPATHS = {expression: etree.XPath(expression) for expression in DATE_EXPRESSIONS + ['//abbr', '//link[@rel="canonical"]', '//meta', '//time']}
+
+# extraction tiers, each one running the stages of the previous ones:
+# url: URL and canonical link (full and partial dates)
+# header: meta elements
+# structural: abbr, DATE_EXPRESSIONS and time elements
+# patterns: cleaning, serialization and text patterns (JSON, timestamps, German dates)
+# full: search_page (if extensive_search is True)
+MODES = ('url', 'header', 'structural', 'patterns', 'full')
 
 CLEANER = Cleaner()
 CLEANER.comments = False
@@ -73,18 +85,132 @@ CLEANER.scripts = False
 CLEANER.style = True
 CLEANER.kill_tags = ['audio', 'canvas', 'label', 'map', 'math', 'object', 'picture', 'rdf', 'svg', 'video'] # 'embed', 'figure', 'img', 'table'
 
+# warm-up: documents going through all stages and date strings which no dateparser language can parse,
+# so that the data and the translation patterns of every language are loaded
+WARMUP_DOCUMENTS = (
+    '<html><head><meta name="date" content="2017-09-01"/></head><body><p class="date">1. Januar 2019</p><time>March 3, 2018</time></body></html>',
+    '<html lang="fr"><body><abbr class="published" title="12 juillet 2016">hier</abbr><p class="byline">Publié le 3 mars 2018</p><time datetime="2018-03-04" class="updated">4</time></body></html>',
+    '<html><body><p>Datum: 12.07.2016</p><script>{"datePublished":"2016-07-12"}</script></body></html>',
+    '<html><body><p>Copyright 2015 - 2017, 2017/05/03, 03.05.2017</p><footer>12.05.2017 10:00:00</footer></body></html>',
+)
+WARMUP_STRINGS = ('12 xyzzy 2019', '99.99.9999')
+
 ## REGEX cache
 JSON_PATTERN = re.compile(r'"date(?:Modified|Published)":"([0-9]{4}-[0-9]{2}-[0-9]{2})')
 # use of regex module for speed
 GERMAN_PATTERN = regex.compile(r'(?:Datum|Stand): ?([0-9]{1,2})\.([0-9]{1,2})\.([0-9]{2,4})')
 TIMESTAMP_PATTERN = regex.compile(r'([0-9]{4}-[0-9]{2}-[0-9]{2}|[0-9]{2}\.[0-9]{2}\.[0-9]{4}).[0-9]{2}:[0-9]{2}:[0-9]{2}')
+# search_page: scans of the whole document
+COPYRIGHT_PATTERN = re.compile(r'(?:©|&copy;|Copyright|\(c\))\D+([12][0-9]{3})\D')
+SLASHES_PATTERN = re.compile(r'/([0-9]{4}/[0-9]{2}/[0-9]{2})[01/]')
+YYYYMMDD_PATTERN = re.compile(r'\D([0-9]{4}[/.-][0-9]{2}[/.-][0-9]{2})\D')
+DDMMYYYY_PATTERN = re.compile(r'\D([0-3]?[0-9][/.-][01]?[0-9][/.-][0-9]{4})\D')
+DIGITS_PATTERN = re.compile(r'(\D19[0-9]{2}[01][0-9][0-3][0-9]\D|\D20[0-9]{2}[01][0-9][0-3][0-9]\D)')
+DDMMYY_PATTERN = re.compile(r'\D([0-3]?[0-9][/.][01]?[0-9][/.][019][0-9])\D')
+YYYYMM_PATTERN = re.compile(r'\D([0-9]{4}[/.-][0-9]{2})\D')
+MMYYYY_PATTERN = re.compile(r'\D([0-3]?[0-9][/.-][0-9]{4})\D')
+YEAR_PATTERN = re.compile(r'\D([12][0-9]{3})\D')
+
+
+def expired(deadline):
+    """Check if the time budget (deadline in time.perf_counter() seconds) is used up"""
+    return deadline is not None and time.perf_counter() > deadline
+
+
+def warmup(freeze=False, languages=None):
+    """
+    Load what the extraction needs before the first document: data of all
+    dateparser languages, patterns compiled on first use, lxml and cleaner.
+    In pre-fork worker models, call it in the parent process so that the
+    workers share the memory pages.
+
+    :param freeze:
+        Move the objects created so far to a permanent generation ignored by
+        the garbage collector (gc.freeze(), Python 3.7+), so that collections
+        in the workers do not write to the shared pages
+    :type freeze: boolean
+    :param languages:
+        Also build the dateparser instances restricted to these languages
+        (see parsers.ScopedDateParsers)
+    :type languages: list of strings
+
+    """
+    start = time.perf_counter()
+    for string in WARMUP_STRINGS:
+        PARSER.get_date_data(string)
+    for language in languages or ():
+        DATEPARSERS.get(language)
+    tree = html.fromstring(WARMUP_DOCUMENTS[0])
+    for xpath in XPATHS.values():
+        xpath(tree)
+    # the warm-up documents are not counted, other threads keep recording
+    METRICS.mute()
+    try:
+        for htmlstring in WARMUP_DOCUMENTS:
+            find_date(htmlstring)
+            find_date(htmlstring, original_date=True)
+    finally:
+        METRICS.mute(False)
+    if freeze is True:
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        else:
+            LOGGER.warning('gc.freeze() requires Python 3.7+')
+    LOGGER.debug('warm-up: %.2f s', time.perf_counter() - start)
+
+
+class Document(object):
+    """
+    Input of the extraction (see load_html) along with the views the stages
+    need: the tree, its meta elements, the declared language, the cleaned
+    tree and its serialization are built when first asked for and kept for
+    the following stages
+
+    """
+
+    def __init__(self, htmlobject):
+        self.htmlobject = htmlobject
+        self.cache = {}
+
+    @property
+    def tree(self):
+        if 'tree' not in self.cache:
+            self.cache['tree'] = load_html(self.htmlobject)
+        return self.cache['tree']
+
+    @property
+    def meta(self):
+        """Meta elements of the document"""
+        if 'meta' not in self.cache:
+            self.cache['meta'] = XPATHS['//meta'](self.tree)
+        return self.cache['meta']
+
+    @property
+    def language(self):
+        if 'language' not in self.cache:
+            self.cache['language'] = document_language(self.tree)
+        return self.cache['language']
+
+    @property
+    def cleaned(self):
+        if 'cleaned' not in self.cache:
+            self.cache['cleaned'] = clean_tree(self.tree)
+        return self.cache['cleaned']
+
+    @property
+    def htmlstring(self):
+        if 'htmlstring' not in self.cache:
+            self.cache['htmlstring'] = html.tostring(self.cleaned, encoding='unicode')
+            LOGGER.debug('html cleaned')
+        return self.cache['htmlstring']
 
 
 #@profile
-def examine_date_elements(tree, expression, outputformat, extensive_search):
+def examine_date_elements(tree, expression, outputformat, extensive_search, deadline=None, tracer=None, stage='expression', language=None):
     """Check HTML elements one by one for date expressions"""
     try:
-        elements = tree.xpath(expression)
+        elements = XPATHS[expression](tree) if expression in XPATHS else tree.xpath(expression)
     except etree.XPathEvalError as err:
         LOGGER.error('lxml expression %s throws an error: %s', expression, err)
         return None
@@ -92,26 +218,30 @@ def examine_date_elements(tree, expression, outputformat, extensive_search):
         return None
     # loop through the elements to analyze
     for elem in elements:
-        # trim
-        temptext = elem.text_content().strip()
-        temptext = re.sub(r'[\n\r\s\t]+', ' ', temptext, re.MULTILINE)
-        textcontent = temptext.strip()
+        if expired(deadline):
+            break
+        # beginning of the text with normalized whitespace, without collecting the whole subtree
+        textcontent = bounded_text(elem.itertext(), 48)
         # simple length heuristics
         if not textcontent or len(textcontent) < 6:
+            if tracer is not None:
+                tracer.event(stage, rule=expression, element=elem, candidate=textcontent, reason='text too short')
             continue
         # try the beginning of the string
         else:
-            # shorten
-            toexamine = textcontent[:48]
+            toexamine = textcontent
             # trim non-digits at the end of the string
             toexamine = re.sub(r'\D+$', '', toexamine)
             #toexamine = re.sub(r'\|.+$', '', toexamine)
             # more than 4 digits required
             if len(toexamine) < 7 or len(list(filter(str.isdigit, toexamine))) < 4:
+                if tracer is not None:
+                    tracer.event(stage, rule=expression, element=elem, candidate=toexamine, reason='not enough digits')
                 continue
-            LOGGER.debug('analyzing (HTML): %s', html.tostring(elem, pretty_print=False, encoding='unicode').translate({ ord(c):None for c in '\n\t\r' }).strip()[:100])
             LOGGER.debug('analyzing (string): %s', toexamine)
-            attempt = try_ymd_date(toexamine, outputformat, extensive_search)
+            attempt = try_ymd_date(toexamine, outputformat, extensive_search, deadline=deadline, language=language)
+            if tracer is not None:
+                tracer.event(stage, rule=expression, element=elem, candidate=toexamine, result=attempt, reason=None if attempt is not None else 'unparsed')
             if attempt is not None:
                 return attempt
     # catchall
@@ -119,7 +249,17 @@ def examine_date_elements(tree, expression, outputformat, extensive_search):
 
 
 #@profile
-def examine_header(tree, outputformat, extensive_search, original_date):
+def try_meta(elem, value, outputformat, extensive_search, deadline=None, tracer=None, language=None):
+    """Parse the value of a meta element and report the attempt to the tracer"""
+    LOGGER.debug('examining meta element: %s', elem.attrib)
+    result = try_ymd_date(value, outputformat, extensive_search, deadline=deadline, language=language)
+    if tracer is not None:
+        tracer.event('header', element=elem, candidate=value, result=result, reason=None if result is not None else 'unparsed')
+    return result
+
+
+#@profile
+def examine_header(tree, outputformat, extensive_search, original_date, deadline=None, tracer=None, language=None, elements=None):
     """
     Parse header elements to find date cues
 
@@ -137,6 +277,12 @@ def examine_header(tree, outputformat, extensive_search, original_date):
         Look for original date (e.g. publication date) instead of most recent
         one (e.g. last modified, updated time)
     :type original_date: boolean
+    :param language:
+        Language code of the document, passed to the date parsers
+    :type language: string
+    :param elements:
+        Meta elements of the tree if they are already collected
+    :type elements: list
     :return: Returns a valid date expression as a string, or None
 
     """
@@ -144,7 +290,7 @@ def examine_header(tree, outputformat, extensive_search, original_date):
     reserve = None
     try:
         # loop through all meta elements
-        for elem in tree.xpath('//meta'): # was //head/meta # "og:" for OpenGraph http://ogp.me/
+        for elem in elements if elements is not None else XPATHS['//meta'](tree): # was //head/meta # "og:" for OpenGraph http://ogp.me/
             # safeguard
             if len(elem.attrib) < 1:
                 continue
@@ -156,21 +302,18 @@ def examine_header(tree, outputformat, extensive_search, original_date):
                 # original date
                 if original_date is True:
                     if elem.get('property').lower() in ('article:published_time', 'bt:pubdate', 'dc:created', 'dc:date', 'og:article:published_time', 'og:published_time', 'rnews:datepublished'):
-                        LOGGER.debug('examining meta property: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                        headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                        headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                         if headerdate is not None:
                             break
                 # modified date: override published_time
                 else:
                     if elem.get('property').lower() in ('article:modified_time', 'og:article:modified_time', 'og:updated_time'):
-                        LOGGER.debug('examining meta property: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                        attempt = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                        attempt = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                         if attempt is not None:
                             headerdate = attempt
                             break # avoid looking further
                     elif elem.get('property').lower() in ('article:published_time', 'bt:pubdate', 'dc:created', 'dc:date', 'og:article:published_time', 'og:published_time', 'rnews:datepublished') and headerdate is None:
-                        LOGGER.debug('examining meta property: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                        headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                        headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
             # name attribute
             elif headerdate is None and 'name' in elem.attrib and 'content' in elem.attrib: # elem.get('name') is not None:
                 # safeguard
@@ -179,50 +322,46 @@ def examine_header(tree, outputformat, extensive_search, original_date):
                 # url
                 if elem.get('name').lower() == 'og:url':
                     headerdate = extract_url_date(elem.get('content'), outputformat)
+                    if tracer is not None:
+                        tracer.event('header', element=elem, candidate=elem.get('content'), result=headerdate, reason=None if headerdate is not None else 'no date in URL')
                 # date
                 elif elem.get('name').lower() in ('article.created', 'article_date_original', 'article.published', 'created', 'cxenseparse:recs:publishtime', 'date', 'date_published', 'dc.date', 'dc.date.created', 'dc.date.issued', 'dcterms.date', 'gentime', 'og:published_time', 'originalpublicationdate', 'pubdate', 'publishdate', 'publish_date', 'published-date', 'publication_date', 'sailthru.date', 'timestamp'):
-                    LOGGER.debug('examining meta name: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                    headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                    headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                 # modified
                 elif elem.get('name').lower() in ('lastmodified', 'last-modified') and original_date is False:
-                    LOGGER.debug('examining meta name: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                    headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                    headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
             elif headerdate is None and 'pubdate' in elem.attrib:
                 if elem.get('pubdate').lower() == 'pubdate':
-                    LOGGER.debug('examining meta pubdate: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                    headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                    headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
             # other types # itemscope?
             elif headerdate is None and 'itemprop' in elem.attrib:
                 if elem.get('itemprop').lower() in ('datecreated', 'datepublished', 'pubyear') and headerdate is None:
-                    LOGGER.debug('examining meta itemprop: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
                     if 'datetime' in elem.attrib:
-                        headerdate = try_ymd_date(elem.get('datetime'), outputformat, extensive_search)
+                        headerdate = try_meta(elem, elem.get('datetime'), outputformat, extensive_search, deadline, tracer, language)
                     elif 'content' in elem.attrib:
-                        headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                        headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                 # override
                 elif elem.get('itemprop').lower() == 'datemodified' and original_date is False:
-                    LOGGER.debug('examining meta itemprop: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
                     if 'datetime' in elem.attrib:
-                        attempt = try_ymd_date(elem.get('datetime'), outputformat, extensive_search)
+                        attempt = try_meta(elem, elem.get('datetime'), outputformat, extensive_search, deadline, tracer, language)
                     elif 'content' in elem.attrib:
-                        attempt = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                        attempt = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                     if attempt is not None:
                         headerdate = attempt
                 # reserve with copyrightyear
                 elif headerdate is None and elem.get('itemprop').lower() == 'copyrightyear':
-                    LOGGER.debug('examining meta itemprop: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
                     if 'content' in elem.attrib:
                         attempt = '-'.join([elem.get('content'), '01', '01'])
                         if date_validator(attempt, '%Y-%m-%d') is True:
                             reserve = attempt
+                        if tracer is not None:
+                            tracer.event('header', element=elem, candidate=elem.get('content'), result=reserve, reason='copyright year as reserve')
             # http-equiv, rare http://www.standardista.com/html5/http-equiv-the-meta-attribute-explained/
             elif headerdate is None and 'http-equiv' in elem.attrib:
                 if original_date is True and elem.get('http-equiv').lower() == 'date':
-                    LOGGER.debug('examining meta http-equiv: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                    headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                    headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
                 if elem.get('http-equiv').lower() in ('date', 'last-modified'):
-                    LOGGER.debug('examining meta http-equiv: %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip())
-                    headerdate = try_ymd_date(elem.get('content'), outputformat, extensive_search)
+                    headerdate = try_meta(elem, elem.get('content'), outputformat, extensive_search, deadline, tracer, language)
             #else:
             #    LOGGER.debug('not found: %s %s', html.tostring(elem, pretty_print=False, encoding='unicode').strip(), elem.attrib)
 
@@ -297,7 +436,7 @@ def search_pattern(htmlstring, pattern, catch, yearpat, original_date):
 
 
 #@profile
-def try_ymd_date(string, outputformat, extensive_search, parser=PARSER):
+def try_ymd_date(string, outputformat, extensive_search, chain=PARSERS, deadline=None, language=None):
     """Use a series of heuristics and rules to parse a potential date expression"""
     # discard on formal criteria
     if string is None or len(list(filter(str.isdigit, string))) < 4:
@@ -305,50 +444,26 @@ def try_ymd_date(string, outputformat, extensive_search, parser=PARSER):
     # just time/single year, not a date
     if re.match(r'[0-9]{2}:[0-9]{2}(:| )', string) or re.match(r'\D*[0-9]{4}\D*$', string):
         return None
-    # much faster
-    if string[0:4].isdigit():
-        # try speedup with ciso8601
-        try:
-            result = parse_datetime_as_naive(string)
-            if date_validator(result, outputformat) is True:
-                LOGGER.debug('ciso8601 result: %s', result)
-                converted = result.strftime(outputformat)
-                return converted
-        except ValueError:
-            LOGGER.debug('ciso8601 error: %s', string)
-    # faster
-    customresult = custom_parse(string, outputformat)
-    if customresult is not None:
-        return customresult
-    # slow but extensive search
-    if extensive_search is True:
-        # send to dateparser
-        dateparser_result = external_date_parser(string, outputformat, parser)
-        if dateparser_result is not None:
-            return dateparser_result
-    # catchall
-    return None
+    # ciso8601, custom parse and, for the extensive search, dateparser (see parsers.PARSERS)
+    return chain.parse(string, outputformat, extensive_search is True and not expired(deadline), language)
 
 
 #@profile
-def try_expression(expression, outputformat, extensive_search):
+def try_expression(expression, outputformat, extensive_search, deadline=None, language=None):
     '''Check if the text string could be a valid date expression'''
-    # trim
-    temptext = expression.strip()
-    temptext = re.sub(r'[\n\r\s\t]+', ' ', temptext, re.MULTILINE)
-    textcontent = temptext.strip()
+    # trim and shorten
+    textcontent = bounded_text((expression,), 48)
     # simple length heuristics
     if not textcontent or len(list(filter(str.isdigit, textcontent))) < 4:
         return None
     # try the beginning of the string
-    textcontent = textcontent[:48]
-    attempt = try_ymd_date(textcontent, outputformat, extensive_search)
+    attempt = try_ymd_date(textcontent, outputformat, extensive_search, deadline=deadline, language=language)
     return attempt
 
 
-def compare_reference(reference, expression, outputformat, extensive_search, original_date):
+def compare_reference(reference, expression, outputformat, extensive_search, original_date, deadline=None, language=None):
     '''Compare candidate to current date reference (includes date validation and older/newer test)'''
-    attempt = try_expression(expression, outputformat, extensive_search)
+    attempt = try_expression(expression, outputformat, extensive_search, deadline, language)
     if attempt is not None:
         new_reference = compare_values(reference, attempt, outputformat, original_date)
     else:
@@ -383,7 +498,7 @@ def search_page(htmlstring, outputformat, original_date):
     # copyright symbol
     LOGGER.debug('looking for copyright/footer information')
     copyear = 0
-    pattern = re.compile(r'(?:©|&copy;|Copyright|\(c\))\D+([12][0-9]{3})\D')
+    pattern = COPYRIGHT_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'^\D?([12][0-9]{3})')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -398,7 +513,7 @@ def search_page(htmlstring, outputformat, original_date):
     ## 3 components
     LOGGER.debug('3 components')
     # target URL characteristics
-    pattern = re.compile(r'/([0-9]{4}/[0-9]{2}/[0-9]{2})[01/]')
+    pattern = SLASHES_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'([0-9]{4})/([0-9]{2})/([0-9]{2})')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -407,7 +522,7 @@ def search_page(htmlstring, outputformat, original_date):
         return result
 
     # more loosely structured data
-    pattern = re.compile(r'\D([0-9]{4}[/.-][0-9]{2}[/.-][0-9]{2})\D')
+    pattern = YYYYMMDD_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'([0-9]{4})[/.-]([0-9]{2})[/.-]([0-9]{2})')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -416,7 +531,7 @@ def search_page(htmlstring, outputformat, original_date):
         return result
 
     #
-    pattern = re.compile(r'\D([0-3]?[0-9][/.-][01]?[0-9][/.-][0-9]{4})\D')
+    pattern = DDMMYYYY_PATTERN
     yearpat = re.compile(r'(19[0-9]{2}|20[0-9]{2})\D?$')
     candidates = plausible_year_filter(htmlstring, pattern, yearpat)
     # revert DD-MM-YYYY patterns before sorting
@@ -443,7 +558,7 @@ def search_page(htmlstring, outputformat, original_date):
         return result
 
     # valid dates strings
-    pattern = re.compile(r'(\D19[0-9]{2}[01][0-9][0-3][0-9]\D|\D20[0-9]{2}[01][0-9][0-3][0-9]\D)')
+    pattern = DIGITS_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'([12][0-9]{3})([01][0-9])([0-3][0-9])')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -452,7 +567,7 @@ def search_page(htmlstring, outputformat, original_date):
         return result
 
     # DD?/MM?/YY
-    pattern = re.compile(r'\D([0-3]?[0-9][/.][01]?[0-9][/.][019][0-9])\D')
+    pattern = DDMMYY_PATTERN
     yearpat = re.compile(r'([0-9]{2})$')
     candidates = plausible_year_filter(htmlstring, pattern, yearpat, tocomplete=True)
     # revert DD-MM-YYYY patterns before sorting
@@ -484,7 +599,7 @@ def search_page(htmlstring, outputformat, original_date):
     ## 2 components
     LOGGER.debug('switching to two components')
     #
-    pattern = re.compile(r'\D([0-9]{4}[/.-][0-9]{2})\D')
+    pattern = YYYYMM_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'([0-9]{4})[/.-]([0-9]{2})')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -495,7 +610,7 @@ def search_page(htmlstring, outputformat, original_date):
                 LOGGER.debug('date found for pattern "%s": %s', pattern, pagedate)
                 return convert_date(pagedate, '%Y-%m-%d', outputformat)
     #
-    pattern = re.compile(r'\D([0-3]?[0-9][/.-][0-9]{4})\D')
+    pattern = MMYYYY_PATTERN
     yearpat = re.compile(r'([12][0-9]{3})\D?$')
     candidates = plausible_year_filter(htmlstring, pattern, yearpat, original_date)
     # revert DD-MM-YYYY patterns before sorting
@@ -521,7 +636,7 @@ def search_page(htmlstring, outputformat, original_date):
     LOGGER.debug('switching to one component')
     # last try
     # pattern = '(\D19[0-9]{2}\D|\D20[0-9]{2}\D)'
-    pattern = re.compile(r'\D([12][0-9]{3})\D')
+    pattern = YEAR_PATTERN
     yearpat = re.compile(r'^\D?([12][0-9]{3})')
     catch = re.compile(r'^\D?([12][0-9]{3})')
     bestmatch = search_pattern(htmlstring, pattern, catch, yearpat, original_date)
@@ -540,14 +655,14 @@ def search_page(htmlstring, outputformat, original_date):
 
 
 #@profile
-def find_date(htmlobject, extensive_search=True, original_date=False, outputformat='%Y-%m-%d', url=None):
+def find_date(htmlobject, extensive_search=True, original_date=False, outputformat='%Y-%m-%d', url=None, cache=None, details=False, budget_ms=None, mode='full', controller=None, profiles=None, tracer=None, scorer=None, profiler=None):
     """
     Extract dates from HTML documents using markup analysis and text patterns
 
     :param htmlobject:
         Two possibilities: 1. HTML document (e.g. body of HTTP request or .html-file) in text string
         form or LXML parsed tree or 2. URL string (gets detected automatically)
-    :type htmlobject: string or lxml tree
+    :type htmlobject: string, lxml tree or Document
     :param extensive_search:
         Activate pattern-based opportunistic text search
     :type extensive_search: boolean
@@ -563,41 +678,227 @@ def find_date(htmlobject, extensive_search=True, original_date=False, outputform
         Provide an URL manually for pattern-searching in URL
         (in some cases much faster)
     :type url: string
+    :param cache:
+        Result cache used to skip the extraction for identical documents
+        (see htmldate.cache.ResultCache)
+    :type cache: ResultCache
+    :param details:
+        Return a dictionary with the date and the stage which found it
+        (e.g. "header", "expression:3", "search_page", "cache")
+    :type details: boolean
+    :param budget_ms:
+        Time budget in milliseconds: once it is used up, the expensive steps
+        (dateparser, cleaning and serialization, search_page) and the remaining
+        structural stages are skipped, the details then state if the search was
+        cut short ("truncated")
+    :type budget_ms: float
+    :param mode:
+        Extraction tier, from the cheapest to the most thorough: "url", "header",
+        "structural", "patterns" or "full" (see MODES), each tier adding
+        stages to the previous one
+    :type mode: string
+    :param controller:
+        Reorder and skip the DATE_EXPRESSIONS according to their recent yield
+        (see htmldate.adaptive.AdaptiveController), the cache is then bypassed
+    :type controller: AdaptiveController
+    :param profiles:
+        Per-domain rules tried first, selected according to the host of the URL
+        or canonical link (see htmldate.profiles.load_profiles), the cache is
+        then bypassed
+    :type profiles: ProfileSet
+    :param tracer:
+        Receive the decisions taken during the extraction (see htmldate.tracing.Tracer),
+        the cache is then bypassed
+    :type tracer: Tracer
+    :param scorer:
+        Score the candidates of the cheap stages together and only run the
+        expensive ones below a confidence threshold (see
+        htmldate.scoring.CandidateScorer), the details then include the
+        confidence, the cache is bypassed
+    :type scorer: CandidateScorer
+    :param profiler:
+        Profile the extraction and save the document along with its options
+        if it is slow (see htmldate.profiling.Profiler)
+    :type profiler: Profiler
     :return: Returns a valid date expression as a string, or None
 
     """
+    if profiler is not None:
+        options = dict(extensive_search=extensive_search, original_date=original_date, outputformat=outputformat, url=url,
+                       cache=cache, details=details, budget_ms=budget_ms, mode=mode, controller=controller,
+                       profiles=profiles, tracer=tracer, scorer=scorer)
+        return profiler.run(find_date, htmlobject, options)
+    start = time.perf_counter()
+    deadline = None
+    if budget_ms is not None:
+        deadline = start + budget_ms/1000
+    # cached result for identical documents and options
+    cachekey = None
+    if cache is not None and tracer is None and scorer is None and profiles is None and controller is None:
+        cachekey = cache.make_key(htmlobject, extensive_search, original_date, outputformat, url, mode)
+        if cachekey is not None:
+            found, result = cache.lookup(cachekey)
+            if METRICS.enabled is True:
+                METRICS.inc('htmldate_cache_lookups_total', result='hit' if found is True else 'miss')
+            if found is True:
+                record_document('cache', start)
+                return format_result(result, 'cache', details, deadline, False)
+    confidence = None
+    if scorer is not None:
+        result, stage, confidence = scorer.examine(htmlobject, extensive_search, original_date, outputformat, url, deadline, mode, profiles, tracer)
+    else:
+        result, stage = examine_document(htmlobject, extensive_search, original_date, outputformat, url, deadline, mode, controller, profiles, tracer)
+    truncated = expired(deadline)
+    if tracer is not None:
+        tracer.event('result', candidate=stage, result=result, reason='time budget used up' if truncated else None)
+    # results of a search cut short are not stored
+    if cachekey is not None and truncated is False:
+        cache.store(cachekey, result)
+    record_document(stage if result is not None else None, start)
+    return format_result(result, stage, details, deadline, truncated, confidence)
+
+
+def record_document(stage, start):
+    """Count a processed document along with its deciding stage and duration (see metrics.METRICS)"""
+    if METRICS.enabled is True:
+        METRICS.inc('htmldate_documents_total', stage=stage or 'none')
+        METRICS.observe('htmldate_extraction_seconds', time.perf_counter() - start)
+
+
+def format_result(result, stage, details, deadline, truncated, confidence=None):
+    """Return the date alone or a dictionary with details on the extraction"""
+    if details is False:
+        return result
+    output = {'date': result, 'stage': stage}
+    if deadline is not None:
+        output['truncated'] = truncated
+    if confidence is not None:
+        output['confidence'] = confidence
+    return output
+
+
+#@profile
+def examine_partial_url(url, outputformat):
+    """Look for a partial date in the URL, return a tuple (date or None, stage or None)"""
+    if url is not None:
+        dateresult = extract_partial_url_date(url, outputformat)
+        if dateresult is not None:
+            return dateresult, 'partial_url'
+    return None, None
+
+
+#@profile
+def clean_tree(tree):
+    """Return a cleaned copy of the tree for string search"""
+    try:
+        return CLEANER.clean_html(tree)
+    except ValueError: # rare LXML error: no NULL bytes or control characters
+        return tree
+
+
+#@profile
+def examine_text_patterns(htmlstring, outputformat):
+    """Look for JSON metadata, timestamps and precise German patterns, return a tuple (date or None, stage or None)"""
+    # date regex timestamp rescue
+    json_match = JSON_PATTERN.search(htmlstring)
+    if json_match and date_validator(json_match.group(1), '%Y-%m-%d') is True:
+        LOGGER.debug('JSON time found: %s', json_match.group(0))
+        return convert_date(json_match.group(1), '%Y-%m-%d', outputformat), 'json'
+    timestamp_match = TIMESTAMP_PATTERN.search(htmlstring)
+    if timestamp_match and date_validator(timestamp_match.group(1), '%Y-%m-%d') is True:
+        LOGGER.debug('time regex found: %s', timestamp_match.group(0))
+        return convert_date(timestamp_match.group(1), '%Y-%m-%d', outputformat), 'timestamp'
+    # precise German patterns
+    de_match = GERMAN_PATTERN.search(htmlstring)
+    if de_match and len(de_match.group(3)) in (2, 4):
+        try:
+            if len(de_match.group(3)) == 2:
+                candidate = datetime.date(int('20' + de_match.group(3)), int(de_match.group(2)), int(de_match.group(1)))
+            else:
+                candidate = datetime.date(int(de_match.group(3)), int(de_match.group(2)), int(de_match.group(1)))
+        except ValueError:
+            LOGGER.debug('value error: %s', de_match.group(0))
+        else:
+            if date_validator(candidate, '%Y-%m-%d') is True:
+                LOGGER.debug('precise pattern found: %s', de_match.group(0))
+                return convert_date(candidate, '%Y-%m-%d', outputformat), 'german'
+    return None, None
+
+
+#@profile
+def examine_document(htmlobject, extensive_search, original_date, outputformat, url, deadline=None, mode='full', controller=None, profiles=None, tracer=None):
+    """Run the extraction cascade and return a tuple (date or None, deciding stage or None)"""
     # init
-    tree = load_html(htmlobject)
+    document = htmlobject if isinstance(htmlobject, Document) else Document(htmlobject)
     find_date.extensive_search = extensive_search
     LOGGER.debug('starting')
 
     # safety
-    if tree is None:
-        return None
     if outputformat != '%Y-%m-%d' and output_format_validator(outputformat) is False:
-        return None
+        return None, None
+    if mode not in MODES:
+        LOGGER.error('unknown extraction mode: %s', mode)
+        return None, None
+    level = MODES.index(mode)
+
+    # URL given by the caller: no need to parse the document, unless a profile of the host comes first
+    if url is not None and (profiles is None or profiles.select(url) is None):
+        dateresult = extract_url_date(url, outputformat)
+        if tracer is not None:
+            tracer.event('url', candidate=url, result=dateresult, reason=None if dateresult is not None else 'no date in URL')
+        if dateresult is not None:
+            return dateresult, 'url'
+        if level < MODES.index('header'):
+            return examine_partial_url(url, outputformat)
+        checked = url
+    else:
+        checked = None
+
+    tree = document.tree
+    if tree is None:
+        return None, None
 
     # URL
     if url is None:
         # link canonical
-        for elem in tree.xpath('//link[@rel="canonical"]'):
+        for elem in XPATHS['//link[@rel="canonical"]'](tree):
             if 'href' in elem.attrib:
                 url = elem.get('href')
-    if url is not None:
+
+    # known location of the date for the host
+    if profiles is not None and url is not None:
+        dateresult = profiles.extract(tree, url, outputformat)
+        if tracer is not None:
+            tracer.event('profile', candidate=url, result=dateresult, reason=None if dateresult is not None else 'no profile or no match')
+        if dateresult is not None:
+            return dateresult, 'profile'
+
+    if url is not None and url != checked:
         dateresult = extract_url_date(url, outputformat)
+        if tracer is not None:
+            tracer.event('url', candidate=url, result=dateresult, reason=None if dateresult is not None else 'no date in URL')
         if dateresult is not None:
-            return dateresult
+            return dateresult, 'url'
+    if level < MODES.index('header'):
+        return examine_partial_url(url, outputformat)
+
+    # declared language, selects the dateparser instance
+    language = document.language
 
     # first, try header
-    pagedate = examine_header(tree, outputformat, extensive_search, original_date)
+    pagedate = examine_header(tree, outputformat, extensive_search, original_date, deadline, tracer, language, document.meta)
     if pagedate is not None: # and date_validator(pagedate, outputformat) is True: # already validated
-        return pagedate
+        return pagedate, 'header'
+    if level < MODES.index('structural'):
+        return examine_partial_url(url, outputformat)
 
     # <abbr>
-    elements = tree.xpath('//abbr')
+    elements = XPATHS['//abbr'](tree)
     if elements is not None: # and len(elements) > 0:
         reference = 0
         for elem in elements:
+            if expired(deadline):
+                break
             # data-utime (mostly Facebook)
             if 'data-utime' in elem.attrib:
                 try:
@@ -622,7 +923,7 @@ def find_date(htmlobject, extensive_search=True, original_date=False, outputform
                     if 'title' in elem.attrib:
                         trytext = elem.get('title')
                         LOGGER.debug('abbr published-title found: %s', trytext)
-                        reference = compare_reference(reference, trytext, outputformat, extensive_search, original_date)
+                        reference = compare_reference(reference, trytext, outputformat, extensive_search, original_date, deadline, language)
                         # faster execution
                         if reference > 0:
                             break
@@ -630,55 +931,64 @@ def find_date(htmlobject, extensive_search=True, original_date=False, outputform
                     if elem.text and len(elem.text) > 10:
                         trytext = re.sub(r'^am ', '', elem.text)
                         LOGGER.debug('abbr published found: %s', trytext)
-                        reference = compare_reference(reference, trytext, outputformat, extensive_search, original_date)
+                        reference = compare_reference(reference, trytext, outputformat, extensive_search, original_date, deadline, language)
         # convert and return
         if reference > 0:
             dateobject = datetime.datetime.fromtimestamp(reference)
             converted = dateobject.strftime(outputformat)
             # quality control
             if date_validator(converted, outputformat) is True:
-                return converted
+                return converted, 'abbr'
         # try rescue in abbr content
         else:
-            dateresult = examine_date_elements(tree, '//abbr', outputformat, extensive_search)
+            dateresult = examine_date_elements(tree, '//abbr', outputformat, extensive_search, deadline, tracer, 'abbr', language)
             if dateresult is not None and date_validator(dateresult, outputformat) is True:
-                return dateresult # break
+                return dateresult, 'abbr' # break
 
     # expressions + text_content
-    for expr in DATE_EXPRESSIONS:
-        dateresult = examine_date_elements(tree, expr, outputformat, extensive_search)
-        if dateresult is not None and date_validator(dateresult, outputformat) is True:
-            return dateresult # break
+    order = range(len(DATE_EXPRESSIONS)) if controller is None else controller.order()
+    for i in order:
+        if expired(deadline):
+            break
+        start = time.perf_counter()
+        dateresult = examine_date_elements(tree, DATE_EXPRESSIONS[i], outputformat, extensive_search, deadline, tracer, 'expression:' + str(i), language)
+        found = dateresult is not None and date_validator(dateresult, outputformat) is True
+        if controller is not None:
+            controller.record(i, found, time.perf_counter() - start)
+        if found is True:
+            return dateresult, 'expression:' + str(i) # break
 
     # <time>
-    elements = tree.xpath('//time')
+    elements = XPATHS['//time'](tree)
     if elements is not None: # and len(elements) > 0:
         # scan all the tags and look for the newest one
         reference = 0
         for elem in elements:
+            if expired(deadline):
+                break
             # go for datetime
             if 'datetime' in elem.attrib and len(elem.get('datetime')) > 6:
                 # first choice: entry-date + datetime attribute
                 if 'class' in elem.attrib:
                     if elem.get('class').startswith('entry-date') or elem.get('class').startswith('entry-time'):
                         LOGGER.debug('time/datetime found: %s', elem.get('datetime'))
-                        reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date)
+                        reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date, deadline, language)
                         if reference > 0:
                             break
                     # updated time
                     if elem.get('class') == 'updated' and original_date is False:
                         LOGGER.debug('updated time/datetime found: %s', elem.get('datetime'))
-                        reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date)
+                        reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date, deadline, language)
                         if reference > 0:
                             break
                 # datetime attribute
                 else:
                     LOGGER.debug('time/datetime found: %s', elem.get('datetime'))
-                    reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date)
+                    reference = compare_reference(reference, elem.get('datetime'), outputformat, extensive_search, original_date, deadline, language)
             # bare text in element
             elif elem.text is not None and len(elem.text) > 6:
                 LOGGER.debug('time/datetime found: %s', elem.text)
-                reference = compare_reference(reference, elem.text, outputformat, extensive_search, original_date)
+                reference = compare_reference(reference, elem.text, outputformat, extensive_search, original_date, deadline, language)
             # else...
         # return
         if reference > 0:
@@ -687,53 +997,28 @@ def find_date(htmlobject, extensive_search=True, original_date=False, outputform
             converted = dateobject.strftime(outputformat)
             # quality control
             if date_validator(converted, outputformat) is True:
-                return converted
+                return converted, 'time'
+    if level < MODES.index('patterns'):
+        return examine_partial_url(url, outputformat)
 
-    # clean before string search
-    try:
-        cleaned_html = CLEANER.clean_html(tree)
-    except ValueError: # rare LXML error: no NULL bytes or control characters
-        cleaned_html = tree
-    htmlstring = html.tostring(cleaned_html, encoding='unicode')
-    # remove comments by hand as faulty in lxml
-    # htmlstring = re.sub(r'<!--.+?-->', '', htmlstring, flags=re.DOTALL)
-    LOGGER.debug('html cleaned')
-
-    # date regex timestamp rescue
-    json_match = JSON_PATTERN.search(htmlstring)
-    if json_match and date_validator(json_match.group(1), '%Y-%m-%d') is True:
-        LOGGER.debug('JSON time found: %s', json_match.group(0))
-        return convert_date(json_match.group(1), '%Y-%m-%d', outputformat)
-    timestamp_match = TIMESTAMP_PATTERN.search(htmlstring)
-    if timestamp_match and date_validator(timestamp_match.group(1), '%Y-%m-%d') is True:
-        LOGGER.debug('time regex found: %s', timestamp_match.group(0))
-        return convert_date(timestamp_match.group(1), '%Y-%m-%d', outputformat)
-
-    # precise German patterns
-    de_match = GERMAN_PATTERN.search(htmlstring)
-    if de_match and len(de_match.group(3)) in (2, 4):
-        try:
-            if len(de_match.group(3)) == 2:
-                candidate = datetime.date(int('20' + de_match.group(3)), int(de_match.group(2)), int(de_match.group(1)))
-            else:
-                candidate = datetime.date(int(de_match.group(3)), int(de_match.group(2)), int(de_match.group(1)))
-        except ValueError:
-            LOGGER.debug('value error: %s', de_match.group(0))
-        else:
-            if date_validator(candidate, '%Y-%m-%d') is True:
-                LOGGER.debug('precise pattern found: %s', de_match.group(0))
-                return convert_date(candidate, '%Y-%m-%d', outputformat)
+    # skip cleaning, serialization and text patterns once the budget is used up
+    htmlstring = None
+    if not expired(deadline):
+        htmlstring = document.htmlstring
+        dateresult, stage = examine_text_patterns(htmlstring, outputformat)
+        if dateresult is not None:
+            return dateresult, stage
 
     # last try: URL 2
-    if url is not None:
-        dateresult = extract_partial_url_date(url, outputformat)
-        if dateresult is not None:
-            return dateresult
+    dateresult, stage = examine_partial_url(url, outputformat)
+    if dateresult is not None:
+        return dateresult, stage
 
     # last resort
-    if extensive_search is True:
+    if extensive_search is True and mode == 'full' and htmlstring is not None and not expired(deadline):
         LOGGER.debug('extensive search started')
         pagedate = search_page(htmlstring, outputformat, original_date)
-        return pagedate
+        if pagedate is not None:
+            return pagedate, 'search_page'
 
-    return None
+    return None, None
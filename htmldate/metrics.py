@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and histograms of the extraction, exported in Prometheus text format.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import logging
+import os
+import threading
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# own
+from .settings import METRICS_BUCKETS
+
+
+LOGGER = logging.getLogger(__name__)
+
+# name: (type, description)
+DESCRIPTIONS = {
+    'htmldate_documents_total': ('counter', 'Documents processed, by deciding stage ("none" if no date was found)'),
+    'htmldate_extraction_seconds': ('histogram', 'Time spent on a document, cached results included'),
+    'htmldate_parsed_bytes_total': ('counter', 'Size of the documents parsed (characters for text input)'),
+    'htmldate_parser_calls_total': ('counter', 'Calls of the date-string parsers, by parser'),
+    'htmldate_parser_hits_total': ('counter', 'Calls of the date-string parsers returning a date, by parser'),
+    'htmldate_parser_seconds': ('histogram', 'Duration of the calls of the date-string parsers, by parser'),
+    'htmldate_cache_lookups_total': ('counter', 'Lookups in the result cache, by result (hit or miss)'),
+    'htmldate_fetches_total': ('counter', 'Downloads attempted'),
+    'htmldate_fetch_errors_total': ('counter', 'Failed downloads, by type of error'),
+    'htmldate_extraction_errors_total': ('counter', 'Documents whose processing raised an exception'),
+}
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels, extra=None):
+    """Serialize a tuple of (name, value) pairs in Prometheus syntax"""
+    if extra is not None:
+        labels = labels + (extra,)
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join('%s="%s"' % item for item in escaped) + '}'
+
+
+def format_value(value):
+    """Serialize a number, integers without decimal part"""
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms identified by a name and labels, nothing is
+    recorded until the registry is enabled. Worker processes hand over
+    their values with drain() and the parent process adds them with merge().
+
+    :param buckets:
+        Upper bounds of the histogram buckets (seconds)
+    :type buckets: tuple
+
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.enabled = False
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {}
+        self.histograms = {}
+
+    def enable(self):
+        """Start recording"""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording, values are kept"""
+        self.enabled = False
+
+    def mute(self, muted=True):
+        """Stop (or resume) recording in the current thread only, e.g. during the warm-up"""
+        self.local.muted = muted
+
+    def inc(self, name, value=1, **labels):
+        """Add a value to a counter"""
+        if getattr(self.local, 'muted', False):
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram"""
+        if getattr(self.local, 'muted', False):
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                # counts by bucket (the last one is +Inf), sum, count
+                self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram = self.histograms[key]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def drain(self):
+        """Return the values recorded so far and set them back to zero"""
+        with self.lock:
+            snapshot = {'counters': self.counters, 'histograms': self.histograms}
+            self.counters, self.histograms = {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the values returned by drain() in another process"""
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (counts, total, number) in snapshot['histograms'].items():
+                if key not in self.histograms:
+                    self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                histogram = self.histograms[key]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += number
+
+    def reset(self):
+        """Set all values back to zero"""
+        self.drain()
+
+    def value(self, name, **labels):
+        """Return the value of a counter (0 if absent)"""
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """Return all values in Prometheus text format"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(counts), total, number)) for key, (counts, total, number) in self.histograms.items())
+        lines, described = [], set()
+        def describe(name, default):
+            if name not in described:
+                described.add(name)
+                kind, description = DESCRIPTIONS.get(name, (default, name))
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, kind))
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+        for (name, labels), (counts, total, number) in histograms:
+            describe(name, 'histogram')
+            cumulated = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulated += count
+                bound = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels, ('le', bound)), cumulated))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), repr(total)))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), number))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Write the values to a file, replaced at once (e.g. for the textfile collector of node_exporter)"""
+        temporary = filename + '.tmp'
+        with open(temporary, mode='w', encoding='utf-8') as outputfile:
+            outputfile.write(self.render())
+        os.replace(temporary, filename)
+
+
+# registry used throughout the package, disabled by default
+METRICS = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Endpoint: GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug('%s - %s', self.address_string(), format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server exposing a registry"""
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        HTTPServer.__init__(self, address, MetricsHandler)
+        self.registry = registry
+
+
+def start_metrics_server(port=9464, host='127.0.0.1', registry=METRICS):
+    """
+    Enable the registry and expose it on http://host:port/metrics from a
+    background thread, return the server (stopped with shutdown())
+
+    :param port:
+        Port to listen on, 0 for a free port (see server.server_port)
+    :type port: integer
+    :param host:
+        Interface to listen on
+    :type host: string
+
+    """
+    registry.enable()
+    server = MetricsServer((host, port), registry)
+    thread = threading.Thread(target=server.serve_forever, name='htmldate-metrics', daemon=True)
+    thread.start()
+    LOGGER.info('metrics on http://%s:%s/metrics', host, server.server_port)
+    return server
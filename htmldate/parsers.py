@@ -11,25 +11,78 @@ Custom parsers for date extraction.
 import datetime
 import logging
 import re
+import threading
+import time
 
-from .settings import PARSER
+from collections import OrderedDict
+
+# third-party
+import dateparser
+
+from ciso8601 import parse_datetime_as_naive
+
+# own
+from .metrics import METRICS
+from .settings import DATEPARSER_INSTANCES, PARSER, PARSERCONFIG
 from .validators import convert_date, date_validator
 
 
 ## INIT
 LOGGER = logging.getLogger(__name__)
 # Regex cache
-AMERICAN_ENGLISH = re.compile(r'(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sep|Oct|Nov|Dec|Januar|Jänner|Februar|Feber|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember) ([0-9]{1,2})(st|nd|rd|th)?,? ([0-9]{4})') # ([0-9]{2,4})
-BRITISH_ENGLISH = re.compile(r'([0-9]{1,2})(st|nd|rd|th)? (of )?(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sep|Oct|Nov|Dec|Januar|Jänner|Februar|Feber|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember),? ([0-9]{4})') # ([0-9]{2,4})
-ENGLISH_DATE = re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{2,4})')
 COMPLETE_URL = re.compile(r'([0-9]{4})[/-]([0-9]{1,2})[/-]([0-9]{1,2})')
 PARTIAL_URL = re.compile(r'/([0-9]{4})/([0-9]{1,2})/')
 YMD_PATTERN = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})')
 DATESTUB_PATTERN = re.compile(r'([0-9]{1,2})\.([0-9]{1,2})\.([0-9]{2,4})')
-GERMAN_TEXTSEARCH = re.compile(r'([0-9]{1,2})\. (Januar|Jänner|Februar|Feber|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember) ([0-9]{4})')
-GENERAL_TEXTSEARCH = re.compile(r'January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sep|Oct|Nov|Dec|Januar|Jänner|Februar|Feber|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember')
 # German dates cache
 TEXT_MONTHS = {'Januar':'01', 'Jänner':'01', 'January':'01', 'Jan':'01', 'Februar':'02', 'Feber':'02', 'February':'02', 'Feb':'02', 'März':'03', 'March':'03', 'Mar':'03', 'April':'04', 'Apr':'04', 'Mai':'05', 'May':'05', 'Juni':'06', 'June':'06', 'Jun':'06', 'Juli':'07', 'July':'07', 'Jul':'07', 'August':'08', 'Aug':'08', 'September':'09', 'Sep':'09', 'Oktober':'10', 'October':'10', 'Oct':'10', 'November':'11', 'Nov':'11', 'Dezember':'12', 'December':'12', 'Dec':'12'}
+GERMAN_MONTHS = ('Januar', 'Jänner', 'Februar', 'Feber', 'März', 'April', 'Mai', 'Juni', 'Juli', 'August', 'September', 'Oktober', 'November', 'Dezember')
+
+# month names of the main European languages (lowercase), ordered from January to December,
+# abbreviations which are common words in other languages are left out
+MONTH_NAMES = {
+    'de': ['januar jänner jan', 'februar feber feb', 'märz mär', 'april apr', 'mai', 'juni jun', 'juli jul', 'august aug', 'september sept sep', 'oktober okt', 'november nov', 'dezember dez'],
+    'en': ['january jan', 'february feb', 'march mar', 'april apr', 'may', 'june jun', 'july jul', 'august aug', 'september sept sep', 'october oct', 'november nov', 'december dec'],
+    'es': ['enero ene', 'febrero feb', 'marzo mar', 'abril abr', 'mayo may', 'junio jun', 'julio jul', 'agosto ago', 'septiembre setiembre sept sep', 'octubre oct', 'noviembre nov', 'diciembre dic'],
+    'fr': ['janvier janv', 'février fevrier févr fevr', 'mars', 'avril avr', 'mai', 'juin', 'juillet juil', 'août aout', 'septembre sept', 'octobre oct', 'novembre nov', 'décembre decembre déc dec'],
+    'it': ['gennaio gen', 'febbraio feb', 'marzo mar', 'aprile apr', 'maggio mag', 'giugno giu', 'luglio lug', 'agosto ago', 'settembre sett', 'ottobre ott', 'novembre nov', 'dicembre dic'],
+    'nl': ['januari jan', 'februari feb', 'maart mrt', 'april apr', 'mei', 'juni jun', 'juli jul', 'augustus aug', 'september sept sep', 'oktober okt', 'november nov', 'december dec'],
+    'pl': ['stycznia styczeń styczen sty', 'lutego luty lut', 'marca marzec', 'kwietnia kwiecień kwiecien kwi', 'maja maj', 'czerwca czerwiec cze', 'lipca lipiec lip', 'sierpnia sierpień sierpien', 'września wrzesień wrzesien wrz', 'października październik pazdziernika paź', 'listopada listopad lis', 'grudnia grudzień grudzien gru'],
+    'pt': ['janeiro jan', 'fevereiro fev', 'março marco mar', 'abril abr', 'maio mai', 'junho jun', 'julho jul', 'agosto ago', 'setembro set', 'outubro', 'novembro nov', 'dezembro dez'],
+}
+MONTH_TABLES = {language: {name: month for month, names in enumerate(table, 1) for name in names.split()} for language, table in MONTH_NAMES.items()}
+MONTH_NUMBERS = {name: month for table in MONTH_TABLES.values() for name, month in table.items()}
+# abbreviations which are also ordinary English words, only read as months if the document language is known
+AMBIGUOUS_MONTHS = frozenset(['ago', 'gen', 'lip', 'mag', 'set', 'sty'])
+GENERIC_MONTHS = {name: month for name, month in MONTH_NUMBERS.items() if name not in AMBIGUOUS_MONTHS}
+
+# one-pass tokenization of date strings for the text layouts: digit runs, words, whitespace and single characters
+DATE_TOKENS = re.compile(r'[0-9]+|[^\W\d_]+|\s+|.', re.DOTALL)
+# shape of the tokens, one character each: digit runs by length (1, 2, 3, 4, else 0),
+# G German month name, E English month name, m other month name (any case),
+# o English ordinal suffix, r other ordinal suffix, c "de/del", f "of", w other words,
+# single space, _ other whitespace, punctuation used in the layouts as such, x other characters
+DIGIT_SHAPES = {1: '1', 2: '2', 3: '3', 4: '4'}
+WORD_SHAPES = dict([(name, 'E') for name in TEXT_MONTHS] + [(name, 'G') for name in GERMAN_MONTHS])
+LOWERCASE_WORD_SHAPES = dict(
+    [(name, 'm') for name in MONTH_NUMBERS] +
+    [(suffix, 'o') for suffix in ('st', 'nd', 'rd', 'th')] +
+    [(suffix, 'r') for suffix in ('er', 'e', 'º', 'ª')] +
+    [('de', 'c'), ('del', 'c'), ('of', 'f')]
+)
+PUNCTUATION_SHAPES = frozenset('.,/-°')
+# shapes of the tokens seen so far, bounded in size
+TOKEN_SHAPES = dict()
+TOKEN_SHAPES_MAXSIZE = 10000
+# layouts matched against the shape, in order of precedence
+GERMAN_LAYOUT = re.compile(r'([12])\. (G) (4)')
+ENGLISH_LAYOUT = re.compile(r'([12])/([12])/([234])')
+AMERICAN_LAYOUT = re.compile(r'([GE]) ([12])o?,? (4)')
+BRITISH_LAYOUT = re.compile(r'([12])o? (?:f )?([GE]),? (4)')
+# day (ordinal marker) (de/of) month (de) year: 12 octobre 2017, 1er mai 2017, 3 de março de 2016, 5. maja 2015
+MULTILINGUAL_DMY = re.compile(r'([12])[or°]?\.? ?(?:[cf] )?([GEm])\.?,? (?:c )?(4)')
+# month day year: oct. 12, 2017
+MULTILINGUAL_MDY = re.compile(r'([GEm])\.? ([12])o?,? (4)')
 
 
 #@profile
@@ -72,52 +125,69 @@ def extract_partial_url_date(testurl, outputformat):
     return None
 
 
+def token_shape(token):
+    """Return the shape character of a token (see DATE_TOKENS)"""
+    if '0' <= token[0] <= '9':
+        shape = DIGIT_SHAPES.get(len(token), '0')
+    elif token[0].isalpha():
+        shape = WORD_SHAPES.get(token) or LOWERCASE_WORD_SHAPES.get(token.lower(), 'w')
+    elif token.isspace():
+        shape = ' ' if token == ' ' else '_'
+    else:
+        shape = token if token in PUNCTUATION_SHAPES else 'x'
+    if len(TOKEN_SHAPES) < TOKEN_SHAPES_MAXSIZE:
+        TOKEN_SHAPES[token] = shape
+    return shape
+
+
 #@profile
-def regex_parse_de(string):
+def tokenize_date(string):
+    """Split a date string into tokens in one pass, return the tokens and their shape (see DATE_TOKENS)"""
+    tokens = DATE_TOKENS.findall(string)
+    return tokens, ''.join([TOKEN_SHAPES.get(token) or token_shape(token) for token in tokens])
+
+
+#@profile
+def regex_parse_de(string, tokenized=None):
     """Try full-text parse for German date elements"""
+    tokens, shape = tokenized or tokenize_date(string)
     # text match
-    match = GERMAN_TEXTSEARCH.search(string)
+    match = GERMAN_LAYOUT.search(shape)
     if not match:
         return None
-    # second element
-    secondelem = TEXT_MONTHS[match.group(2)]
+    day, month, year = tokens[match.start(1)], tokens[match.start(2)], tokens[match.start(3)]
     # process and return
     try:
-        dateobject = datetime.date(int(match.group(3)), int(secondelem), int(match.group(1)))
+        dateobject = datetime.date(int(year), int(TEXT_MONTHS[month]), int(day))
     except ValueError:
         return None
     LOGGER.debug('German text parse: %s', dateobject)
     return dateobject
 
 #@profile
-def regex_parse_en(string):
+def regex_parse_en(string, tokenized=None):
     """Try full-text parse for English date elements"""
-    # https://github.com/vi3k6i5/flashtext ?
+    tokens, shape = tokenized or tokenize_date(string)
     # numbers
-    match = ENGLISH_DATE.search(string)
+    match = ENGLISH_LAYOUT.search(shape)
     if match:
-        day = match.group(2)
-        month = match.group(1)
-        year = match.group(3)
+        month, day, year = tokens[match.start(1)], tokens[match.start(2)], tokens[match.start(3)]
     else:
         # general search
-        if not GENERAL_TEXTSEARCH.search(string):
+        if 'E' not in shape and 'G' not in shape:
             return None
         # American English
-        match = AMERICAN_ENGLISH.search(string)
+        match = AMERICAN_LAYOUT.search(shape)
         if match:
-            day = match.group(2)
-            month = TEXT_MONTHS[match.group(1)]
-            year = match.group(4)
+            month, day, year = tokens[match.start(1)], tokens[match.start(2)], tokens[match.start(3)]
         # British English
         else:
-            match = BRITISH_ENGLISH.search(string)
+            match = BRITISH_LAYOUT.search(shape)
             if match:
-                day = match.group(1)
-                month = TEXT_MONTHS[match.group(4)]
-                year = match.group(5)
+                day, month, year = tokens[match.start(1)], tokens[match.start(2)], tokens[match.start(3)]
             else:
                 return None
+        month = TEXT_MONTHS[month]
     # process and return
     if len(year) == 2:
         year = '20' + year
@@ -130,8 +200,48 @@ def regex_parse_en(string):
 
 
 #@profile
-def custom_parse(string, outputformat):
-    """Try to bypass the slow dateparser"""
+def regex_parse_multilingual(string, tokenized=None, language=None):
+    """Try full-text parse for month names in the main European languages,
+       restricted to the month names of the document language if it is known"""
+    tokens, shape = tokenized or tokenize_date(string)
+    if language is not None:
+        months = MONTH_TABLES.get(language)
+        if months is None:
+            return None
+    else:
+        months = GENERIC_MONTHS
+    for layout, monthgroup, daygroup in ((MULTILINGUAL_DMY, 2, 1), (MULTILINGUAL_MDY, 1, 2)):
+        for match in layout.finditer(shape):
+            month = months.get(tokens[match.start(monthgroup)].lower())
+            if month is None:
+                continue
+            try:
+                dateobject = datetime.date(int(tokens[match.start(3)]), month, int(tokens[match.start(daygroup)]))
+            except ValueError:
+                return None
+            LOGGER.debug('multilingual text parse: %s', dateobject)
+            return dateobject
+    return None
+
+
+#@profile
+def iso_parse(string, outputformat):
+    """Parse ISO 8601 timestamps with ciso8601 (much faster)"""
+    try:
+        result = parse_datetime_as_naive(string)
+    except ValueError:
+        LOGGER.debug('ciso8601 error: %s', string)
+        return None
+    if date_validator(result, outputformat) is True:
+        LOGGER.debug('ciso8601 result: %s', result)
+        return result.strftime(outputformat)
+    return None
+
+
+#@profile
+def custom_parse(string, outputformat, language=None):
+    """Try to bypass the slow dateparser, the language of the document (if known)
+       restricts the month names of other languages"""
     LOGGER.debug('custom parse test: %s', string)
     # '201709011234' not covered by dateparser # regex was too slow
     if string[0:8].isdigit():
@@ -171,10 +281,14 @@ def custom_parse(string, outputformat):
                 LOGGER.debug('D.M.Y match: %s', candidate)
                 converted = convert_date(candidate, '%Y-%m-%d', outputformat)
                 return converted
+    # single pass over the string, the text layouts are then matched against the shape of the tokens
+    tokenized = tokenize_date(string)
     # text match
-    dateobject = regex_parse_de(string)
+    dateobject = regex_parse_de(string, tokenized)
+    if dateobject is None:
+        dateobject = regex_parse_en(string, tokenized)
     if dateobject is None:
-        dateobject = regex_parse_en(string)
+        dateobject = regex_parse_multilingual(string, tokenized, language)
     # examine
     if dateobject is not None:
         try:
@@ -203,3 +317,177 @@ def external_date_parser(string, outputformat, parser=PARSER):
             datestring = datetime.date.strftime(target, outputformat)
             return datestring
     return None
+
+
+class ScopedDateParsers(object):
+    """
+    Dateparser instances restricted to a language (and English), built on first
+    use and bounded in number, the general parser serves as a fallback for
+    unknown or undeclared languages
+
+    :param maxsize:
+        Number of instances kept, the least recently used one is discarded
+    :type maxsize: integer
+    :param fallback:
+        Parser used without language (see settings.PARSER)
+
+    """
+
+    def __init__(self, maxsize=DATEPARSER_INSTANCES, fallback=PARSER):
+        self.maxsize = maxsize
+        self.fallback = fallback
+        self.parsers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, language):
+        """Return the parser for a language code (e.g. "de") or the fallback"""
+        if language is None:
+            return self.fallback
+        with self.lock:
+            if language in self.parsers:
+                self.parsers.move_to_end(language)
+                return self.parsers[language]
+        languages = [language] if language == 'en' else [language, 'en']
+        try:
+            parser = dateparser.DateDataParser(languages=languages, settings=PARSERCONFIG)
+            # unknown languages are only rejected on first use, also loads the locale data
+            parser.get_date_data('1 January 2019')
+        except ValueError:
+            LOGGER.debug('language not supported by dateparser: %s', language)
+            parser = self.fallback
+        with self.lock:
+            self.parsers[language] = parser
+            while len(self.parsers) > self.maxsize:
+                self.parsers.popitem(last=False)
+        return parser
+
+
+DATEPARSERS = ScopedDateParsers()
+
+
+#@profile
+def scoped_date_parser(string, outputformat, language=None):
+    """Use the dateparser instance matching the language of the document"""
+    return external_date_parser(string, outputformat, DATEPARSERS.get(language))
+
+
+class RegisteredParser(object):
+    """Date-string parser in a chain, along with its counters"""
+
+    def __init__(self, name, function, priority, prefilter, languages, extensive, scoped):
+        self.name = name
+        self.function = function
+        self.priority = priority
+        self.prefilter = prefilter
+        self.languages = frozenset(languages) if languages is not None else None
+        self.extensive = extensive
+        self.scoped = scoped
+        self.calls = 0
+        self.filtered = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+
+class ParserChain(object):
+    """
+    Ordered series of functions turning a date string into a date in the output
+    format (or None), the first result wins. Calls, hits and time spent are
+    counted for each parser (counts are approximate when threads share a chain).
+
+    """
+
+    def __init__(self):
+        self.parsers = []
+
+    def register(self, name, function, priority=50, prefilter=None, languages=None, extensive=False, scoped=False):
+        """
+        Add a parser to the chain, replacing a parser with the same name
+
+        :param name:
+            Name used in the statistics
+        :type name: string
+        :param function:
+            Function taking a string and an output format, returning a string or None
+        :param priority:
+            Parsers with lower values run first
+        :type priority: integer
+        :param prefilter:
+            Cheap function taking the string and returning False if the parser can be skipped
+        :param languages:
+            Run the parser only if the language of the document is among these language codes
+        :type languages: list
+        :param extensive:
+            Run the parser only if extensive_search is active
+        :type extensive: boolean
+        :param scoped:
+            Pass the language of the document (or None) to the function as third argument
+        :type scoped: boolean
+
+        """
+        self.unregister(name)
+        self.parsers.append(RegisteredParser(name, function, priority, prefilter, languages, extensive, scoped))
+        # stable sort: registration order for equal priorities
+        self.parsers.sort(key=lambda parser: parser.priority)
+
+    def unregister(self, name):
+        """Remove a parser from the chain"""
+        self.parsers = [parser for parser in self.parsers if parser.name != name]
+
+    def names(self):
+        """Return the names of the parsers in order"""
+        return [parser.name for parser in self.parsers]
+
+    def parse(self, string, outputformat, extensive_search=True, language=None):
+        """Run the string through the chain, return the first result or None"""
+        for parser in self.parsers:
+            if parser.extensive is True and extensive_search is not True:
+                continue
+            if parser.languages is not None and language not in parser.languages:
+                continue
+            if parser.prefilter is not None and not parser.prefilter(string):
+                parser.filtered += 1
+                continue
+            start = time.perf_counter()
+            if parser.scoped is True:
+                result = parser.function(string, outputformat, language)
+            else:
+                result = parser.function(string, outputformat)
+            duration = time.perf_counter() - start
+            parser.seconds += duration
+            parser.calls += 1
+            if METRICS.enabled is True:
+                METRICS.inc('htmldate_parser_calls_total', parser=parser.name)
+                METRICS.observe('htmldate_parser_seconds', duration, parser=parser.name)
+                if result is not None:
+                    METRICS.inc('htmldate_parser_hits_total', parser=parser.name)
+            if result is not None:
+                parser.hits += 1
+                return result
+        return None
+
+    def stats(self):
+        """Return the counters of each parser"""
+        return {
+            parser.name: {
+                'priority': parser.priority,
+                'calls': parser.calls,
+                'filtered': parser.filtered,
+                'hits': parser.hits,
+                'hit_rate': parser.hits / parser.calls if parser.calls else 0.0,
+                'ms_per_call': parser.seconds / parser.calls * 1000 if parser.calls else 0.0,
+                'seconds': parser.seconds,
+            }
+            for parser in self.parsers
+        }
+
+    def reset_stats(self):
+        """Set the counters back to zero"""
+        for parser in self.parsers:
+            parser.calls, parser.filtered, parser.hits, parser.seconds = 0, 0, 0, 0.0
+
+
+# default chain, can be modified (e.g. PARSERS.unregister('dateparser'))
+PARSERS = ParserChain()
+PARSERS.register('iso', iso_parse, priority=10, prefilter=lambda string: string[0:4].isdigit())
+PARSERS.register('custom', custom_parse, priority=20, scoped=True)
+PARSERS.register('dateparser', scoped_date_parser, priority=90, extensive=True, scoped=True)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Supervised pool of extraction processes with per-document limits.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from multiprocessing.connection import wait
+
+# own
+from .server import collect_metrics, run_task
+from .settings import POOL_MAX_RSS, POOL_MAX_TASKS, POOL_TIME_LIMIT
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CPUTimeExceeded(BaseException):
+    """Raised in a worker when a document uses up its CPU time
+    (not an Exception so that it cannot be caught by the task itself)"""
+
+
+def _cpu_exceeded(signum, frame):
+    raise CPUTimeExceeded()
+
+
+def current_rss():
+    """Resident memory of the current process in MB"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (IOError, OSError, ValueError):
+        # peak value, in kilobytes on Linux
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_main(connection, function, initializer, cpu_limit):
+    """Process tasks received on the connection until a None sentinel arrives"""
+    if initializer is not None:
+        initializer()
+    if cpu_limit is not None:
+        signal.signal(signal.SIGPROF, _cpu_exceeded)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        try:
+            if cpu_limit is not None:
+                signal.setitimer(signal.ITIMER_PROF, cpu_limit)
+            result = function(task)
+        except CPUTimeExceeded:
+            result = {'id': task.get('id'), 'date': None, 'stage': None, 'error': 'cpu time limit'}
+            if task.get('url') is not None:
+                result['url'] = task['url']
+        finally:
+            if cpu_limit is not None:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+        connection.send((result, current_rss()))
+
+
+class Worker(object):
+    """Handle on a worker process and its current task"""
+
+    def __init__(self, function, initializer, cpu_limit):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_main, args=(child, function, initializer, cpu_limit))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.tasks = 0
+        self.task = None
+        self.started = None
+
+    def submit(self, task):
+        self.task = task
+        self.started = time.time()
+        self.connection.send(task)
+
+    def stop(self, kill=False):
+        """Stop the process, gracefully unless kill is True"""
+        if kill is False:
+            try:
+                self.connection.send(None)
+            except (OSError, ValueError):
+                kill = True
+        if kill is True:
+            self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class SupervisedPool(object):
+    """
+    Pool of worker processes enforcing per-document limits
+
+    Workers exceeding the wall-clock limit are killed and replaced, the CPU limit
+    is enforced inside the workers. Workers are recycled after a number of tasks
+    or above a memory threshold. Timed-out documents are listed in the timeouts
+    attribute (and appended to the report file if given) for later replay.
+
+    :param workers:
+        Number of worker processes
+    :type workers: integer
+    :param time_limit:
+        Wall-clock limit per document in seconds
+    :type time_limit: float
+    :param cpu_limit:
+        CPU time limit per document in seconds (None to disable, Unix only)
+    :type cpu_limit: float
+    :param max_tasks:
+        Number of tasks after which a worker is replaced
+    :type max_tasks: integer
+    :param max_rss:
+        Resident memory in MB above which a worker is replaced
+    :type max_rss: float
+    :param function:
+        Function applied to each task (a dictionary), by default dating with find_date
+    :param initializer:
+        Function run at the start of each worker
+    :param report:
+        File to which timed-out documents are appended (JSON lines)
+    :type report: string
+
+    """
+
+    def __init__(self, workers=multiprocessing.cpu_count(), time_limit=POOL_TIME_LIMIT, cpu_limit=None,
+                 max_tasks=POOL_MAX_TASKS, max_rss=POOL_MAX_RSS, function=run_task, initializer=None, report=None):
+        self.size = workers
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.function = function
+        self.initializer = initializer
+        self.report = report
+        self.timeouts = []
+        self.recycled = 0
+        self.workers = [self._spawn() for _ in range(workers)]
+
+    def _spawn(self):
+        return Worker(self.function, self.initializer, self.cpu_limit)
+
+    def _replace(self, worker, kill=False):
+        """Stop a worker and start a new one in its place"""
+        worker.stop(kill)
+        self.workers[self.workers.index(worker)] = self._spawn()
+        self.recycled += 1
+
+    def _record(self, task, reason):
+        """Log a document which exceeded its limits for later replay"""
+        LOGGER.error('%s: document %s (%s)', reason, task.get('id'), task.get('url'))
+        self.timeouts.append(task.get('id'))
+        if self.report is not None:
+            with open(self.report, 'a', encoding='utf-8') as reportfile:
+                reportfile.write(json.dumps({'id': task.get('id'), 'url': task.get('url'), 'error': reason}) + '\n')
+
+    def _timed_out(self, worker, reason):
+        """Record and return the result of a task whose worker is lost"""
+        task = worker.task
+        self._record(task, reason)
+        result = {'id': task.get('id'), 'date': None, 'stage': None, 'error': reason}
+        if task.get('url') is not None:
+            result['url'] = task['url']
+        return result
+
+    def imap_unordered(self, tasks):
+        """
+        Process the tasks and yield the results in order of completion
+
+        :param tasks:
+            Iterable of dictionaries (e.g. html, url, id and find_date options),
+            tasks without id are numbered in input order
+        :return: Generator of result dictionaries
+
+        """
+        tasks = iter(tasks)
+        exhausted = False
+        counter = 0
+        while True:
+            # assign tasks to idle workers
+            for worker in list(self.workers):
+                if worker.task is None and not exhausted:
+                    try:
+                        task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if task.get('id') is None:
+                        task = dict(task, id=counter)
+                    counter += 1
+                    worker.submit(task)
+            busy = [worker for worker in self.workers if worker.task is not None]
+            if not busy:
+                break
+            # wait for results until the next deadline
+            deadline = min(worker.started for worker in busy) + self.time_limit
+            ready = wait([worker.connection for worker in busy], timeout=max(0, deadline - time.time()))
+            for worker in busy:
+                if worker.connection in ready:
+                    try:
+                        result, rss = worker.connection.recv()
+                    except (EOFError, OSError):
+                        # the process died (e.g. out of memory)
+                        yield self._timed_out(worker, 'worker crashed')
+                        self._replace(worker, kill=True)
+                        continue
+                    if result.get('error') == 'cpu time limit':
+                        self._record(worker.task, 'cpu time limit')
+                    worker.task = None
+                    worker.tasks += 1
+                    yield collect_metrics(result)
+                    if worker.tasks >= self.max_tasks or rss > self.max_rss:
+                        LOGGER.debug('recycling worker after %s tasks, %.1f MB', worker.tasks, rss)
+                        self._replace(worker)
+                elif time.time() - worker.started > self.time_limit:
+                    yield self._timed_out(worker, 'time limit')
+                    self._replace(worker, kill=True)
+
+    def map(self, tasks):
+        """Process the tasks and return the results in input order"""
+        tasks = [dict(task, id=i) if task.get('id') is None else task for i, task in enumerate(tasks)]
+        results = {result['id']: result for result in self.imap_unordered(tasks)}
+        return [results[task['id']] for task in tasks]
+
+    def close(self):
+        """Stop all workers"""
+        for worker in self.workers:
+            worker.stop(kill=worker.task is not None)
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Per-domain extraction profiles tried before the generic cascade.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import datetime
+import fnmatch
+import json
+import logging
+import os
+
+from urllib.parse import urlsplit
+
+# third-party
+from lxml import etree
+
+# third-party, optional
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# own
+from .core import try_expression
+from .utils import bounded_text, fetch_url, load_html
+from .validators import date_validator
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def compile_rule(rule):
+    """Convert a rule (dictionary with xpath and optional attribute and format) to a tuple"""
+    if isinstance(rule, str):
+        rule = {'xpath': rule}
+    if 'xpath' not in rule:
+        raise ValueError('rule without xpath: %s' % rule)
+    try:
+        xpath = etree.XPath(rule['xpath'])
+    except etree.XPathSyntaxError as err:
+        raise ValueError('invalid xpath %s: %s' % (rule['xpath'], err))
+    return xpath, rule.get('attribute'), rule.get('format')
+
+
+def parse_value(value, dateformat, outputformat):
+    """Convert the value found by a rule using the expected format or the fast heuristics"""
+    if dateformat is None:
+        return try_expression(value, outputformat, False)
+    try:
+        dateobject = datetime.datetime.strptime(value.strip(), dateformat)
+    except ValueError:
+        LOGGER.debug('unexpected format: %s %s', value, dateformat)
+        return None
+    if date_validator(dateobject, outputformat) is True:
+        return dateobject.strftime(outputformat)
+    return None
+
+
+class Profile(object):
+    """
+    Ordered extraction rules for a host
+
+    :param host:
+        Host name or pattern (e.g. "*.example.org")
+    :type host: string
+    :param rules:
+        List of XPath expressions or dictionaries with the keys xpath,
+        attribute (value to read on the elements found) and format (expected
+        date format, see datetime.strptime())
+    :type rules: list
+    :param samples:
+        List of dictionaries with the keys file (path relative to the profile file)
+        or url, and date (expected result)
+    :type samples: list
+
+    """
+
+    def __init__(self, host, rules, samples=None):
+        self.host = host
+        self.rules = [compile_rule(rule) for rule in rules]
+        self.samples = samples or []
+        for sample in self.samples:
+            if 'file' not in sample and 'url' not in sample:
+                raise ValueError('sample without file or url: %s' % sample)
+
+    def extract(self, tree, outputformat='%Y-%m-%d'):
+        """Return a tuple (date or None, index of the matching rule or None)"""
+        for i, (xpath, attribute, dateformat) in enumerate(self.rules):
+            for match in xpath(tree):
+                if attribute is not None:
+                    value = match.get(attribute) if isinstance(match, etree._Element) else None
+                elif isinstance(match, etree._Element):
+                    # beginning of the text only, as in examine_date_elements
+                    value = bounded_text(match.itertext(), 48)
+                else:
+                    value = str(match)
+                if not value:
+                    continue
+                result = parse_value(value, dateformat, outputformat)
+                if result is not None:
+                    return result, i
+        return None, None
+
+
+class ProfileSet(object):
+    """
+    Profiles compiled once and selected by host name
+
+    :param profiles:
+        Dictionary mapping host names or patterns to a list of rules or to a
+        dictionary with the keys rules and samples (see Profile)
+    :type profiles: dict
+
+    """
+
+    def __init__(self, profiles):
+        self.hosts = dict()
+        self.patterns = []
+        for host, profile in profiles.items():
+            if isinstance(profile, list):
+                profile = {'rules': profile}
+            compiled = Profile(host, profile.get('rules', []), profile.get('samples'))
+            if any(char in host for char in '*?['):
+                self.patterns.append((host, compiled))
+            else:
+                self.hosts[host.lower()] = compiled
+
+    def __len__(self):
+        return len(self.hosts) + len(self.patterns)
+
+    def __iter__(self):
+        return iter(list(self.hosts.values()) + [profile for _, profile in self.patterns])
+
+    def select(self, url):
+        """Return the profile matching the host of the URL, or None"""
+        host = urlsplit(url).hostname
+        if host is None:
+            return None
+        if host in self.hosts:
+            return self.hosts[host]
+        if host.startswith('www.') and host[4:] in self.hosts:
+            return self.hosts[host[4:]]
+        for pattern, profile in self.patterns:
+            if fnmatch.fnmatch(host, pattern):
+                return profile
+        return None
+
+    def extract(self, tree, url, outputformat='%Y-%m-%d'):
+        """Apply the profile of the host to the tree, return a date or None"""
+        profile = self.select(url)
+        if profile is None:
+            return None
+        result, rule = profile.extract(tree, outputformat)
+        if result is not None:
+            LOGGER.debug('profile %s, rule %s: %s', profile.host, rule, result)
+        return result
+
+
+def load_profiles(filename):
+    """
+    Read and compile a profile file in JSON or YAML format (the latter requires PyYAML)
+
+    :param filename:
+        Path of the file
+    :type filename: string
+    :return: Returns a ProfileSet
+    :raises ValueError: if the file, a rule or a sample is invalid
+
+    """
+    with open(filename, 'r', encoding='utf-8') as inputfile:
+        if filename.endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise ValueError('PyYAML is required to read %s' % filename)
+            content = yaml.safe_load(inputfile)
+        else:
+            content = json.load(inputfile)
+    if not isinstance(content, dict):
+        raise ValueError('profiles must map hosts to rules: %s' % filename)
+    return ProfileSet(content)
+
+
+def validate_profiles(profiles, basedir='.'):
+    """
+    Run each profile on its sample pages
+
+    :param profiles:
+        Compiled profiles
+    :type profiles: ProfileSet
+    :param basedir:
+        Directory the paths of the samples are relative to
+    :type basedir: string
+    :return: Generator of dictionaries (host, sample, rule, date, expected, ok)
+
+    """
+    for profile in profiles:
+        if not profile.samples:
+            LOGGER.warning('no samples for %s', profile.host)
+        for sample in profile.samples:
+            if 'file' in sample:
+                name = sample['file']
+                with open(os.path.join(basedir, name), 'r', encoding='utf-8', errors='replace') as inputfile:
+                    tree = load_html(inputfile.read())
+            else:
+                name = sample['url']
+                tree = load_html(fetch_url(sample['url']))
+            if tree is None:
+                result, rule = None, None
+            else:
+                result, rule = profile.extract(tree)
+            expected = sample.get('date')
+            # unquoted dates are converted by YAML
+            if isinstance(expected, datetime.date):
+                expected = expected.strftime('%Y-%m-%d')
+            yield {
+                'host': profile.host,
+                'sample': name,
+                'rule': rule,
+                'date': result,
+                'expected': expected,
+                'ok': result is not None and (expected is None or result == expected),
+            }
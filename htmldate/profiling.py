@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of the extraction and capture of slow documents for replay.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import cProfile
+import hashlib
+import heapq
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+from collections import Counter
+from io import StringIO
+
+# third-party
+from lxml import html
+
+# own
+from .cache import URL_INPUT
+from .core import Document, find_date, format_result
+from .settings import PROFILE_INTERVAL, PROFILE_THRESHOLD
+from .utils import fetch_url, load_file
+
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_METHODS = ('cprofile', 'sampling')
+# options of find_date saved along with a slow document
+CAPTURED_OPTIONS = ('extensive_search', 'original_date', 'outputformat', 'url', 'details', 'budget_ms', 'mode')
+
+
+def serialize_document(htmlobject):
+    """Return the input of find_date as bytes"""
+    if isinstance(htmlobject, Document):
+        htmlobject = htmlobject.htmlobject
+    if isinstance(htmlobject, bytes):
+        return htmlobject
+    if isinstance(htmlobject, str):
+        return htmlobject.encode('utf-8', errors='replace')
+    return html.tostring(htmlobject, encoding='utf-8')
+
+
+def describe_code(code):
+    """Name of a function along with the end of its file path and its first line"""
+    filename = os.sep.join(code.co_filename.split(os.sep)[-2:])
+    return '%s (%s:%s)' % (code.co_name, filename, code.co_firstlineno)
+
+
+class Profiler(object):
+    """
+    Run each document through cProfile or a sampling thread, aggregate the
+    functions taking up the time across a batch and save the documents above
+    a latency threshold along with their options (see replay). Only one
+    document is profiled at a time, concurrent ones are timed only.
+
+    :param method:
+        "cprofile" (deterministic, every Python call is counted), "sampling"
+        (stack of the processing thread recorded every interval, lower
+        overhead) or None (timing and capture only)
+    :type method: string
+    :param threshold_ms:
+        Latency in milliseconds above which a document is saved
+    :type threshold_ms: float
+    :param capture_dir:
+        Directory in which the slow documents are saved (None to disable)
+    :type capture_dir: string
+    :param interval:
+        Time between two stack samples in seconds
+    :type interval: float
+    :param slowest:
+        Number of slowest documents listed in the report
+    :type slowest: integer
+
+    """
+
+    def __init__(self, method='cprofile', threshold_ms=PROFILE_THRESHOLD, capture_dir=None, interval=PROFILE_INTERVAL, slowest=10):
+        if method is not None and method not in PROFILE_METHODS:
+            raise ValueError('unknown profiling method: %s' % method)
+        self.method = method
+        self.threshold_ms = threshold_ms
+        self.capture_dir = capture_dir
+        self.interval = interval
+        self.slowest = slowest
+        self.lock = threading.Lock()
+        # counters, ranking and captured files, updated by concurrent documents
+        self.stats_lock = threading.Lock()
+        self.profile = cProfile.Profile() if method == 'cprofile' else None
+        self.documents = 0
+        self.seconds = 0.0
+        self.captured = []
+        self.ranking = []
+        # sampling
+        self.samples = 0
+        self.leaves = Counter()
+        self.stacks = Counter()
+        self.target = None
+        self.active = threading.Event()
+        self.sampler = None
+
+    def run(self, function, htmlobject, options, label=None):
+        """Call function(htmlobject, **options) under the profiler and record its duration,
+           the label (e.g. file name) identifies the document in the report"""
+        # URLs are downloaded beforehand (not timed) so that the page is captured and not its URL
+        if isinstance(htmlobject, str) and URL_INPUT.match(htmlobject):
+            label = label or htmlobject
+            htmlobject = fetch_url(htmlobject)
+            if htmlobject is None:
+                return format_result(None, None, options.get('details', False), None, False)
+        profiled = self.method is not None and self.lock.acquire(blocking=False)
+        start = time.perf_counter()
+        try:
+            if profiled:
+                self.enable()
+            return function(htmlobject, **options)
+        finally:
+            if profiled:
+                self.disable()
+                self.lock.release()
+            self.record(htmlobject, options, time.perf_counter() - start, label)
+
+    def enable(self):
+        """Start profiling the current thread"""
+        if self.method == 'cprofile':
+            self.profile.enable()
+        else:
+            self.target = threading.get_ident()
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, name='htmldate-sampler', daemon=True)
+                self.sampler.start()
+            self.active.set()
+
+    def disable(self):
+        """Stop profiling"""
+        if self.method == 'cprofile':
+            self.profile.disable()
+        else:
+            self.active.clear()
+
+    def sample(self):
+        """Record the stack of the profiled thread at regular intervals"""
+        while True:
+            self.active.wait()
+            time.sleep(self.interval)
+            if not self.active.is_set():
+                continue
+            frame = sys._current_frames().get(self.target)
+            codes = []
+            # frames above Profiler.run are left out
+            while frame is not None and frame.f_code is not RUN_CODE:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if codes:
+                self.samples += 1
+                self.leaves[codes[0]] += 1
+                self.stacks.update(set(codes))
+
+    def record(self, htmlobject, options, duration, label=None):
+        """Count a document and save it if it is too slow"""
+        with self.stats_lock:
+            self.documents += 1
+            self.seconds += duration
+            number = self.documents
+        label = label or options.get('url')
+        if duration * 1000 >= self.threshold_ms and self.capture_dir is not None:
+            filename = self.capture(htmlobject, options, duration, label)
+            if label is None:
+                label = filename
+        entry = (duration, number, label or 'document %d' % number)
+        with self.stats_lock:
+            if len(self.ranking) < self.slowest:
+                heapq.heappush(self.ranking, entry)
+            else:
+                heapq.heappushpop(self.ranking, entry)
+
+    def capture(self, htmlobject, options, duration, label=None):
+        """Save the document and its options in the capture directory, return the file name"""
+        content = serialize_document(htmlobject)
+        captured = {key: options[key] for key in CAPTURED_OPTIONS if key in options}
+        # one file per document and set of options
+        name = hashlib.sha1(content + json.dumps(captured, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        filename = os.path.join(self.capture_dir, name + '.html')
+        metadata = {
+            'document': name + '.html',
+            'options': captured,
+            'source': label,
+            'duration_ms': duration * 1000,
+            'captured': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        try:
+            os.makedirs(self.capture_dir, exist_ok=True)
+            with open(filename, 'wb') as outputfile:
+                outputfile.write(content)
+            with open(os.path.join(self.capture_dir, name + '.json'), 'w', encoding='utf-8') as outputfile:
+                json.dump(metadata, outputfile)
+        except OSError as err:
+            LOGGER.error('capture failed: %s %s', filename, err)
+            return None
+        LOGGER.warning('slow document (%.1f ms) saved as %s', duration * 1000, filename)
+        with self.stats_lock:
+            self.captured.append(filename)
+        return filename
+
+    def report(self, limit=30):
+        """Return the summary of the batch and the functions taking up the time, in text form"""
+        with self.stats_lock:
+            documents, seconds, captured = self.documents, self.seconds, len(self.captured)
+            ranking = sorted(self.ranking, reverse=True)
+        lines = ['# {} documents, {:.2f} s, {:.1f} ms per document, {} captured above {} ms'.format(
+            documents, seconds, seconds / documents * 1000 if documents else 0.0,
+            captured, self.threshold_ms)]
+        if ranking:
+            lines.append('# slowest documents:')
+            for duration, _, label in ranking:
+                lines.append('#   {:10.1f} ms  {}'.format(duration * 1000, label))
+        if self.method == 'cprofile':
+            stream = StringIO()
+            stats = pstats.Stats(self.profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(limit)
+            lines.append(stream.getvalue().strip('\n'))
+        elif self.method == 'sampling':
+            lines.append('# {} samples every {} ms'.format(self.samples, self.interval * 1000))
+            lines.append('{:>8} {:>8} {:>8}  {}'.format('self', 'total', 'total %', 'function'))
+            for code, count in self.stacks.most_common(limit):
+                lines.append('{:8d} {:8d} {:7.1f}%  {}'.format(
+                    self.leaves[code], count, count / self.samples * 100, describe_code(code)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Write the report to a file"""
+        with open(filename, mode='w', encoding='utf-8') as outputfile:
+            outputfile.write(self.report())
+
+    def dump_stats(self, filename):
+        """Write the cProfile statistics in binary form (for pstats, snakeviz, etc.)"""
+        if self.profile is None:
+            raise ValueError('no cProfile statistics with method %s' % self.method)
+        self.profile.dump_stats(filename)
+
+
+RUN_CODE = Profiler.run.__code__
+
+
+def iterate_captures(directory):
+    """Yield the documents saved in a capture directory as tuples (file name, HTML string, metadata)"""
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as inputfile:
+                metadata = json.load(inputfile)
+        except (OSError, ValueError) as err:
+            LOGGER.error('invalid capture: %s %s', filename, err)
+            continue
+        htmlstring = load_file(os.path.join(directory, metadata['document']))
+        if htmlstring is None:
+            continue
+        yield metadata['document'], htmlstring, metadata
+
+
+def replay(directory, profiler=None):
+    """
+    Run the documents of a capture directory again with their options
+
+    :param directory:
+        Capture directory (see Profiler)
+    :type directory: string
+    :param profiler:
+        Profiler used for the replay (without capture)
+    :type profiler: Profiler
+    :return: Generator of tuples (file name, duration when captured in ms,
+        duration of the replay in ms, result)
+
+    """
+    for filename, htmlstring, metadata in iterate_captures(directory):
+        start = time.perf_counter()
+        if profiler is not None:
+            result = profiler.run(find_date, htmlstring, metadata['options'], label=filename)
+        else:
+            result = find_date(htmlstring, **metadata['options'])
+        yield filename, metadata.get('duration_ms'), (time.perf_counter() - start) * 1000, result
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent downloads with per-host politeness rules.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import logging
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+# own
+from .settings import HOST_BUFFER, HOST_DELAY, HOST_MAX_ERRORS, SLOW_HOST_LATENCY
+from .utils import fetch_url
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class HostState(object):
+    """Queue and statistics of a single host"""
+
+    def __init__(self):
+        self.queue = deque()
+        self.active = 0
+        self.next_allowed = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.latency = None
+
+    def record(self, duration, success, alpha=0.3):
+        """Update the moving average of the latency and the error counters"""
+        self.requests += 1
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency = alpha * duration + (1 - alpha) * self.latency
+        if success is True:
+            self.consecutive_errors = 0
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+
+
+class HostScheduler(object):
+    """
+    Fetch URLs concurrently, interleaving hosts round-robin
+
+    Each host has its own queue, a maximum number of simultaneous requests and a
+    minimum delay between requests. Hosts whose average latency exceeds a
+    threshold can only occupy half of the workers, hosts returning repeated
+    errors are backed off and eventually abandoned.
+
+    :param workers:
+        Number of concurrent downloads
+    :type workers: integer
+    :param per_host:
+        Maximum number of concurrent downloads per host
+    :type per_host: integer
+    :param delay:
+        Minimum delay in seconds between the requests to a host
+    :type delay: float
+    :param fetch:
+        Download function taking an URL and returning the HTML text or None
+
+    """
+
+    def __init__(self, workers=8, per_host=1, delay=HOST_DELAY, fetch=fetch_url,
+                 slow_latency=SLOW_HOST_LATENCY, max_errors=HOST_MAX_ERRORS, buffer=HOST_BUFFER):
+        self.workers = workers
+        self.per_host = per_host
+        self.delay = delay
+        self.fetch = fetch
+        self.slow_latency = slow_latency
+        self.max_errors = max_errors
+        self.buffer = buffer
+        self.hosts = dict()
+        self.rotation = deque()
+        self.queued = 0
+        self.dropped = set()
+        self.skipped = deque()
+
+    def _add(self, url):
+        """Append an URL to the queue of its host"""
+        host = urlsplit(url).netloc.lower()
+        if host in self.dropped:
+            self.skipped.append(url)
+            return
+        if host not in self.hosts:
+            self.hosts[host] = HostState()
+        state = self.hosts[host]
+        if not state.queue:
+            self.rotation.append(host)
+        state.queue.append(url)
+        self.queued += 1
+
+    def _is_slow(self, state):
+        return state.latency is not None and state.latency > self.slow_latency
+
+    def _next_url(self, now, slow_active):
+        """Pick the next URL by round-robin over the eligible hosts"""
+        for _ in range(len(self.rotation)):
+            host = self.rotation[0]
+            self.rotation.rotate(-1)
+            state = self.hosts[host]
+            if state.active >= self.per_host or state.next_allowed > now:
+                continue
+            # slow hosts do not take up all the worker slots
+            if self._is_slow(state) and slow_active >= max(1, self.workers // 2):
+                continue
+            url = state.queue.popleft()
+            self.queued -= 1
+            if not state.queue:
+                self.rotation.remove(host)
+            return host, url
+        return None, None
+
+    def _drop_host(self, host):
+        """Abandon the current and future URLs of a failing host"""
+        state = self.hosts[host]
+        LOGGER.error('too many errors, skipping host: %s', host)
+        self.dropped.add(host)
+        self.skipped.extend(state.queue)
+        self.queued -= len(state.queue)
+        state.queue.clear()
+        if host in self.rotation:
+            self.rotation.remove(host)
+
+    def _timed_fetch(self, url):
+        start = time.time()
+        result = self.fetch(url)
+        return result, time.time() - start
+
+    def fetch_all(self, urls):
+        """
+        Download the URLs and yield (URL, HTML text or None) tuples in order of completion
+
+        :param urls:
+            Iterable of URLs, read progressively
+        :return: Generator of tuples
+
+        """
+        urls = iter(urls)
+        exhausted = False
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # fill the host queues
+                while not exhausted and self.queued < self.buffer:
+                    try:
+                        url = next(urls).strip()
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        if url:
+                            self._add(url)
+                while self.skipped:
+                    yield self.skipped.popleft(), None
+                # dispatch
+                now = time.time()
+                slow_active = sum(1 for host, _ in running.values() if self._is_slow(self.hosts[host]))
+                while len(running) < self.workers:
+                    host, url = self._next_url(now, slow_active)
+                    if url is None:
+                        break
+                    state = self.hosts[host]
+                    state.active += 1
+                    if self._is_slow(state):
+                        slow_active += 1
+                    running[executor.submit(self._timed_fetch, url)] = (host, url)
+                if not running:
+                    if self.queued == 0 and exhausted:
+                        break
+                    # wait for the next host to become available
+                    waiting = [self.hosts[host].next_allowed for host in self.rotation]
+                    time.sleep(max(0, min(waiting) - time.time()) if waiting else 0)
+                    continue
+                # collect, or wake up when a host waiting for its delay becomes available
+                waiting = [self.hosts[host].next_allowed for host in self.rotation
+                           if self.hosts[host].active < self.per_host and self.hosts[host].next_allowed > now]
+                timeout = max(0.001, min(waiting) - now) if waiting and len(running) < self.workers else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host, url = running.pop(future)
+                    state = self.hosts[host]
+                    state.active -= 1
+                    htmltext, duration = future.result()
+                    state.record(duration, htmltext is not None)
+                    # back off exponentially after errors
+                    backoff = 2 ** min(state.consecutive_errors, 6) if state.consecutive_errors else 1
+                    state.next_allowed = time.time() + self.delay * backoff
+                    if state.consecutive_errors >= self.max_errors and host not in self.dropped:
+                        self._drop_host(host)
+                    yield url, htmltext
+
+    def stats(self):
+        """Return per-host statistics (requests, errors, average latency)"""
+        return {
+            host: {'requests': state.requests, 'errors': state.errors, 'latency': state.latency}
+            for host, state in self.hosts.items()
+        }
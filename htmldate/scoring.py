@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Candidate scoring: gather the dates found by the cheap stages in one pass,
+score them together and only run the expensive stages when unsure.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import datetime
+import logging
+import math
+import re
+
+from array import array
+
+# third-party
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# own
+from .core import DATE_EXPRESSIONS, MODES, XPATHS, Document, examine_header, examine_text_patterns, expired, search_page, try_ymd_date
+from .parsers import extract_partial_url_date, extract_url_date
+from .settings import SCORING_DECAY, SCORING_MAX_CANDIDATES, SCORING_THRESHOLD, SCORING_VECTOR_ROWS, SCORING_WEIGHTS
+from .utils import bounded_text
+from .validators import convert_date, date_validator, output_format_validator
+
+
+LOGGER = logging.getLogger(__name__)
+
+# stages providing candidates, stored as their index in the table
+STAGES = ('profile', 'url', 'header', 'abbr', 'expression', 'time', 'json', 'timestamp', 'german', 'partial_url', 'search_page')
+STAGE_INDEX = {stage: index for index, stage in enumerate(STAGES)}
+# rules: index in DATE_EXPRESSIONS for the expressions,
+# abbr: 0 data-utime, 1 title, 2 text of published abbr, 3 text of any abbr
+# time: 0 entry-date, 1 updated, 2 datetime attribute, 3 text
+# upper bound of the weights, a single candidate cannot be certain
+MAX_WEIGHT = 0.999
+# DATE_EXPRESSIONS as predicates on (tag, class, id, itemprop), evaluated in a single pass over the tree
+EXPRESSION_RULES = (
+    lambda tag, cls, ident, itemprop: 'date' in cls or 'Date' in cls or 'datum' in cls or 'Datum' in cls,
+    lambda tag, cls, ident, itemprop: 'date' in ident or 'Date' in ident or 'datum' in ident or 'Datum' in ident,
+    lambda tag, cls, ident, itemprop: 'time' in cls or 'time' in ident,
+    lambda tag, cls, ident, itemprop: 'byline' in cls or 'subline' in cls or 'info' in cls,
+    lambda tag, cls, ident, itemprop: any(name in cls for name in ('postmeta', 'post-meta', 'entry-meta', 'postMeta', 'post_meta', 'post__meta')),
+    lambda tag, cls, ident, itemprop: cls in ('meta', 'meta-before', 'asset-meta'),
+    lambda tag, cls, ident, itemprop: 'published' in cls or 'posted' in cls or 'submitted' in cls or 'created-post' in cls,
+    lambda tag, cls, ident, itemprop: 'lastmod' in ident,
+    lambda tag, cls, ident, itemprop: 'date' in itemprop,
+    lambda tag, cls, ident, itemprop: tag == 'footer',
+    lambda tag, cls, ident, itemprop: cls == 'post-footer',
+    lambda tag, cls, ident, itemprop: cls == 'footer' or ident == 'footer',
+    lambda tag, cls, ident, itemprop: tag == 'small',
+    lambda tag, cls, ident, itemprop: 'author' in cls or 'autor' in cls or 'field-content' in cls or cls == 'meta',
+)
+
+
+def to_ordinal(datestring):
+    """Convert a date in %Y-%m-%d format to its proleptic Gregorian ordinal"""
+    return datetime.date(int(datestring[:4]), int(datestring[5:7]), int(datestring[8:10])).toordinal()
+
+
+def match_expressions(tree):
+    """Return the elements matching each of the DATE_EXPRESSIONS, in document order"""
+    matches = [[] for _ in EXPRESSION_RULES]
+    for elem in tree.xpath('//*'):
+        attrib = elem.attrib
+        if 'class' not in attrib and 'id' not in attrib and 'itemprop' not in attrib and elem.tag not in ('footer', 'small'):
+            continue
+        values = (elem.tag, attrib.get('class', ''), attrib.get('id', ''), attrib.get('itemprop', ''))
+        for i, rule in enumerate(EXPRESSION_RULES):
+            if rule(*values):
+                matches[i].append(elem)
+    return matches
+
+
+class CandidateTable(object):
+    """
+    Date candidates stored column-wise (date ordinal, stage, rule, position,
+    frequency), identical (date, stage, rule) triples share a row
+
+    Strings which could only be parsed by the expensive parsers are kept
+    apart until the table is completed (see CandidateScorer.examine)
+
+    """
+
+    def __init__(self):
+        self.ordinals = array('l')
+        self.stages = array('b')
+        self.rules = array('b')
+        self.positions = array('h')
+        self.frequencies = array('h')
+        self.rows = {}
+        self.unparsed = []
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def add(self, datestring, stage, rule=0, position=0):
+        """Store a date in %Y-%m-%d format found by a stage"""
+        key = (to_ordinal(datestring), STAGE_INDEX[stage], rule)
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = len(self.ordinals)
+            self.ordinals.append(key[0])
+            self.stages.append(key[1])
+            self.rules.append(rule)
+            self.positions.append(position)
+            self.frequencies.append(1)
+        else:
+            self.frequencies[row] += 1
+            self.positions[row] = min(self.positions[row], position)
+
+
+class CandidateScorer(object):
+    """
+    Score the date candidates of a document together
+
+    Each row gets the weight of its stage (or stage:rule, see SCORING_WEIGHTS)
+    decreasing with its position within the rule, the support of a date
+    combines the weights of its rows as independent evidence
+    (1 - product of (1 - weight) ** frequency), the confidence is the support
+    of the best date times its probability to be right if only one of the two
+    best dates is.
+
+    The expensive stages (dateparser, cleaning and serialization, text
+    patterns, search_page) only run while the confidence stays below the
+    threshold, the scores of large tables are computed with NumPy if it is
+    installed.
+
+    """
+
+    def __init__(self, weights=None, threshold=SCORING_THRESHOLD, decay=SCORING_DECAY, maxcandidates=SCORING_MAX_CANDIDATES, vectorized=True):
+        self.weights = dict(SCORING_WEIGHTS)
+        if weights is not None:
+            self.weights.update(weights)
+        self.threshold = threshold
+        self.decay = decay
+        self.maxcandidates = maxcandidates
+        # weight matrix indexed by stage and rule
+        self.matrix = [[self.weight(stage, rule) for rule in range(len(DATE_EXPRESSIONS))] for stage in STAGES]
+        self.vector = numpy.array(self.matrix) if vectorized is True and numpy is not None else None
+
+    def weight(self, stage, rule=0):
+        """Weight of a stage, possibly refined for one of its rules"""
+        weight = self.weights.get(stage + ':' + str(rule), self.weights.get(stage, 0.0))
+        return min(max(weight, 0.0), MAX_WEIGHT)
+
+    def score(self, table, original_date=False):
+        """Return the best date ordinal and the confidence, or (None, 0.0)"""
+        if len(table) == 0:
+            return None, 0.0
+        # NumPy only pays off on large tables
+        if self.vector is not None and len(table) >= SCORING_VECTOR_ROWS:
+            ordinals = numpy.frombuffer(table.ordinals, dtype=numpy.int64 if table.ordinals.itemsize == 8 else numpy.int32)
+            weights = self.vector[numpy.frombuffer(table.stages, dtype=numpy.int8), numpy.frombuffer(table.rules, dtype=numpy.int8)]
+            weights = weights * self.decay ** numpy.frombuffer(table.positions, dtype=numpy.int16)
+            logs = numpy.frombuffer(table.frequencies, dtype=numpy.int16) * numpy.log1p(-weights)
+            dates, inverse = numpy.unique(ordinals, return_inverse=True)
+            support = -numpy.expm1(numpy.bincount(inverse, weights=logs))
+            # best support first, then the oldest or the newest date
+            ranking = numpy.lexsort((dates if original_date is True else -dates, -support))
+            best = int(dates[ranking[0]])
+            first = float(support[ranking[0]])
+            second = float(support[ranking[1]]) if len(ranking) > 1 else 0.0
+        else:
+            sums = {}
+            for ordinal, stage, rule, position, frequency in zip(table.ordinals, table.stages, table.rules, table.positions, table.frequencies):
+                sums[ordinal] = sums.get(ordinal, 0.0) + frequency * math.log1p(-self.matrix[stage][rule] * self.decay ** position)
+            ranking = sorted(sums, key=lambda ordinal: (sums[ordinal], ordinal if original_date is True else -ordinal))
+            best = ranking[0]
+            first = -math.expm1(sums[ranking[0]])
+            second = -math.expm1(sums[ranking[1]]) if len(ranking) > 1 else 0.0
+        if first * (1 - second) == 0:
+            return best, 0.0
+        return best, first * first * (1 - second) / (first * (1 - second) + second * (1 - first))
+
+    def decide(self, table, original_date, outputformat, tracer=None):
+        """Return a tuple (date or None, stage of its strongest row or None, confidence)"""
+        best, confidence = self.score(table, original_date)
+        if tracer is not None:
+            tracer.event('scoring', candidate='%s rows' % len(table), result=datetime.date.fromordinal(best).isoformat() if best is not None else None, reason='confidence %.3f' % confidence)
+        if best is None:
+            return None, None, 0.0
+        # earlier stages first in case of equal weights
+        strongest = max((self.matrix[stage][rule] * self.decay ** position, -stage, rule) for ordinal, stage, rule, position in zip(table.ordinals, table.stages, table.rules, table.positions) if ordinal == best)
+        stage = STAGES[-strongest[1]]
+        if stage == 'expression':
+            stage += ':' + str(strongest[2])
+        return convert_date(datetime.date.fromordinal(best).isoformat(), '%Y-%m-%d', outputformat), stage, float(confidence)
+
+    def collect(self, table, value, stage, rule=0, position=0, language=None):
+        """Parse a string with the cheap parsers and store the result, or keep it for the expensive ones"""
+        result = try_ymd_date(value, '%Y-%m-%d', False, language=language)
+        if result is not None:
+            table.add(result, stage, rule, position)
+            return True
+        if value is not None and len(list(filter(str.isdigit, value))) >= 4:
+            table.unparsed.append((value, stage, rule, position))
+        return False
+
+    def collect_elements(self, table, elements, stage, rule, deadline=None, language=None):
+        """Gather the dates in the text of the elements"""
+        position = 0
+        for elem in elements:
+            if position >= self.maxcandidates or expired(deadline):
+                break
+            # same filters as examine_date_elements
+            textcontent = bounded_text(elem.itertext(), 48)
+            if not textcontent or len(textcontent) < 6:
+                continue
+            toexamine = re.sub(r'\D+$', '', textcontent)
+            if len(toexamine) < 7 or len(list(filter(str.isdigit, toexamine))) < 4:
+                continue
+            if self.collect(table, toexamine, stage, rule, position, language) is True:
+                position += 1
+
+    def gather(self, document, url, original_date, level, deadline=None, profiles=None, table=None, checked=False):
+        """Run the cheap stages allowed by the extraction tier and return the table,
+           the date in the URL is not looked up again if it has already been checked"""
+        if table is None:
+            table = CandidateTable()
+        tree = document.tree
+        if profiles is not None and url is not None:
+            result = profiles.extract(tree, url, '%Y-%m-%d')
+            if result is not None:
+                table.add(result, 'profile')
+        if url is not None and checked is False:
+            result = extract_url_date(url, '%Y-%m-%d')
+            if result is not None:
+                table.add(result, 'url')
+        if level < MODES.index('header'):
+            return table
+        language = document.language
+        result = examine_header(tree, '%Y-%m-%d', False, original_date, deadline, None, language, document.meta)
+        if result is not None:
+            table.add(result, 'header')
+        if level < MODES.index('structural'):
+            return table
+        # abbr
+        for position, elem in enumerate(XPATHS['//abbr'](tree)[:self.maxcandidates]):
+            if 'data-utime' in elem.attrib:
+                try:
+                    result = datetime.datetime.fromtimestamp(int(elem.get('data-utime'))).strftime('%Y-%m-%d')
+                except (OverflowError, OSError, ValueError):
+                    result = None
+                if result is not None and date_validator(result, '%Y-%m-%d') is True:
+                    table.add(result, 'abbr', 0, position)
+            if elem.get('class') in ('published', 'date-published', 'time published'):
+                if 'title' in elem.attrib:
+                    self.collect(table, bounded_text((elem.get('title'),), 48), 'abbr', 1, position, language)
+                if elem.text and len(elem.text) > 10:
+                    self.collect(table, bounded_text((re.sub(r'^am ', '', elem.text),), 48), 'abbr', 2, position, language)
+        self.collect_elements(table, XPATHS['//abbr'](tree), 'abbr', 3, deadline, language)
+        # expressions
+        for i, elements in enumerate(match_expressions(tree)):
+            if expired(deadline):
+                break
+            self.collect_elements(table, elements, 'expression', i, deadline, language)
+        # time
+        for position, elem in enumerate(XPATHS['//time'](tree)[:self.maxcandidates]):
+            if 'datetime' in elem.attrib and len(elem.get('datetime')) > 6:
+                if 'class' not in elem.attrib:
+                    rule = 2
+                elif elem.get('class').startswith('entry-date') or elem.get('class').startswith('entry-time'):
+                    rule = 0
+                elif elem.get('class') == 'updated' and original_date is False:
+                    rule = 1
+                else:
+                    continue
+                self.collect(table, bounded_text((elem.get('datetime'),), 48), 'time', rule, position, language)
+            elif elem.text is not None and len(elem.text) > 6:
+                self.collect(table, bounded_text((elem.text,), 48), 'time', 3, position, language)
+        return table
+
+    def examine(self, htmlobject, extensive_search, original_date, outputformat, url, deadline=None, mode='full', profiles=None, tracer=None):
+        """Score the candidates of the cheap stages, add the ones of the expensive stages while the confidence is too low,
+           return a tuple (date or None, deciding stage or None, confidence)"""
+        document = htmlobject if isinstance(htmlobject, Document) else Document(htmlobject)
+        if outputformat != '%Y-%m-%d' and output_format_validator(outputformat) is False:
+            return None, None, 0.0
+        if mode not in MODES:
+            LOGGER.error('unknown extraction mode: %s', mode)
+            return None, None, 0.0
+        level = MODES.index(mode)
+        # URL given by the caller: no need to parse the document if its date is confident enough,
+        # unless a profile of the host comes first
+        table = CandidateTable()
+        checked = url is not None and (profiles is None or profiles.select(url) is None)
+        if checked is True:
+            result = extract_url_date(url, '%Y-%m-%d')
+            if result is not None:
+                table.add(result, 'url')
+                if self.score(table, original_date)[1] >= self.threshold:
+                    return self.decide(table, original_date, outputformat, tracer)
+        if document.tree is None:
+            return None, None, 0.0
+        if url is None:
+            for elem in XPATHS['//link[@rel="canonical"]'](document.tree):
+                if 'href' in elem.attrib:
+                    url = elem.get('href')
+        table = self.gather(document, url, original_date, level, deadline, profiles, table, checked)
+        decision = self.decide(table, original_date, outputformat, tracer)
+        # expensive stages, each one only if the previous ones did not settle the matter
+        if decision[2] < self.threshold and extensive_search is True and level >= MODES.index('header') and not expired(deadline):
+            if STAGE_INDEX['header'] not in table.stages:
+                result = examine_header(document.tree, '%Y-%m-%d', True, original_date, deadline, None, document.language, document.meta)
+                if result is not None:
+                    table.add(result, 'header')
+            for value, stage, rule, position in table.unparsed:
+                if expired(deadline):
+                    break
+                result = try_ymd_date(value, '%Y-%m-%d', True, deadline=deadline, language=document.language)
+                if result is not None:
+                    table.add(result, stage, rule, position)
+            decision = self.decide(table, original_date, outputformat, tracer)
+        htmlstring = None
+        if decision[2] < self.threshold and level >= MODES.index('patterns') and not expired(deadline):
+            htmlstring = document.htmlstring
+            result, stage = examine_text_patterns(htmlstring, '%Y-%m-%d')
+            if result is not None:
+                table.add(result, stage)
+                decision = self.decide(table, original_date, outputformat, tracer)
+        if decision[2] < self.threshold and url is not None:
+            result = extract_partial_url_date(url, '%Y-%m-%d')
+            if result is not None:
+                table.add(result, 'partial_url')
+                decision = self.decide(table, original_date, outputformat, tracer)
+        if decision[2] < self.threshold and extensive_search is True and mode == 'full' and htmlstring is not None and not expired(deadline):
+            result = search_page(htmlstring, '%Y-%m-%d', original_date)
+            if result is not None:
+                table.add(result, 'search_page')
+                decision = self.decide(table, original_date, outputformat, tracer)
+        return decision
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP server keeping warm extraction processes.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import json
+import logging
+import multiprocessing
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+# own
+from .core import find_date, warmup
+from .metrics import METRICS, PROMETHEUS_CONTENT_TYPE
+from .settings import MAX_FILE_SIZE
+from .utils import decode_content, load_file
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def run_task(task, profiler=None):
+    """Date a single document described by a dictionary (html or path of a stored file, url and options)"""
+    try:
+        htmlobject = task.get('html')
+        # stored files are read by the workers
+        if htmlobject is None and task.get('path') is not None:
+            htmlobject = load_file(task['path'])
+            if htmlobject is None:
+                raise ValueError('unreadable file')
+        options = dict(
+            extensive_search=task.get('extensive_search', True),
+            original_date=task.get('original_date', False),
+            outputformat=task.get('outputformat', '%Y-%m-%d'),
+            url=task.get('url'),
+            details=True,
+            budget_ms=task.get('budget_ms'),
+            mode=task.get('mode', 'full'),
+        )
+        if profiler is not None:
+            result = profiler.run(find_date, htmlobject, options, label=task.get('path') or task.get('url'))
+        else:
+            result = find_date(htmlobject, **options)
+    except Exception as err:  # a faulty document must not bring the worker down
+        LOGGER.error('extraction error: %s %s', task.get('url') or task.get('path'), err)
+        result = {'date': None, 'stage': None, 'error': str(err)}
+        if METRICS.enabled is True:
+            METRICS.inc('htmldate_extraction_errors_total')
+    for key in ('id', 'path', 'url'):
+        if task.get(key) is not None:
+            result[key] = task[key]
+    # values recorded in a worker process, added to the registry of the parent (see collect_metrics)
+    if METRICS.enabled is True:
+        result['metrics'] = METRICS.drain()
+    return result
+
+
+def collect_metrics(result):
+    """Move the metrics returned by run_task to the registry of the current process"""
+    snapshot = result.pop('metrics', None)
+    if snapshot is not None:
+        METRICS.merge(snapshot)
+    return result
+
+
+def parse_options(query):
+    """Convert query parameters to extraction options"""
+    params = parse_qs(query)
+    options = dict()
+    if 'fast' in params:
+        options['extensive_search'] = params['fast'][0] in ('0', 'false')
+    if 'original' in params:
+        options['original_date'] = params['original'][0] in ('1', 'true')
+    if 'format' in params:
+        options['outputformat'] = params['format'][0]
+    if 'url' in params:
+        options['url'] = params['url'][0]
+    if 'budget' in params:
+        options['budget_ms'] = float(params['budget'][0])
+    if 'mode' in params:
+        options['mode'] = params['mode'][0]
+    return options
+
+
+class ExtractionServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server sending documents to a pool of pre-warmed processes
+
+    :param address:
+        Tuple (host, port)
+    :param workers:
+        Number of worker processes, 0 to process documents in the server threads
+    :type workers: integer
+    :param freeze:
+        Freeze the objects loaded during the warm-up (see core.warmup)
+    :type freeze: boolean
+    :param metrics:
+        Record the metrics exposed at /metrics until the server is closed
+        (see metrics.METRICS)
+    :type metrics: boolean
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=multiprocessing.cpu_count(), freeze=False, metrics=False):
+        HTTPServer.__init__(self, address, RequestHandler)
+        self.workers = workers
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.stages = Counter()
+        # warm up before forking so that the workers share the loaded data
+        warmup(freeze=freeze)
+        # inherited by the forked workers
+        self.metrics = metrics
+        if metrics is True:
+            METRICS.enable()
+        if workers > 0:
+            # forked workers inherit the warm state, others start from scratch
+            if multiprocessing.get_start_method() == 'fork':
+                self.pool = multiprocessing.Pool(workers)
+            else:
+                self.pool = multiprocessing.Pool(workers, initializer=warmup, initargs=(freeze,))
+        else:
+            self.pool = None
+
+    def extract(self, tasks):
+        """Process a list of tasks and update the statistics"""
+        start = time.time()
+        if self.pool is not None:
+            results = self.pool.map(run_task, tasks)
+        else:
+            results = [run_task(task) for task in tasks]
+        for result in results:
+            collect_metrics(result)
+        with self.lock:
+            self.counts['documents'] += len(results)
+            self.counts['dated'] += sum(1 for result in results if result['date'] is not None)
+            self.counts['errors'] += sum(1 for result in results if 'error' in result)
+            self.counts['seconds'] += time.time() - start
+            self.stages.update(result['stage'] for result in results if result['stage'] is not None)
+        return results
+
+    def stats(self):
+        """Return the server statistics"""
+        with self.lock:
+            stats = dict(self.counts)
+            stats['stages'] = dict(self.stages)
+        stats['workers'] = self.workers
+        stats['uptime'] = time.time() - self.started
+        return stats
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        if self.metrics is True:
+            METRICS.disable()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints: POST /date (HTML document as body, options as query parameters:
+    fast, original, format, url, mode and budget in milliseconds),
+    POST /batch (JSON list of objects with html, url, id and options),
+    GET /health, GET /stats and GET /metrics (Prometheus text format)
+    """
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """Return the request body as bytes, None if it is too large
+           (raises ValueError if its length is invalid)"""
+        length = int(self.headers.get('Content-Length', 0))
+        if length < 0:
+            raise ValueError('negative Content-Length')
+        if length > MAX_FILE_SIZE:
+            return None
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif path == '/stats':
+            self.send_json(200, self.server.stats())
+        elif path == '/metrics':
+            body = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        parsed = urlsplit(self.path)
+        if parsed.path not in ('/date', '/batch'):
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            body = self.read_body()
+        except ValueError as err:
+            self.send_json(400, {'error': 'malformed request: %s' % err})
+            return
+        if body is None:
+            self.send_json(413, {'error': 'document too large'})
+            return
+        try:
+            options = parse_options(parsed.query)
+            if parsed.path == '/batch':
+                tasks = [self.make_task(item, options) for item in json.loads(body.decode('utf-8'))]
+            elif self.headers.get_content_type() == 'application/json':
+                tasks = [self.make_task(json.loads(body.decode('utf-8')), options)]
+            else:
+                htmltext = decode_content(body, self.headers.get_content_charset())
+                if htmltext is None:
+                    htmltext = body.decode(self.headers.get_content_charset() or 'utf-8', errors='replace')
+                tasks = [dict(options, html=htmltext)]
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            self.send_json(400, {'error': 'malformed request: %s' % err})
+            return
+        results = self.server.extract(tasks)
+        self.send_json(200, results if parsed.path == '/batch' else results[0])
+
+    @staticmethod
+    def make_task(item, options):
+        """Combine a JSON item (string or object) with the query options"""
+        if isinstance(item, str):
+            return dict(options, html=item)
+        task = dict(options)
+        task.update(item)
+        if not isinstance(task['html'], str):
+            raise TypeError('html must be a string')
+        return task
+
+    def log_message(self, format, *args):
+        LOGGER.debug('%s - %s', self.address_string(), format % args)
+
+
+def serve(host='127.0.0.1', port=8000, workers=multiprocessing.cpu_count()):
+    """Run the extraction server until interrupted"""
+    server = ExtractionServer((host, port), workers, freeze=True, metrics=True)
+    LOGGER.info('serving on %s:%s with %s workers', host, port, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
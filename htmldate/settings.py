@@ -13,6 +13,8 @@ import dateparser # third-party, slow
 
 # Download
 MAX_FILE_SIZE = 20000000
+# stored files above this size (bytes) are decoded from a memory map instead of a single read
+MMAP_THRESHOLD = 1048576
 MIN_FILE_SIZE = 10
 
 ## Plausible dates
@@ -26,3 +28,68 @@ MAX_YEAR = datetime.date.today().year
 # dateparser module
 PARSERCONFIG = {'PREFER_DAY_OF_MONTH': 'first', 'PREFER_DATES_FROM': 'past', 'DATE_ORDER': 'DMY'}
 PARSER = dateparser.DateDataParser(settings={'PREFER_DAY_OF_MONTH': 'first', 'PREFER_DATES_FROM': 'past', 'DATE_ORDER': 'DMY'}) # allow_redetect_language=False, # languages=['de', 'en'], 
+# number of dateparser instances restricted to the language of the document kept in memory
+DATEPARSER_INSTANCES = 8
+
+# result cache
+CACHE_MAXSIZE = 100000
+CACHE_SYNC_INTERVAL = 100
+
+# batch jobs: probability of false positives in the seen-set
+BLOOM_ERROR_RATE = 0.000001
+
+# concurrent downloads: minimum delay between two requests to the same host (seconds)
+HOST_DELAY = 1.0
+# number of consecutive errors before a host is abandoned
+HOST_MAX_ERRORS = 5
+# average latency above which a host is considered slow (seconds)
+SLOW_HOST_LATENCY = 5.0
+# maximum number of URLs held in the host queues
+HOST_BUFFER = 10000
+
+# asynchronous processing: concurrent downloads
+ASYNC_CONCURRENCY = 16
+
+# supervised pool: wall-clock limit per document (seconds), tasks and memory (MB) before a worker is replaced
+POOL_TIME_LIMIT = 30
+POOL_MAX_TASKS = 1000
+POOL_MAX_RSS = 500
+
+# adaptive rule ordering: documents taken into account per rule, observations before a rule can be skipped,
+# share of documents running all rules in default order, expected hits per millisecond below which a rule is skipped
+ADAPTIVE_WINDOW = 1000
+ADAPTIVE_MIN_SAMPLES = 50
+ADAPTIVE_EXPLORATION = 0.05
+ADAPTIVE_THRESHOLD = 0.001
+
+# candidate scoring: weight of a candidate by stage or stage:rule, confidence above which the expensive stages are skipped,
+# decay of the weight with the position of the candidate within its rule, parsed candidates kept per rule
+SCORING_WEIGHTS = {
+    'profile': 0.95,
+    'url': 0.9,
+    'header': 0.9,
+    'abbr': 0.8,
+    'expression': 0.6,
+    'expression:9': 0.3,
+    'expression:11': 0.3,
+    'expression:12': 0.4,
+    'expression:13': 0.4,
+    'time': 0.8,
+    'json': 0.8,
+    'timestamp': 0.6,
+    'german': 0.7,
+    'partial_url': 0.5,
+    'search_page': 0.3,
+}
+SCORING_THRESHOLD = 0.5
+SCORING_DECAY = 0.3
+SCORING_MAX_CANDIDATES = 3
+# number of rows from which the scores are computed with NumPy
+SCORING_VECTOR_ROWS = 48
+
+# metrics: upper bounds of the histogram buckets (seconds)
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# profiling: latency above which a document is saved for replay (milliseconds), interval between two stack samples (seconds)
+PROFILE_THRESHOLD = 1000
+PROFILE_INTERVAL = 0.001
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Structured trace of the decisions taken during the extraction.
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import logging
+
+# third-party
+from lxml import html
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def describe_element(elem, length=100):
+    """Serialize the beginning of an element on one line"""
+    serialized = html.tostring(elem, pretty_print=False, encoding='unicode', with_tail=False)
+    return ' '.join(serialized.split())[:length]
+
+
+class Tracer(object):
+    """
+    Event sink collecting the steps of an extraction, elements are only
+    serialized when a tracer is attached (see find_date)
+
+    Events are dictionaries with the keys stage (e.g. "header", "expression:3",
+    "result"), rule (XPath expression), element (serialized HTML), candidate
+    (string examined), result (date found or None) and reason (why a candidate
+    was rejected).
+
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def event(self, stage, rule=None, element=None, candidate=None, result=None, reason=None):
+        """Record a step of the extraction"""
+        self.events.append({
+            'stage': stage,
+            'rule': rule,
+            'element': describe_element(element) if element is not None else None,
+            'candidate': candidate,
+            'result': result,
+            'reason': reason,
+        })
+
+    def explain(self):
+        """Return the trace in human-readable form, one event per line"""
+        lines = []
+        for event in self.events:
+            parts = [event['stage']]
+            if event['element'] is not None:
+                parts.append(event['element'])
+            elif event['rule'] is not None:
+                parts.append(event['rule'])
+            if event['candidate'] is not None:
+                parts.append(repr(event['candidate']))
+            parts.append('-> ' + str(event['result']))
+            if event['reason'] is not None:
+                parts.append('(' + event['reason'] + ')')
+            lines.append(' '.join(parts))
+        return '\n'.join(lines)
@@ -9,7 +9,12 @@ Module bundling functions related to HTML processing.
 
 
 # standard
+import bz2
+import gzip
 import logging
+import lzma
+import mmap
+import os
 import re
 import socket
 import urllib3
@@ -20,6 +25,15 @@ import cchardet as chardet
 import requests
 from lxml import etree, html
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# own
+from .metrics import METRICS
+from .settings import MAX_FILE_SIZE, MMAP_THRESHOLD
+
 
 LOGGER = logging.getLogger(__name__)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -27,14 +41,30 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # LXML
 HTML_PARSER = html.HTMLParser() # encoding='utf8'
 
+TEXT_TOKENS = re.compile(r'(\s+)|\S+')
+# declared language, in order of precedence
+LANGUAGE_EXPRESSIONS = [
+    '/html/@lang',
+    '//meta[translate(@http-equiv, "CONTENTLAGU", "contentlagu")="content-language"]/@content',
+    '//meta[@property="og:locale"]/@content',
+]
+LANGUAGE_CODE = re.compile(r'[a-z]{2,3}$')
 
+# stored documents: decompression according to the file extension
+DECOMPRESSORS = {'.bz2': bz2.open, '.gz': gzip.open, '.xz': lzma.open}
+if zstandard is not None:
+    DECOMPRESSORS['.zst'] = lambda filename: zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), read_across_frames=True)
+DECOMPRESSION_ERRORS = (EOFError, OSError, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ())
 
-def fetch_url(url):
-    """ Fetch page using requests/urllib3
+
+
+def send_request(url, extra_headers=None):
+    """ Send a GET request using requests/urllib3
     Args:
         URL: URL of the page to fetch
+        extra_headers: additional HTTP headers (e.g. conditional request)
     Returns:
-        request object (headers + body).
+        response object or None if the request failed.
     Raises:
         Nothing.
     """
@@ -45,44 +75,169 @@ def fetch_url(url):
         'Connection': 'close',  # another way to cover tracks
         # 'User-Agent': '', # your string here
     })
+    if extra_headers is not None:
+        headers.update(extra_headers)
+    if METRICS.enabled is True:
+        METRICS.inc('htmldate_fetches_total')
     # send
     try:
         response = requests.get(url, timeout=30, verify=False, allow_redirects=True, headers=headers)
     except (requests.exceptions.MissingSchema, requests.exceptions.InvalidURL):
         LOGGER.error('malformed URL: %s', url)
+        record_fetch_error('malformed_url')
     except requests.exceptions.TooManyRedirects:
         LOGGER.error('redirects: %s', url)
+        record_fetch_error('redirects')
     except requests.exceptions.SSLError as err:
         LOGGER.error('SSL: %s %s', url, err)
+        record_fetch_error('ssl')
     except (socket.timeout, requests.exceptions.ConnectionError, requests.exceptions.Timeout, socket.error, socket.gaierror) as err:
         LOGGER.error('connection: %s %s', url, err)
+        record_fetch_error('connection')
     #except Exception as err:
     #    logging.error('unknown: %s %s', url, err) # sys.exc_info()[0]
     # if no error
     else:
-        # safety checks
-        if int(response.status_code) != 200:
-            LOGGER.error('not a 200 response: %s', response.status_code)
-        elif response.text is None or len(response.text) < 100:
-            LOGGER.error('file too small/incorrect response: %s %s', url, len(response.text))
-        elif len(response.text) > 20000000:
-            LOGGER.error('file too large: %s %s', url, len(response.text))
-        else:
-            guessed_encoding = chardet.detect(response.content)['encoding']
-            LOGGER.debug('response/guessed encoding: %s / %s', response.encoding, guessed_encoding)
-            if guessed_encoding is not None:
-                try:
-                    htmltext = response.content.decode(guessed_encoding)
-                except UnicodeDecodeError:
-                    htmltext = response.text
-            else:
-                htmltext = response.text
-            # return here
-            return htmltext
+        return response
+    # catchall
+    return None
+
+
+def record_fetch_error(errortype):
+    """Count a failed download by type of error (see metrics.METRICS)"""
+    if METRICS.enabled is True:
+        METRICS.inc('htmldate_fetch_errors_total', type=errortype)
+
+
+def decode_response(url, response):
+    """Run safety checks on the response and decode its content"""
+    if int(response.status_code) != 200:
+        LOGGER.error('not a 200 response: %s', response.status_code)
+        record_fetch_error('status')
+    elif response.text is None or len(response.text) < 100:
+        LOGGER.error('file too small/incorrect response: %s %s', url, len(response.text))
+        record_fetch_error('too_small')
+    elif len(response.text) > 20000000:
+        LOGGER.error('file too large: %s %s', url, len(response.text))
+        record_fetch_error('too_large')
+    else:
+        htmltext = decode_content(response.content, response.encoding)
+        if htmltext is None:
+            htmltext = response.text
+        # return here
+        return htmltext
     # catchall
     return None
 
 
+def decode_content(content, declared_encoding):
+    """Decode the body of a response using the guessed encoding, None if it fails"""
+    guessed_encoding = chardet.detect(content)['encoding']
+    LOGGER.debug('response/guessed encoding: %s / %s', declared_encoding, guessed_encoding)
+    if guessed_encoding is not None:
+        try:
+            return content.decode(guessed_encoding)
+        except UnicodeDecodeError:
+            pass
+    return None
+
+
+def fetch_url(url, httpcache=None):
+    """ Fetch page using requests/urllib3
+    Args:
+        URL: URL of the page to fetch
+        httpcache: optional HTTPCache used for conditional requests
+    Returns:
+        request object (headers + body).
+    Raises:
+        Nothing.
+    """
+    if httpcache is not None:
+        return fetch_conditional(url, httpcache)[0]
+    response = send_request(url)
+    if response is None:
+        return None
+    return decode_response(url, response)
+
+
+def fetch_conditional(url, httpcache):
+    """ Fetch page unless it has not been modified since the last visit
+    Args:
+        URL: URL of the page to fetch
+        httpcache: HTTPCache storing validators (ETag, Last-Modified) and bodies
+    Returns:
+        tuple (HTML text or None, False if the cached version has been reused).
+    Raises:
+        Nothing.
+    """
+    validators = httpcache.get_validators(url)
+    response = send_request(url, validators)
+    if response is None:
+        return None, True
+    # not modified: reuse stored body
+    if int(response.status_code) == 304 and validators:
+        LOGGER.debug('not modified: %s', url)
+        htmltext = httpcache.get_body(url)
+        if htmltext is not None:
+            return htmltext, False
+        # inconsistent cache entry, download again
+        response = send_request(url)
+        if response is None:
+            return None, True
+    htmltext = decode_response(url, response)
+    if htmltext is not None:
+        httpcache.store(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), htmltext)
+    return htmltext, True
+
+
+def decode_file(content):
+    """Decode a stored document, UTF-8 first, then using the guessed encoding, None if it fails"""
+    try:
+        return str(content, 'utf-8')
+    except UnicodeDecodeError:
+        return decode_content(bytes(content), None)
+
+
+def read_bounded(inputfile, limit):
+    """Read until the end of the stream or the limit, decompressors can return less than asked in a single call"""
+    chunks, size = [], 0
+    while size < limit:
+        chunk = inputfile.read(limit - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks)
+
+
+def load_file(filename, maxsize=MAX_FILE_SIZE):
+    """Read and decode a stored document, decompressed according to its extension
+       (.gz, .bz2, .xz and .zst if zstandard is installed), None if it cannot be read or is too large"""
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        if extension in DECOMPRESSORS:
+            with DECOMPRESSORS[extension](filename) as inputfile:
+                content = read_bounded(inputfile, maxsize + 1)
+        else:
+            with open(filename, 'rb') as inputfile:
+                size = os.fstat(inputfile.fileno()).st_size
+                if size == 0 or size > maxsize:
+                    LOGGER.error('empty or too large file: %s %s', filename, size)
+                    return None
+                if size < MMAP_THRESHOLD:
+                    return decode_file(inputfile.read())
+                # large files: decode straight from the mapped pages
+                with mmap.mmap(inputfile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return decode_file(mapped)
+    except DECOMPRESSION_ERRORS as err:
+        LOGGER.error('unreadable file: %s %s', filename, err)
+        return None
+    if len(content) > maxsize:
+        LOGGER.error('file too large: %s', filename)
+        return None
+    return decode_file(content)
+
+
 #@profile
 def load_html(htmlobject):
     """Load object given as input and validate its type (accepted: LXML tree and string, HTML document or URL)"""
@@ -98,6 +253,8 @@ def load_html(htmlobject):
                 htmlobject = htmltext
             else:
                 return None
+        if METRICS.enabled is True:
+            METRICS.inc('htmldate_parsed_bytes_total', len(htmlobject))
         ## robust parsing
         try:
             # parse
@@ -116,3 +273,37 @@ def load_html(htmlobject):
         LOGGER.error('this type cannot be processed: %s', type(htmlobject))
         tree = None
     return tree
+
+
+def document_language(tree):
+    """Return the language code declared by the document (e.g. "de" for "de-AT" or "de_DE") or None"""
+    for expression in LANGUAGE_EXPRESSIONS:
+        for value in tree.xpath(expression):
+            # first language of a list, without region
+            code = re.split(r'[-_,; ]', value.strip().lower(), maxsplit=1)[0]
+            if LANGUAGE_CODE.match(code):
+                return code
+    return None
+
+
+def bounded_text(pieces, limit=48):
+    """Join text pieces (e.g. elem.itertext()) with normalized whitespace,
+       stop as soon as limit characters are collected"""
+    collected = []
+    length = 0
+    space = False
+    for piece in pieces:
+        # lazy tokenization: huge text nodes are not processed entirely
+        for match in TEXT_TOKENS.finditer(piece):
+            if match.group(1) is not None:
+                space = length > 0
+                continue
+            if space is True:
+                collected.append(' ')
+                length += 1
+                space = False
+            collected.append(match.group(0))
+            length += len(match.group(0))
+            if length >= limit:
+                return ''.join(collected)[:limit]
+    return ''.join(collected)
@@ -39,7 +39,7 @@ def date_validator(date_input, outputformat):
     else:
         dateobject = date_input
     # basic year validation
-    year = int(datetime.date.strftime(dateobject, '%Y'))
+    year = dateobject.year
     if MIN_YEAR <= year <= MAX_YEAR:
         # not newer than today
         try:
@@ -66,6 +66,11 @@ setup(
         'regex',
         'requests >= 2.19.0',
     ],
+    extras_require={
+        'async': ['aiohttp >= 3.3; python_version >= "3.7"'],
+        'profiles': ['pyyaml'],
+        'scoring': ['numpy'],
+    },
     # python_requires='>=3',
     entry_points = {
         'console_scripts': ['htmldate=htmldate.cli:main'],
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks on the documents in tests/cache (run with python3 tests/benchmark.py).
+"""
+
+## This file is available from https://github.com/adbar/htmldate
+## under GNU GPL v3 license
+
+# standard
+import argparse
+import gc
+import glob
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+
+try:
+    from htmldate import parsers
+    from htmldate.adaptive import AdaptiveController
+    from htmldate.core import DATE_EXPRESSIONS, MODES, find_date, warmup
+    from htmldate.metrics import METRICS
+    from htmldate.profiling import Profiler
+    from htmldate.scoring import CandidateScorer
+    from htmldate.tracing import Tracer
+    from htmldate.utils import document_language, load_html
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from htmldate import parsers
+    from htmldate.adaptive import AdaptiveController
+    from htmldate.core import DATE_EXPRESSIONS, MODES, find_date, warmup
+    from htmldate.metrics import METRICS
+    from htmldate.profiling import Profiler
+    from htmldate.scoring import CandidateScorer
+    from htmldate.tracing import Tracer
+    from htmldate.utils import document_language, load_html
+
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_documents():
+    """Read the HTML files of the test cache, sorted by name"""
+    documents = []
+    for filename in sorted(glob.glob(os.path.join(TEST_DIR, 'cache', '*.html'))):
+        with open(filename, 'r', encoding='utf-8', errors='replace') as inputfile:
+            documents.append((os.path.basename(filename), inputfile.read()))
+    return documents
+
+
+def print_table(header, rows):
+    """Write a table in reStructuredText format"""
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    separator = '  '.join('=' * width for width in widths)
+    print(separator)
+    print('  '.join(str(cell).ljust(width) for cell, width in zip(header, widths)).rstrip())
+    print(separator)
+    for row in rows:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip())
+    print(separator)
+
+
+def benchmark_modes(documents, repeat=3):
+    """Latency per document, share of dated documents and agreement with the full search for each tier"""
+    reference = {name: find_date(htmlstring) for name, htmlstring in documents}
+    rows = []
+    for mode in MODES:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = {name: find_date(htmlstring, mode=mode) for name, htmlstring in documents}
+            timings.append(time.perf_counter() - start)
+        dated = sum(1 for result in results.values() if result is not None)
+        agreement = sum(1 for name in results if results[name] is not None and results[name] == reference[name])
+        rows.append((
+            mode,
+            '%.2f' % (min(timings) / len(documents) * 1000),
+            '%.1f%%' % (dated / len(documents) * 100),
+            '%.1f%%' % (agreement / len(documents) * 100),
+        ))
+    print_table(('mode', 'ms/doc', 'dated', 'same as full'), rows)
+
+
+def benchmark_adaptive(documents, repeat=3):
+    """Latency and agreement with the default order when the rules are reordered adaptively"""
+    reference = {name: find_date(htmlstring) for name, htmlstring in documents}
+    controller = AdaptiveController(len(DATE_EXPRESSIONS), min_samples=20, seed=1)
+    rows = []
+    for label, kwargs in (('default', {}), ('adaptive', {'controller': controller})):
+        # several passes so that the controller gathers observations
+        for run in range(repeat + 2):
+            start = time.perf_counter()
+            results = {name: find_date(htmlstring, **kwargs) for name, htmlstring in documents}
+            duration = time.perf_counter() - start
+        agreement = sum(1 for name in results if results[name] == reference[name])
+        rows.append((label, '%.2f' % (duration / len(documents) * 1000), '%.1f%%' % (agreement / len(documents) * 100)))
+    print_table(('order', 'ms/doc', 'same as default'), rows)
+    print_table(('rule', 'samples', 'hit rate', 'ms', 'skipped'), [
+        (rule['rule'], rule['samples'], '%.3f' % rule['hit_rate'], '%.2f' % rule['cost_ms'], rule['skipped'])
+        for rule in controller.stats()['rules']
+    ])
+
+
+def make_bylines(language, seed=1):
+    """Date strings with full month names in the usual layouts of a language"""
+    layouts = {
+        'en': ['Posted on {month} {day}, {year}', '{day} {month} {year}'],
+        'de': ['Veröffentlicht am {day}. {month} {year}', '{day}. {month} {year}'],
+        'es': ['Publicado el {day} de {month} de {year}', '{day} {month} {year}'],
+        'fr': ['Publié le {day} {month} {year}', 'le {day} {month} {year} à 10h'],
+        'it': ['Pubblicato il {day} {month} {year}', '{day} {month} {year}'],
+        'nl': ['Gepubliceerd op {day} {month} {year}', '{day} {month} {year}'],
+        'pl': ['Opublikowano {day} {month} {year}', '{day} {month} {year} r.'],
+        'pt': ['Publicado em {day} de {month} de {year}', '{day} {month} {year}'],
+    }
+    rand = random.Random(seed)
+    bylines = []
+    for layout in layouts[language]:
+        for names in parsers.MONTH_NAMES[language]:
+            month = names.split()[0]
+            # capitalized month names
+            if language in ('de', 'en'):
+                month = month.capitalize()
+            bylines.append(layout.format(day=rand.randint(1, 28), month=month, year=rand.randint(2010, 2019)))
+    return bylines
+
+
+def time_calls(function, strings, repeat):
+    """Return the results and the time per call in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(string, '%Y-%m-%d') for string in strings]
+        timings.append(time.perf_counter() - start)
+    return results, min(timings) / len(strings) * 1000
+
+
+def benchmark_languages(documents, repeat=3):
+    """Share of date strings parsed without dateparser and latency per call, by language"""
+    rows = []
+    multilingual = parsers.regex_parse_multilingual
+    # load the dateparser data beforehand
+    parsers.external_date_parser('1 January 2019', '%Y-%m-%d')
+    for language in sorted(parsers.MONTH_NAMES):
+        bylines = make_bylines(language)
+        # custom parse without the multilingual tables
+        parsers.regex_parse_multilingual = lambda string, tokenized=None, language=None: None
+        try:
+            before, _ = time_calls(parsers.custom_parse, bylines, 1)
+        finally:
+            parsers.regex_parse_multilingual = multilingual
+        # month names of the declared language
+        after, custom_ms = time_calls(lambda string, outputformat: parsers.custom_parse(string, outputformat, language), bylines, repeat)
+        _, dateparser_ms = time_calls(parsers.external_date_parser, bylines, 1)
+        rows.append((
+            language,
+            len(bylines),
+            '%.0f%%' % (sum(1 for result in before if result is not None) / len(bylines) * 100),
+            '%.0f%%' % (sum(1 for result in after if result is not None) / len(bylines) * 100),
+            '%.3f' % custom_ms,
+            '%.3f' % dateparser_ms,
+        ))
+    print_table(('language', 'strings', 'custom before', 'custom now', 'custom ms', 'dateparser ms'), rows)
+    # calls reaching dateparser on the test pages
+    parsers.PARSERS.reset_stats()
+    for _, htmlstring in documents:
+        find_date(htmlstring)
+    stats = parsers.PARSERS.stats()
+    print('dateparser calls on %s pages: %s (%s hits)' % (len(documents), stats['dateparser']['calls'], stats['dateparser']['hits']))
+
+
+def benchmark_scoping(documents, repeat=3):
+    """Latency of dateparser with and without restriction to the declared language of the pages"""
+    # date strings examined on each page, grouped by declared language
+    strings = defaultdict(list)
+    pages = defaultdict(int)
+    for _, htmlstring in documents:
+        language = document_language(load_html(htmlstring))
+        tracer = Tracer()
+        find_date(htmlstring, tracer=tracer)
+        pages[language] += 1
+        strings[language].extend(event['candidate'] for event in tracer.events if event['stage'] != 'result' and event['candidate'] and sum(1 for char in event['candidate'] if char.isdigit()) >= 4)
+    rows = []
+    for language in sorted(strings, key=str):
+        if not strings[language]:
+            continue
+        # build the scoped instance beforehand
+        parsers.DATEPARSERS.get(language)
+        general, general_ms = time_calls(parsers.external_date_parser, strings[language], repeat)
+        scoped, scoped_ms = time_calls(lambda string, outputformat: parsers.scoped_date_parser(string, outputformat, language), strings[language], repeat)
+        rows.append((
+            language or '(none)',
+            pages[language],
+            len(strings[language]),
+            '%.3f' % general_ms,
+            '%.3f' % scoped_ms,
+            '%.0f%%' % (sum(1 for first, second in zip(general, scoped) if first == second) / len(general) * 100),
+        ))
+    print_table(('language', 'pages', 'strings', 'general ms', 'scoped ms', 'same result'), rows)
+
+
+def benchmark_scoring(documents, repeat=3):
+    """Latency, agreement with the cascade and share of confident results when the candidates are scored together"""
+    reference = {name: find_date(htmlstring) for name, htmlstring in documents}
+    scorer = CandidateScorer()
+    rows = []
+    for label, kwargs in (('cascade', {}), ('scoring', {'scorer': scorer})):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = {name: find_date(htmlstring, details=True, **kwargs) for name, htmlstring in documents}
+            timings.append(time.perf_counter() - start)
+        confident = [name for name in results if results[name].get('confidence', 1.0) >= scorer.threshold]
+        rows.append((
+            label,
+            '%.2f' % (min(timings) / len(documents) * 1000),
+            '%.1f%%' % (sum(1 for name in results if results[name]['date'] == reference[name]) / len(documents) * 100),
+            '%.1f%%' % (len(confident) / len(documents) * 100),
+            '%.1f%%' % (sum(1 for name in confident if results[name]['date'] == reference[name]) / max(len(confident), 1) * 100),
+        ))
+    print_table(('search', 'ms/doc', 'same as cascade', 'confident', 'confident and same'), rows)
+
+
+def benchmark_metrics(documents, repeat=3):
+    """Latency with and without recording of the metrics, size of the Prometheus output"""
+    rows = []
+    for label in ('disabled', 'enabled'):
+        METRICS.reset()
+        if label == 'enabled':
+            METRICS.enable()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _, htmlstring in documents:
+                find_date(htmlstring)
+            timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        rendered = METRICS.render()
+        rows.append((label, '%.3f' % (min(timings) / len(documents) * 1000), '%.2f' % ((time.perf_counter() - start) * 1000), str(len(rendered.splitlines()))))
+        METRICS.disable()
+    print_table(('metrics', 'ms/doc', 'render ms', 'lines'), rows)
+
+
+def benchmark_profiling(documents, repeat=3):
+    """Latency under each profiling method"""
+    rows = []
+    for method in ('none', None, 'sampling', 'cprofile'):
+        timings = []
+        for _ in range(repeat):
+            profiler = Profiler(method) if method != 'none' else None
+            start = time.perf_counter()
+            for _, htmlstring in documents:
+                find_date(htmlstring, profiler=profiler)
+            timings.append(time.perf_counter() - start)
+        rows.append(({'none': 'no profiler', None: 'timing only'}.get(method, method), '%.2f' % (min(timings) / len(documents) * 1000)))
+    print_table(('method', 'ms/doc'), rows)
+
+
+def process_memory():
+    """Resident and private memory of the current process in MB (Linux)"""
+    values = {}
+    with open('/proc/self/smaps_rollup', 'r') as smaps:
+        for line in smaps:
+            fields = line.split()
+            if fields[0] in ('Rss:', 'Private_Clean:', 'Private_Dirty:'):
+                values[fields[0]] = int(fields[1]) / 1024
+    return values['Rss:'], values['Private_Clean:'] + values['Private_Dirty:']
+
+
+def forked_worker(documents, queue):
+    """Process the documents once, report the latency of the first one and the memory use"""
+    start = time.perf_counter()
+    find_date(documents[0][1])
+    first = time.perf_counter() - start
+    for _, htmlstring in documents[1:]:
+        find_date(htmlstring)
+    total = time.perf_counter() - start
+    # full collection as in long-running workers
+    gc.collect()
+    queue.put((first, total) + process_memory())
+
+
+def forking_parent(variant, documents, workers, queue):
+    """Prepare a fresh parent process according to the variant, then fork the workers"""
+    if variant != 'cold':
+        warmup(freeze=variant == 'warmup + freeze')
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=forked_worker, args=(documents, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    queue.put(collected)
+
+
+def benchmark_warmup(documents, repeat=3, workers=4):
+    """First-request latency and memory of forked workers, with a cold or warmed-up parent"""
+    # first request: page going through the language detection of dateparser
+    documents = sorted(documents, key=lambda document: document[0] != 'wienbadminton.html')
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for variant in ('cold', 'warmup', 'warmup + freeze'):
+        runs = []
+        for _ in range(repeat):
+            queue = context.Queue()
+            parent = context.Process(target=forking_parent, args=(variant, documents, workers, queue))
+            parent.start()
+            runs.extend(queue.get())
+            parent.join()
+        rows.append((
+            variant,
+            '%.1f' % (sorted(run[0] for run in runs)[len(runs) // 2] * 1000),
+            '%.1f' % (sorted(run[1] for run in runs)[len(runs) // 2] / len(documents) * 1000),
+            '%.1f' % (sum(run[2] for run in runs) / len(runs)),
+            '%.1f' % (sum(run[3] for run in runs) / len(runs)),
+        ))
+    print_table(('parent', 'first request ms', 'first pass ms/doc', 'RSS MB', 'private MB'), rows)
+    print('%s workers, median and mean over %s runs' % (workers, repeat))
+
+
+BENCHMARKS = {'adaptive': benchmark_adaptive, 'languages': benchmark_languages, 'metrics': benchmark_metrics, 'modes': benchmark_modes, 'profiling': benchmark_profiling, 'scoring': benchmark_scoring, 'scoping': benchmark_scoping, 'warmup': benchmark_warmup}
+
+
+if __name__ == '__main__':
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("benchmark", help="benchmark to run", choices=sorted(BENCHMARKS))
+    argsparser.add_argument("--repeat", help="number of runs, the fastest is reported", type=int, default=3)
+    args = argsparser.parse_args()
+    BENCHMARKS[args.benchmark](load_documents(), args.repeat)
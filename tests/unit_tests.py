@@ -5,23 +5,67 @@ Unit tests for the htmldate library.
 """
 # https://docs.pytest.org/en/latest/
 
+import argparse
+import asyncio
+import bz2
+import datetime
+import gc
+import gzip
+import json
 import logging
+import lzma
+import multiprocessing
 import os
 import re
+import socket
 import sys
+import tempfile
+import threading
+import time
+
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 import dateparser
+import requests
 
 from lxml import html
 
-from htmldate.cli import examine
-from htmldate.core import compare_reference, find_date, search_page, search_pattern, select_candidate, try_ymd_date
-from htmldate.parsers import custom_parse, extract_partial_url_date, regex_parse_de, regex_parse_en
-from htmldate.utils import fetch_url, load_html
+# optional
+try:
+    import yaml
+except ImportError:
+    yaml = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from htmldate.adaptive import AdaptiveController
+from htmldate.batch import BloomFilter, count_lines, host_shard, in_shard, iterate_files, merge_results, parse_shard, run_job, url_hash
+from htmldate.cache import DictBackend, HTTPCache, ResultCache
+from htmldate.metrics import METRICS, MetricsRegistry, start_metrics_server
+from htmldate.cli import examine, examine_url, process_files, profiles_main
+from htmldate.pool import SupervisedPool
+from htmldate.profiles import ProfileSet, load_profiles, validate_profiles
+from htmldate.profiling import Profiler, iterate_captures, replay
+from htmldate.scheduler import HostScheduler
+from htmldate.scoring import CandidateScorer, CandidateTable, match_expressions
+from htmldate.server import ExtractionServer, collect_metrics, run_task
+from htmldate.tracing import Tracer
+from htmldate.core import DATE_EXPRESSIONS, XPATHS, Document, compare_reference, find_date, search_page, search_pattern, select_candidate, try_ymd_date, warmup
+from htmldate.parsers import PARSERS, ParserChain, ScopedDateParsers, custom_parse, iso_parse, regex_parse_multilingual, tokenize_date, extract_partial_url_date, regex_parse_de, regex_parse_en
+from htmldate.utils import bounded_text, document_language, fetch_conditional, fetch_url, load_file, load_html
 from htmldate.validators import convert_date, date_validator, output_format_validator
 
+# Python 3.7+
+if sys.version_info >= (3, 7):
+    from htmldate.aio import SHARED, close_shared_session, fetch_url_async, find_date_async, iterate_dates
+
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -79,7 +123,7 @@ MOCK_PAGES = { \
 'https://www.cosmopolitan.de/sommertrend-print-look-so-tragen-ihn-die-influencerinnen-86546.html': 'cosmopolitan.sommertrend.html', \
 'https://www.ldt.de/ldtblog/fall-in-love-with-black/': 'ldt.fallinlove.html', \
 'http://www.loldf.org/spip.php?article717': 'lesoreillesloindufront.html', \
-'https://www.beltz.de/sachbuch_ratgeber/buecher/produkt_produktdetails/37219-12_wege_zu_guter_pflege.html': 'beltz.12wege.html'
+'https://www.beltz.de/sachbuch_ratgeber/buecher/produkt_produktdetails/37219-12_wege_zu_guter_pflege.html': 'beltz.12wege.html', \
 'https://www.oberstdorf-resort.de/interaktiv/blog/unser-kraeutergarten-wannenkopfhuette.html': 'oberstdorfresort.html', \
 'https://www.wienbadminton.at/news/119843/Come-Together': 'wienbadminton.html', \
 'https://blog.wikimedia.org/2018/06/28/interactive-maps-now-in-your-language/': 'blog.wikimedia.interactivemaps.html', \
@@ -92,6 +136,71 @@ OUTPUTFORMAT = '%Y-%m-%d'
 PARSER = dateparser.DateDataParser(languages=['de', 'en'], settings={'PREFER_DAY_OF_MONTH': 'first', 'PREFER_DATES_FROM': 'past', 'DATE_ORDER': 'DMY'}) # allow_redetect_language=False,
 
 
+class ConditionalHandler(BaseHTTPRequestHandler):
+    '''local stand-in server honouring conditional requests'''
+    body = ('<html><head><meta name="date" content="2017-09-01"/></head><body>' + 'Test page. '*20 + '</body></html>').encode('utf-8')
+    full_responses = 0
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"v1"' or self.headers.get('If-Modified-Since') == 'Fri, 01 Sep 2017 00:00:00 GMT':
+            self.send_response(304)
+            self.end_headers()
+            return
+        ConditionalHandler.full_responses += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        if self.path != '/no-validators':
+            self.send_header('ETag', '"v1"')
+            self.send_header('Last-Modified', 'Fri, 01 Sep 2017 00:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    '''local server handling concurrent requests'''
+    daemon_threads = True
+
+
+def make_host_handler(latency):
+    '''handler recording concurrency and request times of a stand-in host'''
+    class HostHandler(BaseHTTPRequestHandler):
+        lock = threading.Lock()
+        active = 0
+        max_active = 0
+        times = []
+
+        def do_GET(self):
+            with self.lock:
+                HostHandler.active += 1
+                HostHandler.max_active = max(HostHandler.max_active, HostHandler.active)
+                HostHandler.times.append(time.time())
+            time.sleep(latency)
+            body = ('<html><body>' + 'Test page. '*20 + '</body></html>').encode('utf-8')
+            self.send_response(200 if self.path != '/error' else 500)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with self.lock:
+                HostHandler.active -= 1
+
+        def log_message(self, *args):
+            pass
+    return HostHandler
+
+
+def start_server(handler, server_class=HTTPServer):
+    '''start a local HTTP server in a background thread and return it'''
+    server = server_class(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
 def load_mock_page(url):
     '''load mock page from samples'''
     with open(os.path.join(TEST_DIR, 'cache', MOCK_PAGES[url]), 'r') as inputf:
@@ -230,7 +339,7 @@ def test_exact_date():
     # assert find_date(load_mock_page('https://www.ldt.de/ldtblog/fall-in-love-with-black/')) == '2017-08-08'
     # kein Datum gefunden in 'cosmopolitan.sommertrend.html'
     # assert find_date(load_mock_page('https://www.cosmopolitan.de/sommertrend-print-look-so-tragen-ihn-die-influencerinnen-86546.html'))
-    # assert find_date(load_mock_page('https://paris-luttes.info/quand-on-comprend-que-les-grenades-12355?lang=fr')) == '2019-06-29'
+    assert find_date(load_mock_page('https://paris-luttes.info/quand-on-comprend-que-les-grenades-12355?lang=fr')) == '2019-06-29'
 
 def test_approximate_date():
     '''this page should return an approximate date'''
@@ -254,6 +363,16 @@ def test_approximate_date():
     # assert find_date(load_mock_page('http://www.hundeverein-kreisunna.de/termine.html')) == '2017-03-29' # probably newer
 
 
+def test_bounded_text():
+    '''test the bounded text extraction'''
+    assert bounded_text(['\n  Stand:\t12.', '07.2016 \n ']) == 'Stand: 12.07.2016'
+    assert bounded_text(['  a ', ' b', 'c'], 48) == 'a bc'
+    assert bounded_text(['x' * 10, ' ' * 10 + 'y ' * 100000], 15) == 'xxxxxxxxxx y y '
+    assert bounded_text([]) == ''
+    mytree = html.fromstring('<footer><p>Published <!-- comment --><span>12.07.</span>2016</p>' + '<p>More text</p>' * 10000 + '</footer>')
+    assert bounded_text(mytree.itertext()) == ' '.join(mytree.text_content().split())[:48]
+
+
 def test_date_validator():
     '''test internal date validation'''
     assert date_validator('2016-01-01', OUTPUTFORMAT) is True
@@ -284,10 +403,9 @@ def test_output_format_validator():
 def test_try_ymd_date():
     '''test date extraction via external package'''
     find_date.extensive_search = False
-    assert try_ymd_date('Fri, Sept 1, 2017', OUTPUTFORMAT, PARSER) is None
+    assert try_ymd_date('Fri, Sept 1, 2017', OUTPUTFORMAT, PARSER) == '2017-09-01'
     find_date.extensive_search = True
     assert try_ymd_date('Friday, September 01, 2017', OUTPUTFORMAT, PARSER) == '2017-09-01'
-    # assert try_ymd_date('Fri, Sept 1, 2017', OUTPUTFORMAT, PARSER) == '2017-09-01'
     assert try_ymd_date('Fr, 1 Sep 2017 16:27:51 MESZ', OUTPUTFORMAT, PARSER) == '2017-09-01'
     assert try_ymd_date('Freitag, 01. September 2017', OUTPUTFORMAT, PARSER) == '2017-09-01'
     # assert try_ymd_date('Am 1. September 2017 um 15:36 Uhr schrieb', OUTPUTFORMAT) == '2017-09-01'
@@ -306,6 +424,100 @@ def test_try_ymd_date():
 #    assert examine_header(tree, OUTPUTFORMAT, PARSER)
 
 
+def test_multilingual_parse():
+    '''test the month names of the main European languages'''
+    assert regex_parse_multilingual('Publié le samedi 12 octobre 2017') == datetime.date(2017, 10, 12)
+    assert regex_parse_multilingual('1er mai 2017') == datetime.date(2017, 5, 1)
+    assert regex_parse_multilingual('3 de março de 2016') == datetime.date(2016, 3, 3)
+    assert regex_parse_multilingual('Publicado el 5 de Septiembre de 2018') == datetime.date(2018, 9, 5)
+    assert regex_parse_multilingual('Pubblicato il 21 ottobre 2018 alle 10:00') == datetime.date(2018, 10, 21)
+    assert regex_parse_multilingual('gepubliceerd op 7 mrt. 2019') == datetime.date(2019, 3, 7)
+    assert regex_parse_multilingual('opublikowano 5 października 2015') == datetime.date(2015, 10, 5)
+    assert regex_parse_multilingual('oct. 12, 2017') == datetime.date(2017, 10, 12)
+    assert regex_parse_multilingual('2012 mars 2017') is None
+    assert regex_parse_multilingual('31 février 2017') is None
+    assert regex_parse_multilingual('12 mayonnaise 2017') is None
+    # month names restricted to the document language
+    assert regex_parse_multilingual('set 5, 2019') is None
+    assert regex_parse_multilingual('set 5, 2019', language='pt') == datetime.date(2019, 9, 5)
+    assert regex_parse_multilingual('12 octobre 2017', language='fr') == datetime.date(2017, 10, 12)
+    assert regex_parse_multilingual('12 octobre 2017', language='en') is None
+    assert regex_parse_multilingual('12 octobre 2017', language='ja') is None
+    assert regex_parse_multilingual('12 ottobre 2017 - 3 oct. 2017', language='fr') == datetime.date(2017, 10, 3)
+    assert custom_parse('Updated set 5, 2019', OUTPUTFORMAT, 'en') is None
+    assert custom_parse('Atualizado set 5, 2019', OUTPUTFORMAT, 'pt') == '2019-09-05'
+    # no dateparser needed
+    assert try_ymd_date('samedi 12 octobre 2017', OUTPUTFORMAT, False) == '2017-10-12'
+
+
+def test_tokenize_date():
+    '''test the one-pass tokenization of date strings'''
+    assert tokenize_date('Am 12. Juli 2016, 10:30') == (['Am', ' ', '12', '.', ' ', 'Juli', ' ', '2016', ',', ' ', '10', ':', '30'], 'w 2. G 4, 2x2')
+    assert tokenize_date('March 3rd,\t2018')[1] == 'E 1o,_4'
+    assert tokenize_date('1er MAI 2017 -- 201 20170')[1] == '1r m 4 -- 3 0'
+    assert tokenize_date('3 de março de 2016')[1] == '1 c m c 4'
+    # same layouts and precedence as the patterns applied one after another
+    assert regex_parse_de('Stand: 1. Juli 2016 / 3 March 2017') == datetime.date(2016, 7, 1)
+    assert regex_parse_en('3 March 2017, 12/24/2016') == datetime.date(2016, 12, 24)
+    assert regex_parse_en('Posted on 12th of March, 2017') == datetime.date(2017, 3, 12)
+    assert regex_parse_en('Mayor 12, 2017') is None
+    assert custom_parse('June 5, 2018 (1. Juli 2016)', OUTPUTFORMAT) == '2016-07-01'
+    # digit runs are not split
+    assert custom_parse('Juli 17 20170', OUTPUTFORMAT) is None
+
+
+def test_parser_chain():
+    '''test the configurable parser chain'''
+    assert PARSERS.names() == ['iso', 'custom', 'dateparser']
+    chain = ParserChain()
+    chain.register('custom', custom_parse, priority=20)
+    chain.register('year', lambda string, outputformat: string[-4:] + '-01-01', priority=30, prefilter=lambda string: string[-4:].isdigit())
+    chain.register('iso', iso_parse, priority=10, prefilter=lambda string: string[0:4].isdigit())
+    assert chain.names() == ['iso', 'custom', 'year']
+    assert try_ymd_date('2017-09-01T10:00:00', OUTPUTFORMAT, False, chain=chain) == '2017-09-01'
+    assert try_ymd_date('week 35/2017', OUTPUTFORMAT, False, chain=chain) == '2017-01-01'
+    assert try_ymd_date('2017, week 35', OUTPUTFORMAT, False, chain=chain) is None
+    stats = chain.stats()
+    assert stats['iso']['calls'] == 2 and stats['iso']['hits'] == 1 and stats['iso']['filtered'] == 1
+    assert stats['custom']['calls'] == 2 and stats['custom']['hits'] == 0
+    assert stats['year']['hits'] == 1 and stats['year']['filtered'] == 1 and stats['year']['hit_rate'] == 1.0
+    chain.reset_stats()
+    assert chain.stats()['iso']['calls'] == 0
+    # extensive and language-scoped parsers
+    chain.register('fallback', lambda string, outputformat: '2016-01-01', extensive=True)
+    chain.register('german', lambda string, outputformat: '2015-01-01', priority=0, languages=['de'])
+    assert chain.names() == ['german', 'iso', 'custom', 'year', 'fallback']
+    assert chain.parse('no date', OUTPUTFORMAT, extensive_search=False) is None
+    assert chain.parse('no date', OUTPUTFORMAT, extensive_search=True) == '2016-01-01'
+    assert chain.parse('no date', OUTPUTFORMAT, language='de') == '2015-01-01'
+    chain.unregister('fallback')
+    assert 'fallback' not in chain.names()
+    # the language of the document is passed to scoped parsers
+    chain.register('scoped', lambda string, outputformat, language: language, priority=0, scoped=True)
+    assert chain.parse('no date', OUTPUTFORMAT, language='fr') == 'fr'
+
+
+def test_document_language():
+    '''test the declared language and the dateparser instances scoped to it'''
+    assert document_language(html.fromstring('<html lang="de-AT"><body></body></html>')) == 'de'
+    assert document_language(html.fromstring('<html><head><meta http-equiv="Content-Language" content="fr_FR, en"/></head><body></body></html>')) == 'fr'
+    assert document_language(html.fromstring('<html><head><meta property="og:locale" content="pt_BR"/></head><body></body></html>')) == 'pt'
+    assert document_language(html.fromstring('<html lang="x-klingon"><body></body></html>')) is None
+    assert document_language(html.fromstring('<html><body></body></html>')) is None
+    parsers = ScopedDateParsers(maxsize=2)
+    assert parsers.get(None) is parsers.fallback
+    german = parsers.get('de')
+    assert german is not parsers.fallback and parsers.get('de') is german
+    assert german.get_date_data('3. März 2017')['date_obj'].day == 3
+    # unsupported language, least recently used instance discarded
+    assert parsers.get('xx') is parsers.fallback
+    parsers.get('fr')
+    assert list(parsers.parsers) == ['xx', 'fr']
+    # same result as the general parser
+    htmldoc = '<html lang="es"><body><p class="date">14/noviembre/2017</p></body></html>'
+    assert find_date(htmldoc) == find_date(htmldoc.replace(' lang="es"', '')) == '2017-11-14'
+
+
 def test_compare_reference(extensive_search=False, original_date=False):
     '''test comparison function'''
     assert compare_reference(0, 'AAAA', OUTPUTFORMAT, extensive_search, original_date) == 0
@@ -413,6 +625,744 @@ def test_cli():
     assert examine('<html><body>2016-07-12</body></html>', True) == '2016-07-12'
 
 
+def test_stored_files():
+    '''test the processing of stored files'''
+    htmldoc = '<html><body><p class="date">12. März 2016</p></body></html>'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, 'sub', 'subsub'))
+        with open(os.path.join(tmpdir, 'plain.html'), 'wb') as outputfile:
+            outputfile.write(htmldoc.encode('utf-8'))
+        with open(os.path.join(tmpdir, 'latin1.htm'), 'wb') as outputfile:
+            outputfile.write(('<html><head><title>Pr\xfcfung der Gr\xf6\xdfe</title></head>' + htmldoc[6:]).encode('latin-1'))
+        with gzip.open(os.path.join(tmpdir, 'sub', 'doc.html.gz'), 'wb') as outputfile:
+            outputfile.write(htmldoc.encode('utf-8'))
+        with bz2.open(os.path.join(tmpdir, 'sub', 'doc.html.bz2'), 'wb') as outputfile:
+            outputfile.write(htmldoc.encode('utf-8'))
+        with lzma.open(os.path.join(tmpdir, 'sub', 'subsub', 'doc.html.xz'), 'wb') as outputfile:
+            outputfile.write(htmldoc.encode('utf-8'))
+        with open(os.path.join(tmpdir, 'sub', 'broken.html.gz'), 'wb') as outputfile:
+            outputfile.write(b'not compressed')
+        # larger than the memory map threshold
+        with open(os.path.join(tmpdir, 'sub', 'large.html'), 'wb') as outputfile:
+            outputfile.write((htmldoc[:-14] + ' ' * 1100000 + '</body></html>').encode('utf-8'))
+        open(os.path.join(tmpdir, 'empty.html'), 'w').close()
+        # reading and decoding
+        assert load_file(os.path.join(tmpdir, 'plain.html')) == htmldoc
+        assert 'Größe' in load_file(os.path.join(tmpdir, 'latin1.htm'))
+        for filename in ('doc.html.gz', 'doc.html.bz2', os.path.join('subsub', 'doc.html.xz')):
+            assert load_file(os.path.join(tmpdir, 'sub', filename)) == htmldoc
+        assert len(load_file(os.path.join(tmpdir, 'sub', 'large.html'))) > 1100000
+        assert load_file(os.path.join(tmpdir, 'sub', 'broken.html.gz')) is None
+        assert load_file(os.path.join(tmpdir, 'empty.html')) is None
+        assert load_file(os.path.join(tmpdir, 'plain.html'), maxsize=10) is None
+        assert load_file(os.path.join(tmpdir, 'sub', 'doc.html.gz'), maxsize=10) is None
+        # directories and glob patterns
+        paths = [os.path.relpath(path, tmpdir) for path in iterate_files([tmpdir])]
+        assert paths == ['empty.html', 'latin1.htm', 'plain.html', os.path.join('sub', 'broken.html.gz'), os.path.join('sub', 'doc.html.bz2'), os.path.join('sub', 'doc.html.gz'), os.path.join('sub', 'large.html'), os.path.join('sub', 'subsub', 'doc.html.xz')]
+        assert [os.path.basename(path) for path in iterate_files([tmpdir], '*.html.*')] == ['broken.html.gz', 'doc.html.bz2', 'doc.html.gz', 'doc.html.xz']
+        assert [os.path.basename(path) for path in iterate_files([os.path.join(tmpdir, '**', '*.gz'), os.path.join(tmpdir, 'missing')])] == ['broken.html.gz', 'doc.html.gz']
+        # workers reading the files
+        assert run_task({'path': os.path.join(tmpdir, 'sub', 'doc.html.gz'), 'id': 1}) == {'date': '2016-03-12', 'stage': 'expression:0', 'id': 1, 'path': os.path.join(tmpdir, 'sub', 'doc.html.gz')}
+        assert run_task({'path': os.path.join(tmpdir, 'empty.html')})['error'] == 'unreadable file'
+        args = argparse.Namespace(input_dir=[tmpdir], pattern=None, fast=True, original=False, mode='full', workers=1)
+        output = StringIO()
+        process_files(args, output)
+        results = dict(line.split('\t') for line in output.getvalue().splitlines())
+        assert len(results) == 8
+        assert results[os.path.join(tmpdir, 'sub', 'subsub', 'doc.html.xz')] == '2016-03-12'
+        assert results[os.path.join(tmpdir, 'sub', 'broken.html.gz')] == 'None'
+    # zstd, several frames
+    if zstandard is not None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            compressor = zstandard.ZstdCompressor()
+            filename = os.path.join(tmpdir, 'doc.html.zst')
+            with open(filename, 'wb') as outputfile:
+                outputfile.write(compressor.compress(('<html><body>' + ' ' * 500000).encode('utf-8')))
+                outputfile.write(compressor.compress(htmldoc[12:].encode('utf-8')))
+            assert load_file(filename) == '<html><body>' + ' ' * 500000 + htmldoc[12:]
+            assert load_file(filename, maxsize=500020) is None
+            assert run_task({'path': filename})['date'] == '2016-03-12'
+    if hasattr(gc, 'unfreeze'):
+        gc.unfreeze()
+
+
+def test_budget():
+    '''test the time budget'''
+    htmldoc = '<html><head><meta name="date" content="2017-09-01"/></head><body><p>Copyright 2016</p></body></html>'
+    assert find_date(htmldoc, budget_ms=0, details=True) == {'date': '2017-09-01', 'stage': 'header', 'truncated': True}
+    htmldoc = '<html><body><p>Copyright 2016</p></body></html>'
+    assert find_date(htmldoc, budget_ms=0, details=True) == {'date': None, 'stage': None, 'truncated': True}
+    assert find_date(htmldoc, budget_ms=10000, details=True) == {'date': '2016-01-01', 'stage': 'search_page', 'truncated': False}
+    assert find_date(htmldoc, budget_ms=0, url='https://example.org/2016/05/test', details=True)['date'] == '2016-05-01'
+    # dateparser skipped
+    assert try_ymd_date('12 октября 2017', OUTPUTFORMAT, True) == '2017-10-12'
+    assert try_ymd_date('12 октября 2017', OUTPUTFORMAT, True, deadline=0) is None
+    # results cut short are not cached
+    cache = ResultCache()
+    assert find_date(htmldoc, budget_ms=0, cache=cache) is None
+    assert len(cache) == 0
+
+
+def test_modes():
+    '''test the extraction tiers'''
+    htmldoc = '<html><head><meta name="date" content="2017-09-01"/><link rel="canonical" href="https://example.org/2016/05/test"/></head><body><p class="date">12. Juli 2015</p></body></html>'
+    assert find_date(htmldoc, mode='url', details=True) == {'date': '2016-05-01', 'stage': 'partial_url'}
+    assert find_date(htmldoc, mode='header', details=True) == {'date': '2017-09-01', 'stage': 'header'}
+    htmldoc = '<html><body><p class="date">12. Juli 2015</p><p>"datePublished":"2014-03-01"</p><p>Copyright 2013</p></body></html>'
+    assert find_date(htmldoc, mode='header') is None
+    assert find_date(htmldoc, mode='structural', details=True) == {'date': '2015-07-12', 'stage': 'expression:0'}
+    htmldoc = '<html><body><p>"datePublished":"2014-03-01"</p><p>Copyright 2013</p></body></html>'
+    assert find_date(htmldoc, mode='structural') is None
+    assert find_date(htmldoc, mode='patterns', details=True) == {'date': '2014-03-01', 'stage': 'json'}
+    htmldoc = '<html><body><p>Copyright 2013</p></body></html>'
+    assert find_date(htmldoc, mode='patterns') is None
+    assert find_date(htmldoc, mode='full') == '2013-01-01'
+    assert find_date(htmldoc, mode='full', extensive_search=False) is None
+    assert find_date(htmldoc, mode='unknown') is None
+    # tiers are part of the cache key
+    cache = ResultCache()
+    assert find_date(htmldoc, mode='patterns', cache=cache) is None
+    assert find_date(htmldoc, cache=cache) == '2013-01-01'
+
+
+def test_adaptive():
+    '''test the adaptive ordering of the rules'''
+    controller = AdaptiveController(len(DATE_EXPRESSIONS), min_samples=5, exploration=0, seed=1)
+    assert controller.order() == list(range(len(DATE_EXPRESSIONS)))
+    # rules without yield are skipped
+    for _ in range(5):
+        assert find_date('<html><body><p>Hello</p></body></html>', controller=controller) is None
+    assert controller.order() == []
+    assert all(rule['skipped'] is True for rule in controller.stats()['rules'])
+    # results depending on the order of the rules are not cached
+    cache = ResultCache()
+    htmldoc = '<html><body><p class="meta">12. Juli 2016</p></body></html>'
+    assert find_date(htmldoc, controller=controller, cache=cache, details=True) == {'date': '2016-01-01', 'stage': 'search_page'}
+    assert find_date(htmldoc, cache=cache, details=True) == {'date': '2016-07-12', 'stage': 'expression:5'}
+    assert find_date(htmldoc, controller=controller, cache=cache) == '2016-01-01'
+    assert cache.stats()['hits'] == 0
+    # rules with yield come first
+    controller = AdaptiveController(len(DATE_EXPRESSIONS), min_samples=5, exploration=0, seed=1)
+    for _ in range(5):
+        assert find_date('<html><body><p class="meta">12. Juli 2016</p></body></html>', controller=controller, details=True) == {'date': '2016-07-12', 'stage': 'expression:5'}
+    assert controller.order() == list(range(5, len(DATE_EXPRESSIONS)))
+    assert find_date('<html><body><p class="meta">12. Juli 2016</p></body></html>', controller=controller) == '2016-07-12'
+    stats = controller.stats()
+    assert stats['documents'] == 7 and stats['explorations'] == 0
+    assert stats['rules'][5]['hit_rate'] == 1.0 and stats['rules'][5]['samples'] == 6
+    assert stats['rules'][0]['skipped'] is True and stats['rules'][0]['samples'] == 5
+    # exploration
+    controller = AdaptiveController(len(DATE_EXPRESSIONS), min_samples=5, exploration=1, seed=1)
+    for _ in range(5):
+        find_date('<html><body><p>Hello</p></body></html>', controller=controller)
+    assert controller.order() == list(range(len(DATE_EXPRESSIONS)))
+    # deterministic under a fixed seed
+    first = AdaptiveController(3, min_samples=0, exploration=0.5, seed=42)
+    second = AdaptiveController(3, min_samples=0, exploration=0.5, seed=42)
+    for controller in (first, second):
+        controller.record(2, True, 0.0001)
+    assert [first.order() for _ in range(20)] == [second.order() for _ in range(20)]
+    # bounded window
+    controller = AdaptiveController(1, window=10)
+    for _ in range(25):
+        controller.record(0, True, 0.001)
+    assert controller.stats()['rules'][0]['samples'] == 10
+
+
+def test_profiles():
+    '''test the per-domain profiles'''
+    profiles = ProfileSet({
+        'example.org': [
+            {'xpath': '//span[@class="pubdate"]', 'format': '%d/%m/%Y'},
+            {'xpath': '//time[@itemprop="datePublished"]', 'attribute': 'datetime'},
+        ],
+        '*.example.net': {'rules': ['//meta[@name="issued"]/@content']},
+    })
+    assert len(profiles) == 2
+    assert profiles.select('https://www.example.org/article').host == 'example.org'
+    assert profiles.select('https://news.example.net/article').host == '*.example.net'
+    assert profiles.select('https://example.com/article') is None
+    htmldoc = '<html><head><link rel="canonical" href="https://example.org/article"/><meta name="date" content="2017-09-01"/></head><body><span class="pubdate">03/02/2016</span></body></html>'
+    assert find_date(htmldoc, profiles=profiles, details=True) == {'date': '2016-02-03', 'stage': 'profile'}
+    assert find_date(htmldoc, profiles=profiles, outputformat='%d %B %Y') == '03 February 2016'
+    assert find_date(htmldoc, details=True) == {'date': '2017-09-01', 'stage': 'header'}
+    # second rule, fallback on the generic cascade
+    htmldoc = '<html><body><time itemprop="datePublished" datetime="2016-02-03T10:00:00">Yesterday</time><p class="date">12. Juli 2015</p></body></html>'
+    assert find_date(htmldoc, profiles=profiles, url='https://example.org/article') == '2016-02-03'
+    assert find_date(htmldoc, profiles=profiles, url='https://example.com/article') == '2015-07-12'
+    # huge nodes: only the beginning of the text is collected
+    htmldoc = '<html><body><div class="published">2016-02-03 <b>' + 'text ' * 200000 + '</b></div></body></html>'
+    assert find_date(htmldoc, profiles=ProfileSet({'example.org': ['//div[@class="published"]']}), url='https://example.org/article', details=True) == {'date': '2016-02-03', 'stage': 'profile'}
+    assert find_date('<html><head><meta name="issued" content="2014-05-06"/></head></html>', profiles=profiles, url='https://a.example.net/', details=True)['stage'] == 'profile'
+    try:
+        ProfileSet({'example.org': ['//span[']})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('invalid xpath')
+    # profile file and validation
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, 'sample.html'), 'w', encoding='utf-8') as samplefile:
+            samplefile.write('<html><body><span class="pubdate">03/02/2016</span></body></html>')
+        with open(os.path.join(tmpdir, 'profiles.json'), 'w', encoding='utf-8') as profilefile:
+            json.dump({'example.org': {
+                'rules': [{'xpath': '//span[@class="pubdate"]', 'format': '%d/%m/%Y'}],
+                'samples': [{'file': 'sample.html', 'date': '2016-02-03'}, {'file': 'sample.html', 'date': '2016-03-02'}],
+            }}, profilefile)
+        profiles = load_profiles(os.path.join(tmpdir, 'profiles.json'))
+        reports = list(validate_profiles(profiles, tmpdir))
+        assert [report['ok'] for report in reports] == [True, False]
+        assert reports[0]['rule'] == 0 and reports[1]['date'] == '2016-02-03'
+        try:
+            profiles_main([os.path.join(tmpdir, 'profiles.json')])
+        except SystemExit as err:
+            assert err.code == 1
+        else:
+            raise AssertionError('failed sample')
+        # unquoted dates in YAML
+        if yaml is not None:
+            with open(os.path.join(tmpdir, 'profiles.yml'), 'w', encoding='utf-8') as profilefile:
+                profilefile.write('example.org:\n  rules:\n    - xpath: //span[@class="pubdate"]\n      format: "%d/%m/%Y"\n  samples:\n    - file: sample.html\n      date: 2016-02-03\n')
+            reports = list(validate_profiles(load_profiles(os.path.join(tmpdir, 'profiles.yml')), tmpdir))
+            assert [(report['ok'], report['expected']) for report in reports] == [(True, '2016-02-03')]
+    try:
+        ProfileSet({'example.org': {'rules': ['//time/@datetime'], 'samples': [{'date': '2016-02-03'}]}})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('sample without file or url')
+
+
+def test_tracing():
+    '''test the decision trace'''
+    htmldoc = '<html><head><meta name="date" content="unknown"/></head><body><p class="date">Hello</p><p class="date">No. 123</p><p class="date">12. Juli 2016</p></body></html>'
+    tracer = Tracer()
+    assert find_date(htmldoc, tracer=tracer) == '2016-07-12'
+    assert [(event['stage'], event['reason']) for event in tracer.events] == [
+        ('header', 'unparsed'), ('expression:0', 'text too short'), ('expression:0', 'not enough digits'),
+        ('expression:0', None), ('result', None)
+    ]
+    assert tracer.events[0]['element'] == '<meta name="date" content="unknown">'
+    assert tracer.events[3]['rule'] == DATE_EXPRESSIONS[0] and tracer.events[3]['result'] == '2016-07-12'
+    assert tracer.explain().splitlines()[-1] == "result 'expression:0' -> 2016-07-12"
+    # cache bypassed
+    cache = ResultCache()
+    find_date(htmldoc, cache=cache)
+    tracer = Tracer()
+    assert find_date(htmldoc, cache=cache, tracer=tracer, details=True)['stage'] == 'expression:0'
+    assert len(tracer.events) == 5
+    # no generic result for profile-driven calls
+    profiles = ProfileSet({'example.org': [{'xpath': '//span[@class="pubdate"]', 'format': '%d/%m/%Y'}]})
+    htmldoc = '<html><head><meta name="date" content="2017-09-01"/></head><body><span class="pubdate">03/02/2016</span></body></html>'
+    assert find_date(htmldoc, url='https://example.org/a', cache=cache) == '2017-09-01'
+    assert find_date(htmldoc, url='https://example.org/a', cache=cache, profiles=profiles, details=True) == {'date': '2016-02-03', 'stage': 'profile'}
+
+
+def test_scoring():
+    '''test the scoring of the candidates'''
+    # single pass equivalent to the expressions
+    for url in ('https://www.befifty.de/home/2017/7/12/unter-uns-montauk', 'http://www.hundeverein-querfurt.de/index.php?option=com_content&view=article&id=54&Itemid=50', 'https://www.facebook.com/visitaustria/'):
+        tree = load_html(load_mock_page(url))
+        assert match_expressions(tree) == [tree.xpath(expression) for expression in DATE_EXPRESSIONS]
+    scorer = CandidateScorer()
+    htmldoc = '<html><head><meta name="date" content="2017-09-01"/></head><body><p class="date">1. September 2017</p><time datetime="2016-02-03">3 Feb</time></body></html>'
+    # the date in the URL is enough, the document is not parsed
+    result = find_date(htmldoc, scorer=scorer, details=True, url='https://example.org/2017/09/01/article')
+    assert result['date'] == '2017-09-01' and result['stage'] == 'url' and round(result['confidence'], 3) == 0.9
+    # corroborated by the document above its weight
+    result = find_date(htmldoc, scorer=CandidateScorer(threshold=0.95), details=True, url='https://example.org/2017/09/01/article')
+    assert result['date'] == '2017-09-01' and result['stage'] == 'url' and result['confidence'] > 0.95
+    result = find_date(htmldoc, scorer=scorer, details=True)
+    assert result['date'] == '2017-09-01' and result['stage'] == 'header' and 0.5 < result['confidence'] < 0.95
+    assert find_date(htmldoc, scorer=scorer, outputformat='%d %B %Y') == '01 September 2017'
+    # configurable weights
+    result = find_date(htmldoc, scorer=CandidateScorer(weights={'header': 0, 'expression': 0}), details=True)
+    assert result['date'] == '2016-02-03' and result['stage'] == 'time' and round(result['confidence'], 3) == 0.8
+    # tie: newest or oldest date
+    htmldoc = '<html><body><p class="date">12.03.2015</p><p id="date">14.05.2016</p></body></html>'
+    assert find_date(htmldoc, scorer=scorer, extensive_search=False) == '2016-05-14'
+    assert find_date(htmldoc, scorer=scorer, extensive_search=False, original_date=True) == '2015-03-12'
+    # expensive stages below the threshold, within the extraction tier
+    htmldoc = '<html><body><p class="date">Hello</p><script>{"datePublished":"2015-03-04"}</script></body></html>'
+    result = find_date(htmldoc, scorer=scorer, details=True)
+    assert result['date'] == '2015-03-04' and result['stage'] == 'json' and round(result['confidence'], 3) == 0.8
+    assert find_date(htmldoc, scorer=scorer, details=True, mode='structural') == {'date': None, 'stage': None, 'confidence': 0.0}
+    tracer = Tracer()
+    find_date(htmldoc, scorer=scorer, tracer=tracer)
+    assert [event['stage'] for event in tracer.events] == ['scoring', 'scoring', 'scoring', 'result']
+    # table and scores
+    table = CandidateTable()
+    table.add('2016-07-12', 'expression', 3, 1)
+    table.add('2016-07-12', 'expression', 3, 0)
+    table.add('2015-01-01', 'header')
+    assert len(table) == 2 and list(table.frequencies) == [2, 1] and list(table.positions) == [0, 0]
+    best, confidence = scorer.score(table)
+    assert best == datetime.date(2015, 1, 1).toordinal() and 0 < confidence < 0.9
+    assert scorer.score(CandidateTable()) == (None, 0.0)
+    # same scores with and without NumPy
+    for i in range(100):
+        table.add(datetime.date.fromordinal(735000 + i * 7 % 60).isoformat(), 'expression', i % len(DATE_EXPRESSIONS), i % 3)
+    for original_date in (False, True):
+        first = scorer.score(table, original_date)
+        second = CandidateScorer(vectorized=False).score(table, original_date)
+        assert first[0] == second[0] and abs(first[1] - second[1]) < 1e-9
+
+
+def test_lazy_document():
+    '''test the lazy views on the document'''
+    htmldoc = '<html><head><meta name="date" content="2017-09-01"/></head><body><p>Hello</p></body></html>'
+    document = Document(htmldoc)
+    assert document.cache == {}
+    assert find_date(document, url='https://example.org/2019/01/03/article.html', details=True) == {'date': '2019-01-03', 'stage': 'url'}
+    assert document.cache == {}
+    assert find_date(document, url='https://example.org/2019/01/article.html', mode='url') == '2019-01-01'
+    assert document.cache == {}
+    # same with the scorer
+    result = find_date(document, url='https://example.org/2019/01/03/article.html', details=True, scorer=CandidateScorer())
+    assert result['date'] == '2019-01-03' and result['stage'] == 'url' and result['confidence'] >= 0.5
+    assert document.cache == {}
+    # views built on demand and kept
+    assert find_date(document, url='https://example.org/article.html', mode='header') == '2017-09-01'
+    assert sorted(document.cache) == ['language', 'meta', 'tree']
+    tree = document.tree
+    assert find_date(document) == '2017-09-01' and document.tree is tree
+    document = Document('<html><body><p>Datum: 12.07.2016</p></body></html>')
+    assert find_date(document, details=True) == {'date': '2016-07-12', 'stage': 'german'}
+    assert 'Datum: 12.07.2016' in document.htmlstring and document.cleaned is document.cache['cleaned']
+    # profiles of the host come before the URL
+    profiles = ProfileSet({'example.org': ['//span[@class="pubdate"]']})
+    htmldoc = '<html><body><span class="pubdate">2016-02-03</span></body></html>'
+    assert find_date(htmldoc, url='https://example.org/2019/01/03/article.html', profiles=profiles) == '2016-02-03'
+    assert find_date(htmldoc, url='https://example.com/2019/01/03/article.html', profiles=profiles) == '2019-01-03'
+
+
+def test_cache():
+    '''test the result cache'''
+    htmldoc = '<html><body><span class="entry-date">12. Juli 2016</span></body></html>'
+    cache = ResultCache(backend=DictBackend(), maxsize=10)
+    assert find_date(htmldoc, cache=cache) == '2016-07-12'
+    assert find_date(htmldoc, cache=cache) == '2016-07-12'
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    # options are part of the key
+    assert find_date(htmldoc, outputformat='%d %B %Y', cache=cache) == '12 July 2016'
+    assert find_date('<html><body>No date.</body></html>', cache=cache) is None
+    assert find_date('<html><body>No date.</body></html>', cache=cache) is None
+    assert cache.stats()['hits'] == 2 and len(cache) == 3
+    # trees and URLs are not cached
+    assert cache.make_key(html.fromstring(htmldoc), True, False, OUTPUTFORMAT, None) is None
+    assert cache.make_key('https://example.org/', True, False, OUTPUTFORMAT, None) is None
+    # eviction
+    for i in range(30):
+        cache.store(str(i), None)
+    cache.evict()
+    assert len(cache) == 10
+    # persistent storage and version change
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'cache.sqlite')
+        with ResultCache(filename) as cache:
+            assert examine(htmldoc, True, cache=cache) == '2016-07-12'
+        with ResultCache(filename) as cache:
+            assert examine(htmldoc, True, cache=cache) == '2016-07-12'
+            assert cache.stats()['hit_rate'] == 1.0
+            cache.backend.put(ResultCache.VERSION_KEY, '0.0.1')
+        with ResultCache(filename) as cache:
+            assert len(cache) == 0
+
+
+def test_conditional_requests():
+    '''test the HTTP cache against a local server'''
+    ConditionalHandler.full_responses = 0
+    server = start_server(ConditionalHandler)
+    url = 'http://127.0.0.1:%s/page' % server.server_address[1]
+    args = type('args', (), {'fast': True, 'original': False, 'mode': 'full'})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        httpcache = HTTPCache(os.path.join(tmpdir, 'http.sqlite'))
+        htmltext, modified = fetch_conditional(url, httpcache)
+        assert modified is True and htmltext is not None
+        assert ConditionalHandler.full_responses == 1
+        assert httpcache.get_validators(url) == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Fri, 01 Sep 2017 00:00:00 GMT'}
+        # 304: cached body without download
+        assert fetch_conditional(url, httpcache) == (htmltext, False)
+        assert fetch_url(url, httpcache) == htmltext
+        assert ConditionalHandler.full_responses == 1
+        # dates are reused for the same options only
+        assert examine_url(url, args, httpcache=httpcache) == '2017-09-01'
+        assert httpcache.get_date(url, 'True\tFalse\tfull') == (True, '2017-09-01')
+        assert httpcache.get_date(url, 'False\tFalse\tfull') == (False, None)
+        assert examine_url(url, args, httpcache=httpcache) == '2017-09-01'
+        # pages without validators are not stored
+        noval = 'http://127.0.0.1:%s/no-validators' % server.server_address[1]
+        assert fetch_conditional(noval, httpcache)[1] is True
+        assert httpcache.get_validators(noval) == {}
+        httpcache.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_resumable_job():
+    '''test checkpointed batch processing'''
+    bloom = BloomFilter(1000)
+    bloom.add(url_hash('https://example.org/1'))
+    assert url_hash('https://example.org/1') in bloom
+    assert url_hash('https://example.org/2') not in bloom
+    urls = ['https://example.org/%s' % i for i in range(10)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfile = os.path.join(tmpdir, 'urls.txt')
+        jobdir = os.path.join(tmpdir, 'job')
+        with open(inputfile, 'w', encoding='utf-8') as outputf:
+            outputf.write('\n'.join(urls[:5] + urls[:2] + urls[5:]) + '\n')
+        # simulated interruption after 4 URLs
+        def interrupted(url):
+            if url == urls[4]:
+                raise KeyboardInterrupt
+            return '2017-09-01'
+        output = StringIO()
+        try:
+            run_job(inputfile, jobdir, interrupted, output)
+        except KeyboardInterrupt:
+            pass
+        assert output.getvalue().count('\n') == 4
+        # resume: done and duplicate URLs are skipped
+        output = StringIO()
+        assert run_job(inputfile, jobdir, lambda url: None, output) == 6
+        assert output.getvalue().split('\n')[0] == urls[4] + '\tNone'
+        assert run_job(inputfile, jobdir, lambda url: None, output) == 0
+        # incomplete record is ignored
+        with open(os.path.join(jobdir, 'progress.log'), 'a', encoding='utf-8') as logfile:
+            logfile.write('123')
+        assert run_job(inputfile, jobdir, lambda url: None, StringIO()) == 0
+        with open(os.path.join(jobdir, 'progress.log'), 'r', encoding='utf-8') as logfile:
+            assert logfile.read().endswith('\n')
+        # short URLs: the seen-set is sized on the number of lines, none is wrongly skipped
+        with open(inputfile, 'w', encoding='utf-8') as outputf:
+            outputf.write(''.join('http://a/%s\n' % i for i in range(20000)))
+        assert count_lines(inputfile) == 20001
+        assert run_job(inputfile, os.path.join(tmpdir, 'short'), lambda url: None, StringIO()) == 20000
+
+
+def test_sharding():
+    '''test deterministic sharding and merge step'''
+    assert parse_shard('2/8') == (2, 8)
+    for spec in ('8/8', '-1/8', '1/0', 'x'):
+        try:
+            parse_shard(spec)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(spec)
+    # same host, same shard
+    urls = ['https://host%s.example.org/page/%s' % (i % 7, i) for i in range(70)]
+    assert host_shard('https://example.org/a', 4) == host_shard('http://example.org:8080/b?c', 4)
+    shards = [[url for url in urls if in_shard(url, (i, 3))] for i in range(3)]
+    assert sum(len(shard) for shard in shards) == len(urls)
+    assert in_shard(urls[0], None) is True
+    # merge TSV and JSON lines, prefer dated duplicates
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first, second = os.path.join(tmpdir, '0.tsv'), os.path.join(tmpdir, '1.jsonl')
+        with open(first, 'w', encoding='utf-8') as outputf:
+            outputf.write('https://b.org/\t2017-09-01\nhttps://a.org/\tNone\n')
+        with open(second, 'w', encoding='utf-8') as outputf:
+            outputf.write('{"url": "https://a.org/", "date": "2018-01-01"}\n{"url": "https://c.org/", "date": null}\n')
+        output = StringIO()
+        stats = merge_results([first, second], output)
+        assert output.getvalue() == 'https://a.org/\t2018-01-01\nhttps://b.org/\t2017-09-01\nhttps://c.org/\tNone\n'
+        assert stats['records'] == 4 and stats['urls'] == 3 and stats['dated'] == 2
+        output = StringIO()
+        merge_results([first], output, 'jsonl')
+        assert output.getvalue().startswith('{"url": "https://a.org/", "date": null}')
+
+
+def test_scheduler():
+    '''test per-host politeness against several local servers'''
+    handlers = [make_host_handler(0.05), make_host_handler(0.05), make_host_handler(0.3)]
+    servers = [start_server(handler, ThreadingServer) for handler in handlers]
+    prefixes = ['http://127.0.0.1:%s' % server.server_address[1] for server in servers]
+    # URL list sorted by host
+    urls = [prefix + '/page/' + str(i) for prefix in prefixes for i in range(4)]
+    scheduler = HostScheduler(workers=4, per_host=1, delay=0.1)
+    results = list(scheduler.fetch_all(urls))
+    assert sorted(url for url, _ in results) == sorted(urls)
+    assert all(htmltext is not None for _, htmltext in results)
+    for handler in handlers:
+        assert handler.max_active == 1
+        assert all(second - first >= 0.1 for first, second in zip(handler.times, handler.times[1:]))
+    # round-robin: the last host does not wait for the others
+    assert min(handlers[2].times) - min(handlers[0].times) < 0.1
+    stats = scheduler.stats()
+    assert stats[prefixes[2][7:]]['latency'] > stats[prefixes[0][7:]]['latency']
+    # failing hosts are abandoned
+    scheduler = HostScheduler(workers=2, delay=0, max_errors=2)
+    results = list(scheduler.fetch_all([prefixes[0] + '/error'] * 5 + [prefixes[1] + '/page']))
+    assert len(results) == 6
+    assert scheduler.stats()[prefixes[0][7:]]['requests'] == 2
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_aio():
+    '''test asynchronous download and extraction'''
+    if sys.version_info < (3, 7):
+        return
+    server = start_server(ConditionalHandler, ThreadingServer)
+    prefix = 'http://127.0.0.1:%s/' % server.server_address[1]
+    htmldoc = '<html><body><span class="entry-date">12. Juli 2016</span></body></html>'
+
+    async def run():
+        assert await find_date_async(htmldoc) == '2016-07-12'
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            assert await find_date_async(htmldoc, executor, outputformat='%d %B %Y') == '12 July 2016'
+            htmltext = await fetch_url_async(prefix + 'page')
+            assert htmltext is not None and await find_date_async(htmltext, executor) == '2017-09-01'
+            assert await fetch_url_async('http://127.0.0.1:1/') is None
+            # connections reused across calls
+            session = SHARED['session']
+            assert session is not None and await fetch_url_async(prefix + 'page') == htmltext and SHARED['session'] is session
+            await close_shared_session()
+            assert session.closed and SHARED['session'] is None
+            urls = [prefix + str(i) for i in range(10)] + ['http://127.0.0.1:1/']
+            results = []
+            async for result in iterate_dates(urls, concurrency=3, executor=executor):
+                results.append(result)
+        return results
+
+    results = asyncio.get_event_loop().run_until_complete(run())
+    assert sorted(results) == sorted([(prefix + str(i), '2017-09-01') for i in range(10)] + [('http://127.0.0.1:1/', None)])
+    # session left open by a previous event loop
+    assert asyncio.run(fetch_url_async(prefix + 'page')) is not None
+    session = SHARED['session']
+    assert asyncio.run(fetch_url_async(prefix + 'page')) is not None
+    assert session.closed and SHARED['session'] is not session
+    asyncio.run(close_shared_session())
+    server.shutdown()
+    server.server_close()
+
+
+def test_warmup():
+    '''test the warm-up before forking'''
+    warmup(languages=['de'])
+    assert find_date('<html><body><p class="date">12. Juli 2016</p></body></html>') == '2016-07-12'
+    assert all(expression in XPATHS for expression in DATE_EXPRESSIONS)
+    # the warm-up documents are not counted
+    METRICS.enable()
+    try:
+        warmup()
+        assert METRICS.render() == '\n'
+    finally:
+        METRICS.disable()
+    if hasattr(gc, 'freeze'):
+        warmup(freeze=True)
+        try:
+            assert gc.get_freeze_count() > 0
+        finally:
+            gc.unfreeze()
+
+
+def test_metrics():
+    '''test the counters and histograms'''
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.inc('test_total', stage='url')
+    registry.inc('test_total', 2, stage='url')
+    registry.observe('test_seconds', 0.5)
+    registry.observe('test_seconds', 0.1)
+    assert registry.value('test_total', stage='url') == 3
+    rendered = registry.render()
+    assert '# TYPE test_total counter\ntest_total{stage="url"} 3\n' in rendered
+    assert 'test_seconds_bucket{le="0.1"} 1\ntest_seconds_bucket{le="1.0"} 2\ntest_seconds_bucket{le="+Inf"} 2\n' in rendered
+    assert 'test_seconds_sum 0.6\ntest_seconds_count 2\n' in rendered
+    # hand-over between processes
+    other = MetricsRegistry(buckets=(0.1, 1.0))
+    other.merge(registry.drain())
+    other.merge({'counters': {('test_total', (('stage', 'url'),)): 1}, 'histograms': {}})
+    assert registry.value('test_total', stage='url') == 0 and other.value('test_total', stage='url') == 4
+    assert 'test_seconds_count 2' in other.render()
+    # muted in the current thread only
+    METRICS.enable()
+    METRICS.mute()
+    find_date('<html><body><p class="date">12. Juli 2016</p></body></html>')
+    thread = threading.Thread(target=find_date, args=('<html><body><p class="date">12. Juli 2016</p></body></html>',))
+    thread.start()
+    thread.join()
+    METRICS.mute(False)
+    assert METRICS.value('htmldate_documents_total', stage='expression:0') == 1
+    METRICS.disable()
+    # extraction, disabled by default
+    METRICS.reset()
+    find_date('<html><body><p class="date">12. Juli 2016</p></body></html>')
+    assert METRICS.render() == '\n'
+    METRICS.enable()
+    try:
+        find_date('<html><body><p class="date">12. Juli 2016</p></body></html>')
+        find_date('<html><body>Nothing here.</body></html>', extensive_search=False)
+        assert METRICS.value('htmldate_documents_total', stage='expression:0') == 1
+        assert METRICS.value('htmldate_documents_total', stage='none') == 1
+        assert METRICS.value('htmldate_parsed_bytes_total') > 0
+        assert METRICS.value('htmldate_parser_calls_total', parser='custom') >= 1
+        assert 'htmldate_extraction_seconds_count 2' in METRICS.render()
+        cache = ResultCache(':memory:')
+        find_date('<html><body><p class="date">12. Juli 2016</p></body></html>', cache=cache)
+        find_date('<html><body><p class="date">12. Juli 2016</p></body></html>', cache=cache)
+        assert METRICS.value('htmldate_cache_lookups_total', result='hit') == 1
+        assert METRICS.value('htmldate_documents_total', stage='cache') == 1
+        cache.close()
+        # download errors
+        assert fetch_url('xyz') is None
+        assert METRICS.value('htmldate_fetch_errors_total', type='malformed_url') == 1
+        # results of a worker
+        result = run_task({'html': '<html><body><p class="date">12. Juli 2016</p></body></html>', 'id': 1})
+        assert 'metrics' in result and METRICS.value('htmldate_documents_total', stage='expression:0') == 0
+        assert collect_metrics(result) == {'date': '2016-07-12', 'stage': 'expression:0', 'id': 1}
+        assert METRICS.value('htmldate_documents_total', stage='expression:0') == 3
+        # endpoint
+        server = start_metrics_server(port=0)
+        response = requests.get('http://127.0.0.1:%s/metrics' % server.server_port)
+        assert response.status_code == 200 and response.headers['Content-Type'].startswith('text/plain')
+        assert 'htmldate_documents_total{stage="none"} 1' in response.text
+        assert requests.get('http://127.0.0.1:%s/other' % server.server_port).status_code == 404
+        server.shutdown()
+        server.server_close()
+        # file written on exit
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'htmldate.prom')
+            METRICS.write(filename)
+            with open(filename, 'r', encoding='utf-8') as inputfile:
+                assert inputfile.read() == METRICS.render()
+    finally:
+        METRICS.disable()
+        METRICS.reset()
+
+
+def test_profiling():
+    '''test the profiling hooks and the replay of slow documents'''
+    htmldoc = '<html><body><p class="date">12. Juli 2016</p></body></html>'
+    try:
+        Profiler('unknown')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('unknown method accepted')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # every document is slow enough
+        profiler = Profiler('cprofile', threshold_ms=0, capture_dir=tmpdir)
+        assert find_date(htmldoc, profiler=profiler) == '2016-07-12'
+        assert find_date(htmldoc, url='https://example.org/2017/09/01/', details=True, profiler=profiler) == {'date': '2017-09-01', 'stage': 'url'}
+        assert profiler.documents == 2 and len(profiler.captured) == 2
+        report = profiler.report()
+        assert report.startswith('# 2 documents') and 'https://example.org/2017/09/01/' in report and 'examine_document' in report
+        profiler.dump_stats(os.path.join(tmpdir, 'stats.prof'))
+        # saved with the options
+        captures = list(iterate_captures(tmpdir))
+        assert len(captures) == 2
+        options = [metadata['options'] for _, _, metadata in captures]
+        assert {'extensive_search': True, 'original_date': False, 'outputformat': '%Y-%m-%d', 'url': 'https://example.org/2017/09/01/', 'details': True, 'budget_ms': None, 'mode': 'full'} in options
+        assert all(htmlstring == htmldoc for _, htmlstring, _ in captures)
+        # replay
+        results = sorted(str(result) for _, _, _, result in replay(tmpdir))
+        assert results == ['2016-07-12', "{'date': '2017-09-01', 'stage': 'url'}"]
+        profiler = Profiler('sampling', interval=0.0001)
+        for filename, captured, duration, result in replay(tmpdir, profiler):
+            assert filename.endswith('.html') and captured > 0 and duration > 0
+        assert profiler.documents == 2 and profiler.captured == []
+        assert 'samples every' in profiler.report()
+    # concurrent documents are all counted
+    profiler = Profiler(None, slowest=5)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: profiler.record('', {}, i / 1000), range(400)))
+    assert profiler.documents == 400 and sorted(profiler.ranking, reverse=True)[0][0] == 0.399
+    assert len(profiler.ranking) == 5 and min(profiler.ranking) == profiler.ranking[0]
+    # pages given as URL are captured once downloaded
+    server = start_server(ConditionalHandler)
+    url = 'http://127.0.0.1:%s/page' % server.server_address[1]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profiler = Profiler(None, threshold_ms=0, capture_dir=tmpdir)
+        assert find_date(url, profiler=profiler) == '2017-09-01'
+        assert find_date('http://127.0.0.1:1/', profiler=profiler, details=True) == {'date': None, 'stage': None}
+        captures = list(iterate_captures(tmpdir))
+        assert len(captures) == 1 and captures[0][1] == ConditionalHandler.body.decode('utf-8') and captures[0][2]['source'] == url
+        assert [result for _, _, _, result in replay(tmpdir)] == ['2017-09-01']
+    server.shutdown()
+    server.server_close()
+    # timing only, nothing saved below the threshold
+    profiler = Profiler(None, threshold_ms=60000, capture_dir='/nonexistent')
+    assert run_task({'html': htmldoc, 'path': 'doc.html'}, profiler)['date'] == '2016-07-12'
+    assert profiler.captured == [] and 'doc.html' in profiler.report()
+
+
+def test_server():
+    '''test the extraction server on localhost'''
+    server = ExtractionServer(('127.0.0.1', 0), workers=1, metrics=True)
+    # forked workers are not warmed up a second time
+    if multiprocessing.get_start_method() == 'fork':
+        assert server.pool._initializer is None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    prefix = 'http://127.0.0.1:%s' % server.server_address[1]
+    htmldoc = '<html><body><span class="entry-date">12. Juli 2016</span></body></html>'
+    assert requests.get(prefix + '/health').json() == {'status': 'ok'}
+    # single documents as text or bytes
+    response = requests.post(prefix + '/date', data=htmldoc.encode('utf-8'), headers={'Content-Type': 'text/html; charset=utf-8'})
+    assert response.json() == {'date': '2016-07-12', 'stage': 'expression:0'}
+    response = requests.post(prefix + '/date?format=%25d%20%25B%20%25Y&url=https://example.org/2017/09/01/', data=htmldoc)
+    assert response.json() == {'date': '01 September 2017', 'stage': 'url', 'url': 'https://example.org/2017/09/01/'}
+    response = requests.post(prefix + '/date', json={'html': htmldoc, 'id': 1})
+    assert response.json()['id'] == 1
+    # batch
+    batch = [htmldoc, {'html': '<html><body>Nothing here.</body></html>', 'id': 'x'}, {'html': htmldoc, 'original_date': True}]
+    results = requests.post(prefix + '/batch?fast=1', data=json.dumps(batch)).json()
+    assert [result['date'] for result in results] == ['2016-07-12', None, '2016-07-12']
+    assert results[1]['id'] == 'x'
+    # errors and statistics
+    assert requests.post(prefix + '/batch', data='[{"url": "x"}]').status_code == 400
+    assert requests.post(prefix + '/unknown', data='').status_code == 404
+    for length in ('-1', 'x'):
+        connection = socket.create_connection(server.server_address, timeout=5)
+        connection.sendall(('POST /date HTTP/1.1\r\nHost: localhost\r\nContent-Length: %s\r\n\r\n' % length).encode('ascii'))
+        assert connection.recv(1024).startswith(b'HTTP/1.0 400')
+        connection.close()
+    stats = requests.get(prefix + '/stats').json()
+    assert stats['documents'] == 6 and stats['dated'] == 5 and stats['stages']['url'] == 1
+    # metrics recorded in the workers
+    response = requests.get(prefix + '/metrics')
+    assert response.status_code == 200 and 'htmldate_documents_total{stage="url"} 1' in response.text
+    server.shutdown()
+    server.server_close()
+    assert METRICS.enabled is False
+
+
+def pathological_task(task):
+    '''simulate slow documents'''
+    if task.get('sleep'):
+        time.sleep(task['sleep'])
+    if task.get('spin'):
+        while True:
+            pass
+    return run_task(task)
+
+
+def test_supervised_pool():
+    '''test per-document limits and worker recycling'''
+    htmldoc = '<html><body><span class="entry-date">12. Juli 2016</span></body></html>'
+    tasks = [{'html': htmldoc, 'url': 'https://example.org/' + str(i)} for i in range(5)]
+    tasks[1]['sleep'] = 30
+    tasks[3]['spin'] = True
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report = os.path.join(tmpdir, 'timeouts.jsonl')
+        with SupervisedPool(workers=2, time_limit=1, cpu_limit=0.3, max_tasks=2, function=pathological_task, report=report) as pool:
+            start = time.time()
+            results = pool.map(tasks)
+            assert time.time() - start < 10
+            assert [result['date'] for result in results] == ['2016-07-12', None, '2016-07-12', None, '2016-07-12']
+            assert results[1]['error'] == 'time limit' and results[1]['url'] == 'https://example.org/1'
+            assert results[3]['error'] == 'cpu time limit'
+            assert sorted(pool.timeouts) == [1, 3]
+            assert pool.recycled >= 2
+            # the pool is still usable
+            assert pool.map([{'html': htmldoc}])[0]['date'] == '2016-07-12'
+        with open(report, 'r', encoding='utf-8') as reportfile:
+            assert sorted(json.loads(line)['url'] for line in reportfile) == ['https://example.org/1', 'https://example.org/3']
+
+
 def test_download():
     '''test page download'''
     #assert fetch_url('https://www.iana.org/404') is None
@@ -456,9 +1406,14 @@ if __name__ == '__main__':
 
     # function-level
     test_input()
+    test_bounded_text()
     test_date_validator()
     test_search_pattern()
     test_try_ymd_date()
+    test_multilingual_parse()
+    test_tokenize_date()
+    test_parser_chain()
+    test_document_language()
     test_convert_date()
     test_compare_reference()
     test_candidate_selection()
@@ -476,6 +1431,25 @@ if __name__ == '__main__':
 
     # cli
     test_cli()
+    test_stored_files()
+    test_budget()
+    test_modes()
+    test_adaptive()
+    test_profiles()
+    test_tracing()
+    test_scoring()
+    test_lazy_document()
+    test_cache()
+    test_conditional_requests()
+    test_resumable_job()
+    test_sharding()
+    test_scheduler()
+    test_aio()
+    test_warmup()
+    test_metrics()
+    test_profiling()
+    test_server()
+    test_supervised_pool()
 
     # loading functions
     test_download()